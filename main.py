@@ -2,11 +2,12 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog, colorchooser
 import sounddevice as sd
 from scipy.io.wavfile import write
+from scipy.signal import butter, sosfilt
 import numpy as np
 from datetime import datetime
 import pyautogui
 import cv2
-from PIL import Image, ImageTk, ImageDraw, ImageFont
+from PIL import Image, ImageTk, ImageDraw, ImageFont, ImageColor
 import threading
 import os
 import time
@@ -15,6 +16,22 @@ import json
 import copy
 import argparse
 import re
+import math
+import ctypes
+import functools
+import itertools
+import collections
+import types
+import sys
+import wave
+import heapq
+import shutil
+import hashlib
+import subprocess
+import sqlite3
+import contextlib
+import multiprocessing
+import concurrent.futures
 import mss
 import mss.tools
 from ctypes import cast, POINTER
@@ -34,9 +51,50 @@ except ImportError:
 # Глобальная блокировка для потокобезопасной работы с MSS
 mss_lock = threading.Lock()
 
+# Размеры выходных холстов: предпросмотр имеет то же соотношение сторон, что и запись
+PREVIEW_SIZE = (640, 360)
+RECORD_SIZE = (1920, 1080)
+# Разрешения записи на выбор; RECORD_SIZE - по умолчанию
+RECORD_SIZES = ((1280, 720), (1920, 1080), (2560, 1440), (3840, 2160))
+# Смещения источников задаются в пикселях этого опорного холста
+REFERENCE_SIZE = (1920, 1080)
+
+# Поля сцены с масштабом и смещением для каждого типа источника
+TRANSFORM_FIELDS = {
+    "full_screen": ("screen_scale", "screen_offset_x", "screen_offset_y"),
+    "window": ("window_scale", "window_offset_x", "window_offset_y"),
+    "camera": ("camera_scale", "camera_offset_x", "camera_offset_y"),
+    "media": ("media_scale", "media_offset_x", "media_offset_y"),
+}
+
+# Цепочка обработки звука по умолчанию: срез НЧ, шумовой гейт, компрессор с лимитером
+DEFAULT_AUDIO_DSP = {
+    "highpass": {"enabled": False, "cutoff": 80.0},
+    "gate": {"enabled": False, "threshold_db": -50.0, "attack_ms": 5.0, "release_ms": 150.0},
+    "compressor": {"enabled": False, "threshold_db": -18.0, "ratio": 4.0, "attack_ms": 10.0,
+                   "release_ms": 200.0, "makeup_db": 0.0, "ceiling_db": -1.0},
+}
+
+# Хромакей камеры: цвет фона, допуск по тону (градусы), пороги насыщенности и яркости,
+# ширина мягкого перехода, подрезка и размытие края маски (пиксели камеры), подавление засветки
+DEFAULT_CHROMA_KEY = {"enabled": False, "color": "#00FF00", "tolerance": 40, "min_saturation": 70,
+                      "min_value": 40, "softness": 30, "erode": 1, "feather": 2, "despill": True}
+
+# Цветокоррекция источника: яркость (-100..100), контраст, насыщенность и файл 3D LUT (.cube)
+DEFAULT_COLOR_CORRECTION = {"brightness": 0, "contrast": 1.0, "saturation": 1.0, "lut_path": None}
+
+# Размер предпросмотра, в координатах которого хранились тексты до нормализации
+LEGACY_TEXT_SPACE = (640, 480)
+# Экран, в пикселях которого хранился левый верхний угол захвата экрана до смещений от центра
+LEGACY_SCREEN_SPACE = (1920, 1080)
+
 class TextObject:
-    """Класс для представления текстового объекта"""
-    def __init__(self, text="Новый текст", x=100, y=100, font_size=24, 
+    """Класс для представления текстового объекта.
+
+    x, y - доли ширины и высоты выходного кадра (0..1), font_size - размер
+    в пикселях кадра высотой REFERENCE_SIZE[1].
+    """
+    def __init__(self, text="Новый текст", x=0.1, y=0.1, font_size=48, 
                  font_color="#FFFFFF", font_family="Arial", 
                  background_color=None, background_alpha=0):
         self.text = text
@@ -55,26 +113,70 @@ class TextObject:
             'text': self.text, 'x': self.x, 'y': self.y, 'font_size': self.font_size,
             'font_color': self.font_color, 'font_family': self.font_family,
             'background_color': self.background_color, 'background_alpha': self.background_alpha,
-            'visible': self.visible, 'scale': self.scale
+            'visible': self.visible, 'scale': self.scale, 'coords': 'normalized'
         }
         
     @classmethod
     def from_dict(cls, data):
         text_obj = cls(
-            text=data.get('text', 'Новый текст'), x=data.get('x', 100), y=data.get('y', 100),
-            font_size=data.get('font_size', 24), font_color=data.get('font_color', '#FFFFFF'),
+            text=data.get('text', 'Новый текст'), x=data.get('x', 0.1), y=data.get('y', 0.1),
+            font_size=data.get('font_size', 48), font_color=data.get('font_color', '#FFFFFF'),
             font_family=data.get('font_family', 'Arial'), background_color=data.get('background_color'),
             background_alpha=data.get('background_alpha', 0)
         )
+        if data.get('coords') != 'normalized':
+            # Старые сцены хранили пиксели предпросмотра 640x480
+            text_obj.x = data.get('x', 100) / LEGACY_TEXT_SPACE[0]
+            text_obj.y = data.get('y', 100) / LEGACY_TEXT_SPACE[1]
+            text_obj.font_size = data.get('font_size', 24) * REFERENCE_SIZE[1] / LEGACY_TEXT_SPACE[1]
         text_obj.visible = data.get('visible', True)
         text_obj.scale = data.get('scale', 1.0)
         return text_obj
 
+# Привязки изображений к краям кадра
+IMAGE_ANCHORS = {
+    "top_left": "Слева сверху", "top_right": "Справа сверху",
+    "bottom_left": "Слева снизу", "bottom_right": "Справа снизу", "center": "По центру",
+}
+
+class ImageObject:
+    """Класс для представления изображения (логотипа, водяного знака) поверх кадра.
+
+    width - доля ширины выходного кадра, высота следует пропорциям файла;
+    margin - отступ от края в долях высоты кадра.
+    """
+    def __init__(self, path, anchor="top_right", width=0.15, margin=0.02, opacity=1.0):
+        self.path = path
+        self.anchor = anchor
+        self.width = width
+        self.margin = margin
+        self.opacity = opacity
+        self.visible = True
+
+    def to_dict(self):
+        return {
+            'path': self.path, 'anchor': self.anchor, 'width': self.width,
+            'margin': self.margin, 'opacity': self.opacity, 'visible': self.visible
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        image_obj = cls(
+            path=data['path'], anchor=data.get('anchor', 'top_right'), width=data.get('width', 0.15),
+            margin=data.get('margin', 0.02), opacity=data.get('opacity', 1.0)
+        )
+        image_obj.visible = data.get('visible', True)
+        return image_obj
+
+# Номера сцен: в отличие от id() объекта, не повторяются после удаления сцены
+scene_ids = itertools.count(1)
+
 class Scene:
     """Класс для представления сцены с настройками"""
     def __init__(self, name="Новая сцена"):
+        self.scene_id = next(scene_ids)  # Не сохраняется в файл: ключ кэшей на время работы
         self.name = name
-        self.video_sources = {"full_screen": True, "window": False, "camera": False}
+        self.video_sources = {"full_screen": True, "window": False, "camera": False, "media": False}
         self.selected_window = None
         self.audio_enabled = True
         self.window_info = "Окно не выбрано"
@@ -82,9 +184,12 @@ class Scene:
         self.camera_resolution = "640x480"
         self.layout = "single"
         self.text_objects = []
+        self.image_objects = []
         self.camera_scale = 1.0
         self.camera_offset_x = 0
         self.camera_offset_y = 0
+        self.camera_chroma = copy.deepcopy(DEFAULT_CHROMA_KEY)
+        self.color_correction = {source: dict(DEFAULT_COLOR_CORRECTION) for source in TRANSFORM_FIELDS}
         self.screen_scale = 1.0
         self.screen_offset_x = 0
         self.screen_offset_y = 0
@@ -92,6 +197,20 @@ class Scene:
         self.window_offset_x = 0
         self.window_offset_y = 0
         self.window_rect = None  # Добавляем для хранения координат окна
+        self.show_cursor = True  # Рисовать курсор поверх захвата экрана и окна
+        self.cursor_clicks = False  # Подсвечивать щелчки кольцом
+        self.monitor_mode = "single"  # single / span / subset
+        self.monitor_index = 1  # Номер монитора в нумерации mss (с 1)
+        self.monitor_subset = [1]
+        self.media_path = None  # Видеофайл, изображение или папка с последовательностью кадров
+        self.media_loop = True
+        self.media_scale = 1.0
+        self.media_offset_x = 0
+        self.media_offset_y = 0
+        # Аудиодорожки: первая - микрофон, остальные - дополнительные входы
+        self.audio_tracks = [{"name": "Микрофон", "device": None, "gain": 1.0, "muted": False, "dsp": True}]
+        self.audio_stems = False  # Писать каждую дорожку в отдельный WAV
+        self.audio_dsp = copy.deepcopy(DEFAULT_AUDIO_DSP)  # Для дорожек с "dsp": True
         
     def to_dict(self):
         return {
@@ -99,35 +218,2986 @@ class Scene:
             'window_info': self.window_info, 'camera_index': self.camera_index, 
             'camera_resolution': self.camera_resolution, 'layout': self.layout,
             'text_objects': [text_obj.to_dict() for text_obj in self.text_objects],
+            'image_objects': [image_obj.to_dict() for image_obj in self.image_objects],
             'camera_scale': self.camera_scale, 'camera_offset_x': self.camera_offset_x, 
-            'camera_offset_y': self.camera_offset_y, 'screen_scale': self.screen_scale,
+            'camera_offset_y': self.camera_offset_y, 'camera_chroma': self.camera_chroma,
+            'color_correction': self.color_correction, 'screen_scale': self.screen_scale,
             'screen_offset_x': self.screen_offset_x, 'screen_offset_y': self.screen_offset_y,
             'window_scale': self.window_scale, 'window_offset_x': self.window_offset_x, 
-            'window_offset_y': self.window_offset_y, 'window_rect': self.window_rect
+            'window_offset_y': self.window_offset_y, 'window_rect': self.window_rect,
+            'show_cursor': self.show_cursor, 'cursor_clicks': self.cursor_clicks,
+            'monitor_mode': self.monitor_mode, 'monitor_index': self.monitor_index,
+            'monitor_subset': self.monitor_subset, 'media_path': self.media_path,
+            'media_loop': self.media_loop, 'media_scale': self.media_scale,
+            'media_offset_x': self.media_offset_x, 'media_offset_y': self.media_offset_y,
+            'audio_tracks': self.audio_tracks,
+            'audio_stems': self.audio_stems, 'audio_dsp': self.audio_dsp, 'offsets': 'centered'
         }
         
     @classmethod
     def from_dict(cls, data):
         scene = cls(data['name'])
-        scene.video_sources = data.get('video_sources', {"full_screen": True, "window": False, "camera": False})
+        scene.video_sources.update(data.get('video_sources', {}))
         scene.audio_enabled = data.get('audio_enabled', True)
         scene.window_info = data.get('window_info', "Окно не выбрано")
         scene.camera_index = data.get('camera_index', 0)
         scene.camera_resolution = data.get('camera_resolution', '640x480')
         scene.layout = data.get('layout', 'single')
         scene.text_objects = [TextObject.from_dict(text_data) for text_data in data.get('text_objects', [])]
+        scene.image_objects = [ImageObject.from_dict(image_data) for image_data in data.get('image_objects', [])]
         scene.camera_scale = data.get('camera_scale', 1.0)
         scene.camera_offset_x = data.get('camera_offset_x', 0)
         scene.camera_offset_y = data.get('camera_offset_y', 0)
+        scene.camera_chroma.update(data.get('camera_chroma', {}))
+        for source, params in data.get('color_correction', {}).items():
+            if source in scene.color_correction:
+                scene.color_correction[source].update(params)
         scene.screen_scale = data.get('screen_scale', 1.0)
         scene.screen_offset_x = data.get('screen_offset_x', 0)
         scene.screen_offset_y = data.get('screen_offset_y', 0)
+        if data.get('offsets') != 'centered':
+            # Старые сцены хранили левый верхний угол уменьшенного экрана, а не смещение от центра
+            offsets = []
+            for old, size in zip((scene.screen_offset_x, scene.screen_offset_y), LEGACY_SCREEN_SPACE):
+                span = size * scene.screen_scale
+                corner = max(0, min(size - span, old))
+                offsets.append(int(round(corner - (size - span) / 2)))
+            scene.screen_offset_x, scene.screen_offset_y = offsets
         scene.window_scale = data.get('window_scale', 1.0)
         scene.window_offset_x = data.get('window_offset_x', 0)
         scene.window_offset_y = data.get('window_offset_y', 0)
         scene.window_rect = data.get('window_rect', None)
+        scene.show_cursor = data.get('show_cursor', True)
+        scene.cursor_clicks = data.get('cursor_clicks', False)
+        scene.monitor_mode = data.get('monitor_mode', 'single')
+        scene.monitor_index = data.get('monitor_index', 1)
+        scene.monitor_subset = data.get('monitor_subset', [1])
+        scene.media_path = data.get('media_path', None)
+        scene.media_loop = data.get('media_loop', True)
+        scene.media_scale = data.get('media_scale', 1.0)
+        scene.media_offset_x = data.get('media_offset_x', 0)
+        scene.media_offset_y = data.get('media_offset_y', 0)
+        scene.audio_tracks = data.get('audio_tracks', scene.audio_tracks)
+        scene.audio_stems = data.get('audio_stems', False)
+        for stage, params in data.get('audio_dsp', {}).items():
+            if stage in scene.audio_dsp:
+                scene.audio_dsp[stage].update(params)
         return scene
 
+    def active_source(self):
+        """Возвращает основной источник видео с учетом приоритета.
+
+        Камера с хромакеем накладывается поверх основного источника и сама
+        основным не бывает.
+        """
+        if self.video_sources["full_screen"]:
+            return "full_screen"
+        if self.video_sources["window"] and self.window_rect:
+            return "window"
+        if self.video_sources["camera"] and not self.camera_chroma["enabled"]:
+            return "camera"
+        if self.video_sources["media"] and self.media_path:
+            return "media"
+        return None
+
+    def keyed_camera(self):
+        """Накладывается ли камера с хромакеем поверх основного источника"""
+        return self.video_sources["camera"] and self.camera_chroma["enabled"]
+
+    def transform_params(self, source):
+        """Возвращает (масштаб, смещение X, смещение Y) для источника"""
+        return tuple(getattr(self, field) for field in TRANSFORM_FIELDS[source])
+
+def freeze(value):
+    """Возвращает неизменяемую копию списков и словарей"""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return types.MappingProxyType({key: freeze(item) for key, item in value.items()})
+    return value
+
+class TextSnapshot:
+    """Неизменяемая копия текстового объекта для потоков захвата"""
+    __slots__ = ("text", "x", "y", "font_size", "font_color", "font_family",
+                 "background_color", "background_alpha", "visible", "scale")
+
+    def __init__(self, text_obj):
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(text_obj, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Снимок текстового объекта неизменяем")
+
+class ImageSnapshot:
+    """Неизменяемая копия изображения-наложения для потоков захвата"""
+    __slots__ = ("path", "anchor", "width", "margin", "opacity", "visible")
+
+    def __init__(self, image_obj):
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(image_obj, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Снимок изображения неизменяем")
+
+class SceneSnapshot:
+    """Неизменяемый снимок сцены с номером версии.
+
+    Интерфейс публикует новый снимок после каждой правки, а потоки захвата
+    читают его одной атомарной операцией чтения ссылки и работают с ним
+    весь кадр. Кэши сверяются с version и сбрасываются точно по изменениям.
+    """
+    __slots__ = ("version", "scene_id", "name", "video_sources", "window_rect", "audio_enabled",
+                 "camera_index", "camera_resolution", "layout", "text_objects", "image_objects",
+                 "camera_scale", "camera_offset_x", "camera_offset_y", "camera_chroma",
+                 "color_correction", "screen_scale", "screen_offset_x", "screen_offset_y",
+                 "window_scale", "window_offset_x", "window_offset_y",
+                 "show_cursor", "cursor_clicks", "monitor_mode", "monitor_index", "monitor_subset",
+                 "media_path", "media_loop", "media_scale", "media_offset_x", "media_offset_y")
+
+    def __init__(self, scene, version):
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "scene_id", scene.scene_id)
+        for name in self.__slots__[2:]:
+            value = getattr(scene, name)
+            if name == "text_objects":
+                value = tuple(TextSnapshot(text_obj) for text_obj in value)
+            elif name == "image_objects":
+                value = tuple(ImageSnapshot(image_obj) for image_obj in value)
+            else:
+                value = freeze(value)
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Снимок сцены неизменяем")
+
+    active_source = Scene.active_source
+    keyed_camera = Scene.keyed_camera
+    transform_params = Scene.transform_params
+
+class TilePool:
+    """Пул потоков для обработки холста горизонтальными полосами.
+
+    Операции OpenCV и NumPy над полосами отпускают GIL, поэтому полосы
+    действительно обрабатываются параллельно. Первую полосу выполняет
+    вызывающий поток, остальные - потоки пула.
+    """
+    MIN_BAND = 64  # Более узкие полосы не окупают переключение потоков
+
+    def __init__(self, threads):
+        self.threads = max(1, threads)
+        self.executor = None
+        if self.threads > 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.threads - 1, thread_name_prefix="compose-tile")
+        self._bands = {}
+
+    def bands(self, height):
+        bands = self._bands.get(height)
+        if bands is None:
+            count = max(1, min(self.threads, height // self.MIN_BAND))
+            edges = [height * i // count for i in range(count + 1)]
+            bands = list(zip(edges[:-1], edges[1:]))
+            self._bands[height] = bands
+        return bands
+
+    def run(self, height, band):
+        """Вызывает band(y0, y1) для всех полос высоты height и ждет завершения"""
+        bands = self.bands(height)
+        if len(bands) == 1:
+            band(0, height)
+            return
+        futures = [self.executor.submit(band, y0, y1) for y0, y1 in bands[1:]]
+        band(*bands[0])
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+class FrameTransform:
+    """Предвычисленное аффинное отображение источника на выходной холст.
+
+    Источник вписывается в холст с сохранением пропорций, умножается на
+    масштаб сцены и центрируется со смещением в пикселях REFERENCE_SIZE.
+    Заранее считаются видимая область холста и соответствующая ей часть
+    источника, так что кадр переносится одним resize прямо в холст.
+    """
+    def __init__(self, src_size, out_size, scale=1.0, offset_x=0, offset_y=0):
+        src_w, src_h = src_size
+        out_w, out_h = out_size
+        self.src_size = src_size
+        self.out_size = out_size
+        self.scale = min(out_w / src_w, out_h / src_h) * scale
+        self.tx = (out_w - src_w * self.scale) / 2 + offset_x * out_w / REFERENCE_SIZE[0]
+        self.ty = (out_h - src_h * self.scale) / 2 + offset_y * out_h / REFERENCE_SIZE[1]
+
+        # Видимая часть источника на холсте
+        dx0 = max(0, int(round(self.tx)))
+        dy0 = max(0, int(round(self.ty)))
+        dx1 = min(out_w, int(round(self.tx + src_w * self.scale)))
+        dy1 = min(out_h, int(round(self.ty + src_h * self.scale)))
+        if dx1 <= dx0 or dy1 <= dy0:
+            self.dst_rect = None
+            self.src_rect = None
+        else:
+            # Обратное отображение видимой области в координаты источника
+            sx0 = max(0, int(math.floor((dx0 - self.tx) / self.scale)))
+            sy0 = max(0, int(math.floor((dy0 - self.ty) / self.scale)))
+            sx1 = min(src_w, max(sx0 + 1, int(math.ceil((dx1 - self.tx) / self.scale))))
+            sy1 = min(src_h, max(sy0 + 1, int(math.ceil((dy1 - self.ty) / self.scale))))
+            self.dst_rect = (dx0, dy0, dx1, dy1)
+            self.src_rect = (sx0, sy0, sx1, sy1)
+
+
+    def matrix(self):
+        """Матрица 2x3 для cv2.warpAffine"""
+        return np.float32([[self.scale, 0, self.tx], [0, self.scale, self.ty]])
+
+    def clear_margins(self, canvas):
+        """Очищает поля холста вне области источника"""
+        if self.dst_rect is None:
+            canvas.fill(0)
+            return
+        dx0, dy0, dx1, dy1 = self.dst_rect
+        canvas[:dy0].fill(0)
+        canvas[dy1:].fill(0)
+        canvas[dy0:dy1, :dx0].fill(0)
+        canvas[dy0:dy1, dx1:].fill(0)
+
+    def apply(self, src, canvas, pool, cropped=False, tiles=None):
+        """Переносит видимую часть источника в холст без промежуточных кадров.
+
+        Если cropped=True, src уже содержит только src_rect (захват области).
+        Источники BGRA (mss) конвертируются в BGR на меньшей из двух сторон
+        преобразования; временные буферы берутся из пула. С пулом полос
+        tiles перенос выполняется параллельно по полосам холста.
+        """
+        if self.dst_rect is None:
+            return
+        dx0, dy0, dx1, dy1 = self.dst_rect
+        if cropped:
+            part = src
+        else:
+            sx0, sy0, sx1, sy1 = self.src_rect
+            part = src[sy0:sy1, sx0:sx1]
+        roi = canvas[dy0:dy1, dx0:dx1]
+        if tiles is not None and tiles.threads > 1:
+            self.apply_tiled(part, roi, pool, tiles)
+            return
+        dst_w, dst_h = dx1 - dx0, dy1 - dy0
+        same_size = part.shape[:2] == roi.shape[:2]
+
+        if part.shape[2] == 3:
+            if same_size:
+                np.copyto(roi, part)
+            else:
+                cv2.resize(part, (dst_w, dst_h), dst=roi, interpolation=cv2.INTER_LINEAR)
+        elif same_size:
+            cv2.cvtColor(part, cv2.COLOR_BGRA2BGR, dst=roi)
+        elif dst_w * dst_h <= part.shape[0] * part.shape[1]:
+            # Уменьшение: сначала масштабируем, потом конвертируем меньше пикселей
+            scaled = pool.get("scaled_bgra", (dst_h, dst_w, 4))
+            cv2.resize(part, (dst_w, dst_h), dst=scaled, interpolation=cv2.INTER_LINEAR)
+            cv2.cvtColor(scaled, cv2.COLOR_BGRA2BGR, dst=roi)
+        else:
+            # Увеличение: конвертируем исходные пиксели, потом масштабируем
+            converted = pool.get("source_bgr", (part.shape[0], part.shape[1], 3))
+            cv2.cvtColor(part, cv2.COLOR_BGRA2BGR, dst=converted)
+            cv2.resize(converted, (dst_w, dst_h), dst=roi, interpolation=cv2.INTER_LINEAR)
+
+    @staticmethod
+    def apply_tiled(part, roi, pool, tiles):
+        """Параллельный перенос по полосам.
+
+        Каждая полоса масштабируется своим warpAffine с матрицей, сдвинутой
+        на начало полосы; центры пикселей отображаются так же, как в
+        cv2.resize, поэтому на стыках полос нет швов.
+        """
+        dst_h, dst_w = roi.shape[:2]
+        src_h, src_w = part.shape[:2]
+        bgra = part.shape[2] == 4
+        same_size = (src_h, src_w) == (dst_h, dst_w)
+        scale_x, scale_y = dst_w / src_w, dst_h / src_h
+        warped = pool.get("tiled_bgra", (dst_h, dst_w, 4)) if bgra and not same_size else None
+
+        def band(y0, y1):
+            target = roi[y0:y1]
+            if same_size:
+                if bgra:
+                    cv2.cvtColor(part[y0:y1], cv2.COLOR_BGRA2BGR, dst=target)
+                else:
+                    np.copyto(target, part[y0:y1])
+                return
+            matrix = np.float32([[scale_x, 0, 0.5 * scale_x - 0.5],
+                                 [0, scale_y, 0.5 * scale_y - 0.5 - y0]])
+            if bgra:
+                cv2.warpAffine(part, matrix, (dst_w, y1 - y0), dst=warped[y0:y1],
+                               flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+                cv2.cvtColor(warped[y0:y1], cv2.COLOR_BGRA2BGR, dst=target)
+            else:
+                cv2.warpAffine(part, matrix, (dst_w, y1 - y0), dst=target,
+                               flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+        tiles.run(dst_h, band)
+
+class FrameBufferPool:
+    """Пул переиспользуемых буферов кадров.
+
+    Буфер с данным именем выделяется заново только при смене размера,
+    поэтому в установившемся режиме кадры не создают новых массивов.
+    """
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+def wrap_screenshot(screenshot):
+    """Оборачивает BGRA-буфер снимка mss в массив без копирования"""
+    return np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(
+        screenshot.height, screenshot.width, 4)
+
+def read_image(path, flags=cv2.IMREAD_COLOR):
+    """Читает изображение; в отличие от cv2.imread, понимает не-ASCII пути в Windows"""
+    data = np.fromfile(path, dtype=np.uint8)
+    if data.size == 0:
+        return None
+    return cv2.imdecode(data, flags)
+
+class MonitorLayout:
+    """Кэш геометрии мониторов.
+
+    Геометрия перечитывается только при смене конфигурации дисплеев; на
+    Windows она определяется дешевой сигнатурой из GetSystemMetrics, на
+    других системах - перечислением мониторов раз в REFRESH_INTERVAL.
+    """
+    CHECK_INTERVAL = 2.0
+    REFRESH_INTERVAL = 10.0
+    # SM_XVIRTUALSCREEN, SM_YVIRTUALSCREEN, SM_CXVIRTUALSCREEN, SM_CYVIRTUALSCREEN, SM_CMONITORS
+    SIGNATURE_METRICS = (76, 77, 78, 79, 80)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.monitors = []  # Как sct.monitors[1:]
+        self._signature = None
+        self._next_check = 0
+        self._next_refresh = 0
+        self.refresh_if_changed(force=True)
+
+    def _display_signature(self):
+        try:
+            user32 = ctypes.windll.user32
+        except AttributeError:
+            return None
+        return tuple(user32.GetSystemMetrics(metric) for metric in self.SIGNATURE_METRICS)
+
+    def refresh_if_changed(self, force=False):
+        """Перечитывает геометрию, если изменилась конфигурация дисплеев"""
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return
+        with self.lock:
+            self._next_check = now + self.CHECK_INTERVAL
+            signature = self._display_signature()
+            if not force:
+                if signature is None and now < self._next_refresh:
+                    return
+                if signature is not None and signature == self._signature:
+                    return
+            try:
+                with mss.mss() as sct:
+                    self.monitors = [dict(monitor) for monitor in sct.monitors[1:]]
+            except Exception as e:
+                print(f"Ошибка получения списка мониторов: {e}")
+            self._signature = signature
+            self._next_refresh = now + self.REFRESH_INTERVAL
+
+    def select(self, scene):
+        """Возвращает (ограничивающий прямоугольник, список мониторов) для сцены"""
+        monitors = self.monitors
+        if not monitors:
+            return None, []
+        if scene.monitor_mode == "span":
+            selected = list(monitors)
+        elif scene.monitor_mode == "subset":
+            selected = [monitors[i - 1] for i in scene.monitor_subset if 1 <= i <= len(monitors)]
+        else:
+            index = scene.monitor_index if 1 <= scene.monitor_index <= len(monitors) else 1
+            selected = [monitors[index - 1]]
+        if not selected:
+            selected = [monitors[0]]
+
+        left = min(m["left"] for m in selected)
+        top = min(m["top"] for m in selected)
+        right = max(m["left"] + m["width"] for m in selected)
+        bottom = max(m["top"] + m["height"] for m in selected)
+        bbox = {"left": left, "top": top, "width": right - left, "height": bottom - top}
+        return bbox, selected
+
+class ChromaKey:
+    """Хромакей: маска прозрачности кадра камеры по цвету фона.
+
+    Пороги по тону, насыщенности и яркости сведены в таблицу 256x3, поэтому
+    кадр проходит один cvtColor в HSV и один cv2.LUT, а "фоновость" пикселя -
+    минимум трех каналов таблицы с мягкими переходами. Затем маска очищается
+    морфологическим размыканием, подрезается и размывается по краю. Все
+    промежуточные буферы переиспользуются между кадрами.
+    """
+    HUE_SOFTNESS = 10  # Ширина перехода по тону, градусы
+
+    def __init__(self, config):
+        self.config = dict(config)
+        self.pool = FrameBufferPool()
+        hsv = cv2.cvtColor(np.uint8([[parse_color(config["color"], (0, 255, 0))[::-1]]]), cv2.COLOR_BGR2HSV)
+        hue = int(hsv[0, 0, 0])  # 0..179, градусы / 2
+
+        levels = np.arange(256, dtype=np.float32)
+        distance = np.abs((levels - hue + 90) % 180 - 90)
+        half_tolerance = config["tolerance"] / 2
+        hue_key = (half_tolerance + self.HUE_SOFTNESS / 2 - distance) / (self.HUE_SOFTNESS / 2)
+        softness = max(1.0, float(config["softness"]))
+        saturation_key = (levels - config["min_saturation"]) / softness
+        value_key = (levels - config["min_value"]) / softness
+        table = np.stack([hue_key, saturation_key, value_key], axis=1)
+        self.lut = (np.clip(table, 0, 1) * 255 + 0.5).astype(np.uint8).reshape(256, 1, 3)
+
+        self.open_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        erode = int(config["erode"])
+        self.erode_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * erode + 1,) * 2) if erode > 0 else None
+        feather = int(config["feather"])
+        self.feather_size = (2 * feather + 1,) * 2 if feather > 0 else None
+        # Засветка подавляется в канале ключа: зеленом для зеленого фона, синем для синего
+        self.spill_channel = None
+        if config["despill"]:
+            if 30 <= hue < 90:
+                self.spill_channel = 1
+            elif 90 <= hue < 150:
+                self.spill_channel = 0
+
+    def apply(self, frame, alpha=None):
+        """Возвращает маску прозрачности кадра (255 - передний план).
+
+        alpha - буфер прошлого кадра для переиспользования. При включенном
+        подавлении засветки кадр правится на месте.
+        """
+        height, width = frame.shape[:2]
+        if alpha is None or alpha.shape != (height, width):
+            alpha = np.empty((height, width), dtype=np.uint8)
+        hsv = self.pool.get("hsv", (height, width, 3))
+        key = self.pool.get("key", (height, width, 3))
+        channel = self.pool.get("channel", (height, width))
+        cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=hsv)
+        cv2.LUT(hsv, self.lut, dst=key)
+        cv2.extractChannel(key, 0, dst=alpha)
+        for index in (1, 2):
+            cv2.extractChannel(key, index, dst=channel)
+            cv2.min(alpha, channel, dst=alpha)
+        cv2.bitwise_not(alpha, dst=alpha)
+
+        cv2.morphologyEx(alpha, cv2.MORPH_OPEN, self.open_kernel, dst=alpha)
+        if self.erode_kernel is not None:
+            cv2.erode(alpha, self.erode_kernel, dst=alpha)
+        if self.feather_size is not None:
+            cv2.blur(alpha, self.feather_size, dst=alpha)
+
+        if self.spill_channel is not None:
+            # Канал ключа не ярче наибольшего из двух других
+            limit = self.pool.get("spill", (height, width))
+            other = self.pool.get("other", (height, width))
+            a, b = [i for i in range(3) if i != self.spill_channel]
+            cv2.extractChannel(frame, a, dst=limit)
+            cv2.extractChannel(frame, b, dst=other)
+            cv2.max(limit, other, dst=limit)
+            cv2.extractChannel(frame, self.spill_channel, dst=other)
+            cv2.min(other, limit, dst=other)
+            cv2.insertChannel(other, frame, self.spill_channel)
+        return alpha
+
+class CameraSource:
+    """Открытая камера с фоновым потоком чтения.
+
+    Поток держит устройство "теплым": последний кадр всегда готов, и
+    компоновщик забирает его без ожидания. Кадры читаются по кругу в три
+    буфера, поэтому отданный кадр не перезаписывается в ближайшие два чтения.
+    Если запрошен хромакей, маска считается в том же потоке один раз на кадр
+    камеры, в исходном разрешении, и публикуется вместе с кадром.
+
+    Устройство открывает только этот поток: смена разрешения и повторное
+    открытие после серии неудачных чтений выполняются в нем же, с
+    освобождением прежнего дескриптора, так как драйверы не дают открыть
+    камеру дважды.
+    """
+    BUFFERS = 3
+    KEY_IDLE_TIMEOUT = 1.0  # Без запросов маски дольше этого хромакей отключается
+    MAX_FAILED_READS = 40  # ~2 с неудачных чтений подряд - камера переоткрывается
+    RETRY_DELAY = 2.0
+
+    def __init__(self, index, resolution):
+        self.index = index
+        self.resolution = resolution
+        self.latest = None
+        self.keyed = None  # (кадр, маска) последнего кадра с хромакеем
+        self.chroma_config = None
+        self.keyed_used = 0
+        self.last_used = time.monotonic()
+        self.running = True
+        self.thread = threading.Thread(target=self._reader, daemon=True, name=f"camera-{index}")
+        self.thread.start()
+
+    def _open(self, resolution):
+        """Открывает устройство; при неудаче возвращает None"""
+        capture = cv2.VideoCapture(self.index)
+        if not capture.isOpened():
+            capture.release()
+            return None
+        width, height = map(int, resolution.split('x'))
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        return capture
+
+    def _reader(self):
+        capture = None
+        try:
+            buffers = [None] * self.BUFFERS
+            alphas = [None] * self.BUFFERS
+            keyer = None
+            slot = 0
+            opened_resolution = None
+            failed_reads = 0
+            open_failed = False
+            while self.running:
+                if capture is None or opened_resolution != self.resolution:
+                    if capture is not None:
+                        capture.release()  # Освобождаем устройство до повторного открытия
+                    opened_resolution = self.resolution
+                    capture = self._open(opened_resolution)
+                    if capture is None:
+                        if not open_failed:
+                            print(f"Не удалось открыть камеру {self.index}, повторяем попытки")
+                        open_failed = True
+                        time.sleep(self.RETRY_DELAY)
+                        continue
+                    open_failed = False
+                    failed_reads = 0
+                    buffers = [None] * self.BUFFERS
+
+                ret, frame = capture.read(buffers[slot])
+                if not ret:
+                    failed_reads += 1
+                    if failed_reads >= self.MAX_FAILED_READS:
+                        print(f"Камера {self.index} не отдает кадры, переоткрываем")
+                        capture.release()
+                        capture = None
+                    time.sleep(0.05)
+                    continue
+                failed_reads = 0
+                buffers[slot] = frame
+                config = self.chroma_config
+                if config is not None and time.monotonic() - self.keyed_used < self.KEY_IDLE_TIMEOUT:
+                    if keyer is None or keyer.config != config:
+                        keyer = ChromaKey(config)
+                    alphas[slot] = keyer.apply(frame, alphas[slot])
+                    self.keyed = (frame, alphas[slot])
+                else:
+                    keyer = None
+                    self.keyed = None
+                self.latest = frame  # Атомарная замена ссылки
+                slot = (slot + 1) % self.BUFFERS
+        except Exception as e:
+            print(f"Ошибка захвата камеры {self.index}: {e}")
+        finally:
+            if capture is not None:
+                capture.release()
+
+    def read(self):
+        """Возвращает последний кадр или None, если камера еще открывается"""
+        self.last_used = time.monotonic()
+        return self.latest
+
+    def read_keyed(self, config):
+        """Возвращает (кадр, маска) с хромакеем config или None до первой маски"""
+        self.last_used = self.keyed_used = time.monotonic()
+        if self.chroma_config != config:
+            self.chroma_config = dict(config)
+            self.keyed = None
+        return self.keyed
+
+    def close(self):
+        """Останавливает поток и ждет освобождения устройства"""
+        self.running = False
+        if self.thread is not threading.current_thread():
+            self.thread.join(timeout=2.0)
+
+class MediaSource:
+    """Видеофайл или последовательность изображений с упреждающим декодированием.
+
+    Поток декодирования держит несколько следующих кадров в кольце и сразу
+    приводит видимую часть кадра к размеру области каждого выхода, который
+    запросил кадр. Компоновщику остается только скопировать готовый кадр,
+    поэтому декодирование и масштабирование не попадают в путь захвата.
+    Кадр выбирается по времени воспроизведения, так что частота источника
+    не зависит от частоты предпросмотра и записи.
+    """
+    RING = 4
+    IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+    SEQUENCE_FPS = 30.0
+
+    def __init__(self, path, loop=True):
+        self.path = path
+        self.loop = loop
+        self.fps = self.SEQUENCE_FPS
+        self.frame_count = 0
+        self.frame_size = None  # Размер кадра (w, h), известен после открытия
+        self.raw = [None] * self.RING
+        self.scaled = [{} for _ in range(self.RING)]  # Слот -> {выход: (спецификация, кадр)}
+        self.slot_index = [-1] * self.RING  # Номер кадра воспроизведения в слоте
+        self.decoded = -1
+        self.targets = {}  # Выход -> (src_rect, (ширина, высота)) для предмасштабирования
+        self.start_time = None
+        self.seek_request = None
+        self.last_used = time.monotonic()
+        self.running = True
+        self.thread = threading.Thread(target=self._decoder, daemon=True,
+                                       name=f"media-{os.path.basename(path)}")
+        self.thread.start()
+
+    def playback_index(self):
+        return int((time.monotonic() - self.start_time) * self.fps)
+
+    def seek(self, seconds):
+        """Переходит к позиции в секундах (выполняется потоком декодирования)"""
+        self.seek_request = max(0.0, seconds)
+
+    def read(self, output, src_rect, dst_size):
+        """Возвращает (кадр, обрезан_и_масштабирован) для текущего момента.
+
+        Если кадр уже подготовлен под область выхода output, возвращается
+        он и True; иначе - исходный кадр и False (например, сразу после
+        изменения трансформации, пока декодер не перешел на новый размер).
+        """
+        self.last_used = time.monotonic()
+        spec = (src_rect, dst_size)
+        if self.targets.get(output) != spec:
+            self.targets[output] = spec
+        if self.start_time is None:
+            return None, False
+        index = self.playback_index()
+        best_slot, best_index = -1, -1
+        for slot, frame_index in enumerate(self.slot_index):
+            if best_index < frame_index <= index:
+                best_slot, best_index = slot, frame_index
+        if best_slot < 0:
+            return None, False
+        prepared = self.scaled[best_slot].get(output)
+        if prepared is not None and prepared[0] == spec:
+            return prepared[1], True
+        return self.raw[best_slot], False
+
+    def _open(self):
+        """Открывает источник; для папки - отсортированный список изображений"""
+        if os.path.isdir(self.path):
+            self.images = sorted(os.path.join(self.path, name) for name in os.listdir(self.path)
+                                 if name.lower().endswith(self.IMAGE_EXTENSIONS))
+            self.capture = None
+            self.frame_count = len(self.images)
+            self.position = 0
+            self.fps = self.SEQUENCE_FPS
+        else:
+            self.images = None
+            self.capture = cv2.VideoCapture(self.path)
+            if not self.capture.isOpened():
+                raise RuntimeError("не удалось открыть файл")
+            self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.fps = self.capture.get(cv2.CAP_PROP_FPS) or self.SEQUENCE_FPS
+
+    def _seek_frame(self, frame_number):
+        if self.capture is not None:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        else:
+            self.position = frame_number
+
+    def _read_into(self, buffer):
+        """Читает следующий кадр (в buffer, если размер подходит)"""
+        if self.capture is not None:
+            return self.capture.read(buffer)
+        if self.position >= self.frame_count:
+            return False, None
+        frame = read_image(self.images[self.position])
+        self.position += 1
+        return frame is not None, frame
+
+    def _skip(self):
+        if self.capture is not None:
+            return self.capture.grab()
+        self.position += 1
+        return self.position <= self.frame_count
+
+    def _prepare(self, slot, frame):
+        """Обрезает и масштабирует кадр под области всех выходов"""
+        prepared = self.scaled[slot]
+        for output, (src_rect, dst_size) in list(self.targets.items()):
+            if src_rect is None:
+                continue
+            sx0, sy0, sx1, sy1 = src_rect
+            if sx1 > frame.shape[1] or sy1 > frame.shape[0]:
+                continue
+            old = prepared.get(output)
+            buffer = old[1] if old is not None and old[1].shape[:2] == (dst_size[1], dst_size[0]) else None
+            buffer = cv2.resize(frame[sy0:sy1, sx0:sx1], dst_size, dst=buffer, interpolation=cv2.INTER_AREA)
+            prepared[output] = ((src_rect, dst_size), buffer)
+
+    def _decoder(self):
+        try:
+            self._open()
+            self.start_time = time.monotonic()
+            while self.running:
+                if self.seek_request is not None:
+                    seconds, self.seek_request = self.seek_request, None
+                    frame_number = int(seconds * self.fps)
+                    if self.frame_count:
+                        frame_number %= self.frame_count
+                    self._seek_frame(frame_number)
+                    self.slot_index = [-1] * self.RING
+                    self.decoded = -1
+                    self.start_time = time.monotonic() - frame_number / self.fps
+
+                playback = self.playback_index()
+                next_index = self.decoded + 1
+                if next_index > playback + self.RING - 2:
+                    # Кольцо заполнено наперед - ждем половину кадра
+                    time.sleep(0.5 / self.fps)
+                    continue
+                # Отстали (например, после паузы системы) - пропускаем кадры без декодирования
+                while next_index < playback and self._skip():
+                    next_index += 1
+
+                slot = next_index % self.RING
+                self.slot_index[slot] = -1  # Слот недоступен, пока перезаписывается
+                ok, frame = self._read_into(self.raw[slot])
+                if not ok:
+                    if self.loop and self.frame_count > 0:
+                        self._seek_frame(0)
+                        continue
+                    time.sleep(0.1)  # Конец файла без повтора: остается последний кадр
+                    continue
+                self.raw[slot] = frame
+                self.frame_size = (frame.shape[1], frame.shape[0])
+                self._prepare(slot, frame)
+                self.slot_index[slot] = next_index
+                self.decoded = next_index
+        except Exception as e:
+            print(f"Ошибка медиаисточника {self.path}: {e}")
+        finally:
+            if getattr(self, 'capture', None) is not None:
+                self.capture.release()
+
+    def close(self):
+        self.running = False
+
+class SourcePool:
+    """Пул открытых источников активной и недавно использованных сцен.
+
+    Источники вытесняются по LRU при превышении MAX_SOURCES и по простою
+    дольше IDLE_TIMEOUT; источники активной сцены (active_keys) не
+    вытесняются. Закрытие камеры ждет ее поток чтения, поэтому вытесненные
+    источники закрываются в фоновом потоке, а не в потоках захвата.
+    """
+    MAX_SOURCES = 4
+    IDLE_TIMEOUT = 60.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sources = collections.OrderedDict()
+        self.active_keys = frozenset()  # Заменяется целиком при смене сцены
+
+    def get(self, key, factory):
+        evicted = []
+        with self.lock:
+            source = self.sources.get(key)
+            if source is None:
+                source = factory()
+                self.sources[key] = source
+            self.sources.move_to_end(key)
+            keep = self.active_keys | {key}
+            for old_key in list(self.sources):
+                if len(self.sources) <= self.MAX_SOURCES:
+                    break
+                if old_key not in keep:
+                    evicted.append(self.sources.pop(old_key))
+        self.close_later(evicted)
+        return source
+
+    @staticmethod
+    def close_later(sources):
+        """Закрывает источники в фоновом потоке"""
+        if not sources:
+            return
+        def close():
+            for source in sources:
+                source.close()
+        threading.Thread(target=close, daemon=True, name="source-close").start()
+
+    def camera(self, index, resolution, reconfigure=True):
+        """Камера с номером index; устройство одно на номер, разрешение меняется на месте.
+
+        reconfigure=False возвращает камеру в текущем разрешении (например,
+        уходящей сцене во время перехода), чтобы две сцены не переключали
+        устройство друг у друга.
+        """
+        source = self.get(("camera", index), lambda: CameraSource(index, resolution))
+        if reconfigure and source.resolution != resolution:
+            source.resolution = resolution
+        return source
+
+    def media(self, path, loop):
+        return self.get(("media", path, loop), lambda: MediaSource(path, loop))
+
+    def scene_keys(self, scene):
+        """Ключи источников, которые нужны сцене"""
+        keys = set()
+        if scene.video_sources["camera"]:
+            keys.add(("camera", scene.camera_index))
+        if scene.video_sources["media"] and scene.media_path:
+            keys.add(("media", scene.media_path, scene.media_loop))
+        return keys
+
+    def prewarm(self, scene):
+        """Заранее открывает источники сцены"""
+        if scene.video_sources["camera"]:
+            self.camera(scene.camera_index, scene.camera_resolution)
+        if scene.video_sources["media"] and scene.media_path:
+            self.media(scene.media_path, scene.media_loop)
+
+    def evict_idle(self, keep=()):
+        """Закрывает источники, простаивающие дольше IDLE_TIMEOUT"""
+        now = time.monotonic()
+        evicted = []
+        with self.lock:
+            for key in list(self.sources):
+                source = self.sources[key]
+                if key not in keep and key not in self.active_keys and now - source.last_used > self.IDLE_TIMEOUT:
+                    evicted.append(self.sources.pop(key))
+        self.close_later(evicted)
+
+    def close_all(self):
+        with self.lock:
+            sources = list(self.sources.values())
+            self.sources.clear()
+        for source in sources:
+            source.close()
+
+class TransformEngine:
+    """Кэш преобразований источников для одного выходного разрешения.
+
+    Преобразование пересчитывается только при изменении размеров источника
+    или параметров трансформации сцены.
+    """
+    def __init__(self, out_size):
+        self.out_size = out_size
+        self._cache = {}  # (сцена, источник) -> (версия, параметры, преобразование)
+
+    def get(self, scene, source, src_size):
+        """Возвращает преобразование источника для снимка сцены"""
+        key = (scene.scene_id, source)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == scene.version and cached[1][0] == src_size:
+            return cached[2]
+        params = (tuple(src_size),) + scene.transform_params(source)
+        if cached is None or cached[1] != params:
+            transform = FrameTransform(params[0], self.out_size, *params[1:])
+        else:
+            transform = cached[2]
+        self._cache[key] = (scene.version, params, transform)
+        return transform
+
+@functools.lru_cache(maxsize=8)
+def load_cube_lut(path, mtime):
+    """Читает 3D LUT в формате .cube один раз для данного времени изменения.
+
+    Возвращает (таблица [b, g, r] -> RGB, DOMAIN_MIN, DOMAIN_MAX).
+    """
+    size = None
+    domain_min, domain_max = [0.0, 0.0, 0.0], [1.0, 1.0, 1.0]
+    rows = []
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            parts = line.split()
+            if not parts or parts[0].startswith('#'):
+                continue
+            keyword = parts[0].upper()
+            if keyword == 'LUT_3D_SIZE':
+                size = int(parts[1])
+            elif keyword == 'LUT_1D_SIZE':
+                raise RuntimeError("поддерживаются только трехмерные LUT")
+            elif keyword == 'DOMAIN_MIN':
+                domain_min = [float(value) for value in parts[1:4]]
+            elif keyword == 'DOMAIN_MAX':
+                domain_max = [float(value) for value in parts[1:4]]
+            elif keyword[0].isalpha():
+                continue  # TITLE и прочие ключевые слова
+            else:
+                rows.append([float(value) for value in parts[:3]])
+    if size is None or size < 2 or len(rows) != size ** 3:
+        raise RuntimeError(f"неверный файл LUT {path}")
+    # Красный меняется быстрее всего, поэтому порядок осей - синий, зеленый, красный
+    table = np.array(rows, dtype=np.float32).reshape(size, size, size, 3)
+    return table, np.float32(domain_min), np.float32(domain_max)
+
+class ColorCorrection:
+    """Цветокоррекция источника, скомпилированная в таблицы.
+
+    Яркость и контраст одинаковы для всех каналов и сводятся к таблице 256
+    значений для cv2.LUT. Насыщенность - это масштаб цветоразностных
+    каналов вокруг 128 при неизменной яркости, поэтому она применяется
+    таблицей cv2.LUT в пространстве YCrCb. Решетка файла .cube заранее
+    интерполируется по синему во все 256 значений, и срезы выкладываются
+    в одно изображение (строки - зеленый, столбцы - синий * size +
+    красный; для 33^3 это 820 КБ). Тогда трилинейная интерполяция - это
+    один cv2.remap с билинейной интерполяцией, а координаты для него дают
+    таблицы cv2.LUT по каналам. Кадр обрабатывается по полосам, с пулом
+    полос - параллельно. Объекты неизменяемы и общие для всех выходов.
+    """
+    MAX_LATTICE = 127  # Ширина раскладки 256 * size должна быть меньше 32767 для cv2.remap
+    def __init__(self, brightness, contrast, saturation, lut_path=None, lut_mtime=None):
+        levels = np.arange(256, dtype=np.float32)
+        self.curve = np.clip((levels - 128) * contrast + 128 + brightness * 1.27 + 0.5, 0, 255).astype(np.uint8)
+        self.use_curve = not np.array_equal(self.curve, np.arange(256, dtype=np.uint8))
+        self.chroma_lut = None
+        if saturation != 1:
+            chroma = np.clip((levels - 128) * saturation + 128 + 0.5, 0, 255).astype(np.uint8)
+            self.chroma_lut = np.stack([np.arange(256, dtype=np.uint8), chroma, chroma], axis=-1).reshape(256, 1, 3)
+        self.lattice = None
+        if lut_path:
+            self.compile_lattice(load_cube_lut(lut_path, lut_mtime))
+        self.identity = self.lattice is None and self.chroma_lut is None and not self.use_curve
+
+    def compile_lattice(self, cube):
+        """Раскладывает решетку LUT в изображение срезов и готовит таблицы координат"""
+        table, domain_min, domain_max = cube
+        size = table.shape[0]
+        if size > self.MAX_LATTICE:
+            raise RuntimeError(f"LUT {size}^3 больше поддерживаемого {self.MAX_LATTICE}^3")
+        values = np.arange(256, dtype=np.float32) / 255
+        positions = []
+        for rgb in range(3):  # DOMAIN_MIN и DOMAIN_MAX заданы в порядке RGB
+            position = (values - domain_min[rgb]) / (domain_max[rgb] - domain_min[rgb]) * (size - 1)
+            positions.append(np.clip(position, 0, size - 1).astype(np.float32))
+        red, green, blue = positions
+        # Срезы по каждому значению синего: ось синего у таблицы первая
+        node = np.minimum(blue.astype(np.int32), size - 2)
+        weight = (blue - node)[:, None, None, None]
+        slices = table[node] * (1 - weight) + table[node + 1] * weight  # (синий, зеленый, красный, RGB)
+        layout = slices[..., ::-1].transpose(1, 0, 2, 3).reshape(size, 256 * size, 3)
+        self.lattice = np.clip(layout * 255 + 0.5, 0, 255).astype(np.uint8)
+        self.lattice_x_blue = (np.arange(256, dtype=np.float32) * size).reshape(256, 1)
+        self.lattice_x_red = red.reshape(256, 1)
+        self.lattice_y = green.reshape(256, 1)
+
+    def apply_lattice(self, bgr, dst):
+        """Интерполирует решетку для полосы BGR и пишет результат в dst (может совпадать с bgr)"""
+        blue, green, red = cv2.split(bgr)
+        map_x = cv2.LUT(blue, self.lattice_x_blue)
+        cv2.add(map_x, cv2.LUT(red, self.lattice_x_red), dst=map_x)
+        map_y = cv2.LUT(green, self.lattice_y)
+        cv2.remap(self.lattice, map_x, map_y, cv2.INTER_LINEAR, dst=dst, borderMode=cv2.BORDER_REPLICATE)
+
+    def grade_band(self, src, dst):
+        """Применяет цепочку к полосе src (BGR или BGRA) и пишет BGR в dst"""
+        if src.shape[2] == 4:
+            cv2.cvtColor(src, cv2.COLOR_BGRA2BGR, dst=dst)
+            src = dst
+        if self.use_curve:
+            cv2.LUT(src, self.curve, dst=dst)
+            src = dst
+        if self.chroma_lut is not None:
+            ycrcb = cv2.cvtColor(src, cv2.COLOR_BGR2YCrCb)
+            cv2.LUT(ycrcb, self.chroma_lut, dst=ycrcb)
+            cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR, dst=dst)
+            src = dst
+        if self.lattice is not None:
+            self.apply_lattice(src, dst)
+        elif src is not dst:
+            np.copyto(dst, src)
+
+    def apply(self, image, pool, tag, tiles=None):
+        """Возвращает скорректированный BGR-кадр в буфере пула для источника tag"""
+        height, width = image.shape[:2]
+        graded = pool.get(f"graded_{tag}", (height, width, 3))
+
+        def band(y0, y1):
+            self.grade_band(image[y0:y1], graded[y0:y1])
+
+        if tiles is None:
+            band(0, height)
+        else:
+            tiles.run(height, band)
+        return graded
+
+class ColorCorrectionCache:
+    """Строит цветокоррекции в фоновом потоке и хранит готовые.
+
+    Потоки захвата не ждут разбора файла .cube: пока коррекция строится,
+    источник выводится с прежней. Параметры, которые перестали
+    запрашивать (промежуточные положения ползунков), не компилируются.
+    """
+    MAX_READY = 3  # Раскладка решетки 65^3 занимает 3,2 МБ; одновременно нужны экран, камера и медиа
+    STALE_AFTER = 1.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.ready = collections.OrderedDict()  # параметры -> ColorCorrection
+        self.requested = {}  # параметры -> время последнего запроса
+        threading.Thread(target=self._worker, daemon=True, name="color-compile").start()
+
+    def get(self, params):
+        """Возвращает готовую коррекцию или None, поставив ее в очередь на сборку"""
+        with self.lock:
+            correction = self.ready.get(params)
+            if correction is not None:
+                self.ready.move_to_end(params)
+                return correction
+            self.requested[params] = time.time()
+        self.wakeup.set()
+        return None
+
+    def _worker(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                now = time.time()
+                for params, requested in list(self.requested.items()):
+                    if now - requested > self.STALE_AFTER:
+                        del self.requested[params]
+                if not self.requested:
+                    self.wakeup.clear()
+                    continue
+                params = max(self.requested, key=self.requested.get)
+            try:
+                correction = ColorCorrection(*params)
+            except Exception as e:
+                print(f"Ошибка цветокоррекции: {e}")
+                correction = ColorCorrection(0, 1.0, 1.0)  # Запоминаем, чтобы не повторять ошибку
+            with self.lock:
+                self.requested.pop(params, None)
+                self.ready[params] = correction
+                while len(self.ready) > self.MAX_READY:
+                    self.ready.popitem(last=False)
+
+class Compositor:
+    """Собирает кадр активного источника сцены на холсте заданного размера.
+
+    Предпросмотр и запись используют один и тот же код, отличаясь только
+    размером холста, поэтому сцена выглядит в них одинаково.
+    """
+    def __init__(self, app, out_size, tiles=None):
+        self.app = app
+        self.out_size = out_size
+        self.tiles = tiles  # Пул полос для больших выходов или None
+        self.transforms = TransformEngine(out_size)
+        self.pool = FrameBufferPool()
+        self.canvas = self.pool.get("canvas", (out_size[1], out_size[0], 3))
+        self.canvas.fill(0)
+        self._stitch_layout = None
+        self._corrections = {}  # (сцена, источник) -> (версия, цветокоррекция или None)
+        self._cursor_sprites = {}  # (вид, стадия, масштаб) -> спрайт
+
+    def compose(self, scene, sct):
+        """Возвращает холст с кадром сцены (холст переиспользуется).
+
+        Камера с хромакеем накладывается поверх основного источника.
+        """
+        canvas = self.compose_primary(scene, sct)
+        if scene.keyed_camera():
+            try:
+                self.overlay_keyed_camera(scene)
+            except Exception as e:
+                print(f"Ошибка наложения камеры: {e}")
+        return canvas
+
+    def compose_primary(self, scene, sct):
+        source = scene.active_source()
+        if source is None:
+            if scene.keyed_camera():
+                self.canvas.fill(0)  # Камера с хромакеем без другого источника - на черном
+                return self.canvas
+            return self.placeholder("Выберите источник видео")
+
+        try:
+            if source == "camera":
+                frame = self.app.capture_camera(scene)
+                if frame is None:
+                    # Камера еще открывается: оставляем предыдущий кадр вместо пропуска
+                    return self.canvas
+                transform = self.transforms.get(scene, source, (frame.shape[1], frame.shape[0]))
+                transform.clear_margins(self.canvas)
+                if transform.src_rect is not None:
+                    sx0, sy0, sx1, sy1 = transform.src_rect
+                    part = self.correct(scene, source, frame[sy0:sy1, sx0:sx1])
+                    transform.apply(part, self.canvas, self.pool, cropped=True, tiles=self.tiles)
+                return self.canvas
+
+            if source == "media":
+                return self.compose_media(scene)
+
+            region, monitors = self.source_region(scene, source)
+            if region is None:
+                return self.placeholder("Неверные размеры окна" if source == "window" else "Мониторы не найдены")
+
+            # Преобразование известно до захвата, поэтому захватываем только
+            # ту часть источника, которая видна на холсте
+            transform = self.transforms.get(scene, source, (region["width"], region["height"]))
+            transform.clear_margins(self.canvas)
+            if transform.src_rect is not None:
+                frame = self.grab_visible(sct, region, monitors, transform.src_rect)
+                frame = self.correct(scene, source, frame)
+                transform.apply(frame, self.canvas, self.pool, cropped=True, tiles=self.tiles)
+                if scene.show_cursor:
+                    self.draw_cursor(scene, region, transform)
+            return self.canvas
+        except Exception as e:
+            print(f"Ошибка захвата источника {source}: {e}")
+            return self.placeholder("Ошибка захвата окна" if source == "window" else None)
+
+    def compose_media(self, scene):
+        """Переносит текущий кадр медиаисточника; обычно это одно копирование"""
+        media = self.app.media_source(scene)
+        if media is None or media.frame_size is None:
+            return self.canvas  # Файл еще открывается
+        transform = self.transforms.get(scene, "media", media.frame_size)
+        transform.clear_margins(self.canvas)
+        if transform.src_rect is not None:
+            dx0, dy0, dx1, dy1 = transform.dst_rect
+            frame, prepared = media.read(self.out_size, transform.src_rect, (dx1 - dx0, dy1 - dy0))
+            if frame is not None:
+                frame = self.correct(scene, "media", frame)
+                transform.apply(frame, self.canvas, self.pool, cropped=prepared, tiles=self.tiles)
+        return self.canvas
+
+    def correct(self, scene, source, image):
+        """Применяет цветокоррекцию источника к его кадру в исходном разрешении, по полосам пула компоновщика"""
+        key = (scene.scene_id, source)
+        cached = self._corrections.get(key)
+        if cached is None or cached[0] != scene.version:
+            params = scene.color_correction[source]
+            version = scene.version
+            correction = cached[1] if cached is not None else None
+            try:
+                path = params["lut_path"]
+                ready = self.app.color_corrections.get((
+                    params["brightness"], params["contrast"], params["saturation"],
+                    path, os.path.getmtime(path) if path else None))
+                if ready is None:
+                    version = None  # Таблица еще строится: пока оставляем прежнюю коррекцию
+                else:
+                    correction = None if ready.identity else ready
+            except Exception as e:
+                print(f"Ошибка цветокоррекции: {e}")
+                correction = None
+            cached = (version, correction)
+            self._corrections[key] = cached
+        return image if cached[1] is None else cached[1].apply(image, self.pool, source, self.tiles)
+
+    def overlay_keyed_camera(self, scene):
+        """Смешивает кадр камеры с холстом по маске хромакея"""
+        keyed = self.app.capture_keyed_camera(scene)
+        if keyed is None:
+            return
+        frame, alpha = keyed
+        transform = self.transforms.get(scene, "camera", (frame.shape[1], frame.shape[0]))
+        if transform.dst_rect is None:
+            return
+        dx0, dy0, dx1, dy1 = transform.dst_rect
+        sx0, sy0, sx1, sy1 = transform.src_rect
+        size = (dx1 - dx0, dy1 - dy0)
+        part = self.correct(scene, "camera", frame[sy0:sy1, sx0:sx1])
+        mask = alpha[sy0:sy1, sx0:sx1]
+        if part.shape[:2] != (size[1], size[0]):
+            part = cv2.resize(part, size, dst=self.pool.get("keyed_bgr", (size[1], size[0], 3)),
+                              interpolation=cv2.INTER_LINEAR)
+            mask = cv2.resize(mask, size, dst=self.pool.get("keyed_mask", (size[1], size[0])),
+                              interpolation=cv2.INTER_LINEAR)
+        mask3 = self.pool.get("keyed_mask3", (size[1], size[0], 3))
+        foreground = self.pool.get("keyed_fg", (size[1], size[0], 3))
+        roi = self.canvas[dy0:dy1, dx0:dx1]
+
+        def blend(y0, y1):
+            band_mask = mask3[y0:y1]
+            band_fg = foreground[y0:y1]
+            band_roi = roi[y0:y1]
+            cv2.cvtColor(mask[y0:y1], cv2.COLOR_GRAY2BGR, dst=band_mask)
+            cv2.multiply(part[y0:y1], band_mask, dst=band_fg, scale=1 / 255.0)
+            cv2.bitwise_not(band_mask, dst=band_mask)
+            cv2.multiply(band_roi, band_mask, dst=band_roi, scale=1 / 255.0)
+            cv2.add(band_roi, band_fg, dst=band_roi)
+
+        if self.tiles is not None:
+            self.tiles.run(size[1], blend)
+        else:
+            blend(0, size[1])
+
+    def draw_cursor(self, scene, region, transform):
+        """Накладывает курсор и кольца щелчков; затрагивается только их область"""
+        sample = self.app.cursor.sample()
+        if sample is None:
+            return
+        x, y, now, clicks = sample
+        left, top = region["left"], region["top"]
+        scale = transform.scale
+        if scene.cursor_clicks:
+            for click_x, click_y, click_time in clicks:
+                stage = int((now - click_time) / CursorTracker.CLICK_DURATION * CursorTracker.RING_STAGES)
+                if 0 <= stage < CursorTracker.RING_STAGES:
+                    sprite = self.cursor_sprite("ring", stage, scale)
+                    blend_sprite(self.canvas, sprite,
+                                 int(round(transform.tx + (click_x - left) * scale)) + sprite.offset_x,
+                                 int(round(transform.ty + (click_y - top) * scale)) + sprite.offset_y)
+        if left <= x < left + region["width"] and top <= y < top + region["height"]:
+            sprite = self.cursor_sprite("arrow", 0, scale)
+            blend_sprite(self.canvas, sprite,
+                         int(round(transform.tx + (x - left) * scale)) + sprite.offset_x,
+                         int(round(transform.ty + (y - top) * scale)) + sprite.offset_y)
+
+    def cursor_sprite(self, kind, stage, scale):
+        key = (kind, stage, round(scale, 3))
+        sprite = self._cursor_sprites.get(key)
+        if sprite is None:
+            if len(self._cursor_sprites) > 64:
+                self._cursor_sprites.clear()  # Масштаб источника менялся много раз
+            if kind == "arrow":
+                sprite = render_cursor_sprite(max(6, int(round(CursorTracker.CURSOR_HEIGHT * scale))))
+            else:
+                sprite = render_click_ring_sprite(stage, scale)
+            self._cursor_sprites[key] = sprite
+        return sprite
+
+    def source_region(self, scene, source):
+        """Возвращает область рабочего стола источника и мониторы, из которых она состоит"""
+        if source == "full_screen":
+            bbox, monitors = self.app.monitor_layout.select(scene)
+            return bbox, monitors
+
+        left, top, right, bottom = scene.window_rect
+        width = right - left
+        height = bottom - top
+        if width <= 0 or height <= 0:
+            return None, None
+        region = {
+            "left": max(0, left),
+            "top": max(0, top),
+            "width": min(width, 3840),  # Ограничиваем максимальный размер
+            "height": min(height, 2160)
+        }
+        return region, None
+
+    def grab_visible(self, sct, region, monitors, src_rect):
+        """Захватывает видимый прямоугольник источника (BGRA).
+
+        Для нескольких мониторов захватываются только пересечения видимой
+        области с каждым из них, и части сшиваются в буфер из пула.
+        """
+        sx0, sy0, sx1, sy1 = src_rect
+        area = {"left": region["left"] + sx0, "top": region["top"] + sy0,
+                "width": sx1 - sx0, "height": sy1 - sy0}
+        if not monitors or len(monitors) == 1:
+            return wrap_screenshot(sct.grab(area))
+
+        stitched = self.pool.get("stitched", (area["height"], area["width"], 4))
+        layout_key = (id(stitched), area["left"], area["top"]) + \
+            tuple((m["left"], m["top"], m["width"], m["height"]) for m in monitors)
+        if layout_key != self._stitch_layout:
+            # Промежутки между мониторами не перезаписываются, очищаем их один раз
+            stitched.fill(0)
+            self._stitch_layout = layout_key
+        area_right = area["left"] + area["width"]
+        area_bottom = area["top"] + area["height"]
+        for monitor in monitors:
+            left = max(area["left"], monitor["left"])
+            top = max(area["top"], monitor["top"])
+            right = min(area_right, monitor["left"] + monitor["width"])
+            bottom = min(area_bottom, monitor["top"] + monitor["height"])
+            if right <= left or bottom <= top:
+                continue
+            shot = wrap_screenshot(sct.grab({"left": left, "top": top,
+                                             "width": right - left, "height": bottom - top}))
+            x = left - area["left"]
+            y = top - area["top"]
+            np.copyto(stitched[y:y + shot.shape[0], x:x + shot.shape[1]], shot)
+        return stitched
+
+    def placeholder(self, message):
+        """Заполняет холст черным с поясняющей надписью"""
+        self.canvas.fill(0)
+        if message:
+            k = self.out_size[0] / PREVIEW_SIZE[0]
+            cv2.putText(self.canvas, message, (int(50 * k), int(50 * k)),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.7 * k, (255, 255, 255), max(1, int(2 * k)))
+        return self.canvas
+
+class CursorPoint(ctypes.Structure):
+    _fields_ = [("x", ctypes.c_long), ("y", ctypes.c_long)]
+
+class CursorTracker:
+    """Положение курсора и щелчки мыши для наложения на захват экрана.
+
+    Потоки захвата опрашивают его раз в кадр: на Windows - через
+    GetCursorPos и GetAsyncKeyState (единицы микросекунд), на других
+    системах - через pyautogui.position(), без отслеживания щелчков.
+    Предпросмотр, запись и буфер повтора опрашивают его одновременно,
+    поэтому положение читается в локальную структуру, а фронт нажатия
+    и список щелчков меняются под замком: щелчок, замеченный любым
+    потоком, учитывается ровно один раз.
+    """
+    CURSOR_HEIGHT = 22  # Высота стрелки в пикселях рабочего стола
+    CLICK_DURATION = 0.4
+    RING_STAGES = 8
+    VK_LBUTTON = 0x01
+    VK_RBUTTON = 0x02
+
+    def __init__(self):
+        try:
+            self.user32 = ctypes.windll.user32
+        except AttributeError:
+            self.user32 = None
+        self.lock = threading.Lock()
+        self.pressed = False
+        self.clicks = ()  # (x, y, время) недавних щелчков; кортеж заменяется целиком
+
+    def sample(self):
+        """Возвращает (x, y, время, щелчки) в координатах рабочего стола или None"""
+        if self.user32 is not None:
+            point = CursorPoint()
+            if not self.user32.GetCursorPos(ctypes.byref(point)):
+                return None
+            x, y = point.x, point.y
+            pressed = bool((self.user32.GetAsyncKeyState(self.VK_LBUTTON) |
+                            self.user32.GetAsyncKeyState(self.VK_RBUTTON)) & 0x8000)
+        else:
+            try:
+                x, y = pyautogui.position()
+            except Exception:
+                return None
+            pressed = False
+        with self.lock:
+            now = time.monotonic()
+            if pressed and not self.pressed:
+                self.clicks = self.clicks + ((x, y, now),)
+            self.pressed = pressed
+            if self.clicks and now - self.clicks[0][2] > self.CLICK_DURATION:
+                self.clicks = tuple(click for click in self.clicks if now - click[2] <= self.CLICK_DURATION)
+            clicks = self.clicks
+        return x, y, now, clicks
+
+def render_cursor_sprite(height):
+    """Рисует стрелку курсора (белую с черным контуром) высотой height, острием в (0, 0)"""
+    k = height / 19
+    points = np.int32([[0, 0], [0, 16], [4, 12], [7, 18], [9, 17], [6, 11], [11, 11]]) * 8 * k
+    shift = 3  # Координаты с 3 битами дробной части для сглаживания
+    thickness = max(1, int(round(k)))
+    width = int(12 * k) + thickness + 2
+    size = (int(19 * k) + thickness + 2, width)
+    points = points.astype(np.int32) + (thickness << shift)
+    alpha = np.zeros(size, dtype=np.uint8)
+    color = np.zeros(size + (3,), dtype=np.uint8)
+    cv2.fillPoly(alpha, [points], 255, cv2.LINE_AA, shift)
+    cv2.polylines(alpha, [points], True, 255, thickness, cv2.LINE_AA, shift)
+    cv2.fillPoly(color, [points], (255, 255, 255), cv2.LINE_AA, shift)
+    cv2.polylines(color, [points], True, (0, 0, 0), thickness, cv2.LINE_AA, shift)
+    premultiplied = color.astype(np.float32) * (alpha[..., None] / 255.0)
+    return Sprite(premultiplied, alpha, -thickness, -thickness)
+
+def render_click_ring_sprite(stage, scale):
+    """Рисует кольцо щелчка: с каждой стадией оно шире и прозрачнее"""
+    progress = (stage + 0.5) / CursorTracker.RING_STAGES
+    radius = max(2, int(round((8 + 22 * progress) * scale)))
+    thickness = max(1, int(round(3 * scale)))
+    half = radius + thickness + 1
+    alpha = np.zeros((2 * half + 1, 2 * half + 1), dtype=np.uint8)
+    cv2.circle(alpha, (half, half), radius, int(255 * (1 - progress)), thickness, cv2.LINE_AA)
+    color = np.empty(alpha.shape + (3,), dtype=np.float32)
+    color[:] = (0, 200, 255)  # Желтый в BGR
+    return Sprite(color * (alpha[..., None] / 255.0), alpha, -half, -half)
+
+# Переходы между сценами
+TRANSITION_KINDS = {"cut": "Склейка", "fade": "Наплыв", "slide": "Сдвиг"}
+
+class SceneTransition:
+    """Переход между сценами на одном выходе.
+
+    Смена scene_id в снимке запускает переход: пока он идет, каждый кадр
+    собираются обе сцены (источники обеих остаются живыми), уходящая
+    копируется в свой буфер, и результат смешивается в выходной буфер.
+    Все буферы выделены заранее под размер выхода. Время сборки кадров
+    перехода измеряется, и процентили последнего перехода показываются в
+    строке задержки: по ним видно, укладывается ли двойной захват в
+    интервал кадра.
+    """
+    def __init__(self, out_size, kind="cut", duration=0.5, tiles=None):
+        shape = (out_size[1], out_size[0], 3)
+        self.tiles = tiles  # Пул полос выхода для смешивания, или None
+        self.outgoing = np.zeros(shape, dtype=np.uint8)
+        self.output = np.zeros(shape, dtype=np.uint8)
+        self.kind = kind
+        self.duration = duration
+        self.frame_times = []  # Время сборки кадров текущего перехода, с
+        self.last_times = None  # p50 и p95 последнего перехода, мс
+        self.current = None  # Снимок сцены последнего кадра
+        self.previous = None  # Снимок уходящей сцены во время перехода
+        self.start_time = 0
+
+    def render(self, scene, render_scene):
+        """Возвращает кадр сцены.
+
+        render_scene(снимок, буфер) собирает кадр одной сцены; если буфер
+        задан, кадр должен пережить сборку следующей сцены, и его можно
+        собрать прямо в буфер, иначе возвращается любой массив выхода.
+        """
+        current = self.current
+        self.current = scene
+        if current is not None and current.scene_id != scene.scene_id:
+            self.finish()  # Прерванный переход
+            if self.kind != "cut" and self.duration > 0:
+                self.previous = current
+                self.start_time = time.monotonic()
+            else:
+                self.previous = None
+        previous = self.previous
+        if previous is None:
+            return render_scene(scene, None)
+        progress = (time.monotonic() - self.start_time) / self.duration if self.duration > 0 else 1
+        if progress >= 1:
+            self.previous = None
+            self.finish()
+            return render_scene(scene, None)
+
+        started = time.perf_counter()
+        outgoing = render_scene(previous, self.outgoing)
+        if outgoing is not self.outgoing:
+            np.copyto(self.outgoing, outgoing)
+        # Если источник новой сцены еще открывается, под ее наложениями
+        # остается чистый кадр уходящей сцены
+        incoming = render_scene(scene, None)
+        width = self.output.shape[1]
+        shift = min(width, max(0, int(width * progress)))
+
+        def blend(y0, y1):
+            if self.kind == "slide":
+                # Новая сцена въезжает справа, уходящая уезжает влево
+                np.copyto(self.output[y0:y1, :width - shift], self.outgoing[y0:y1, shift:])
+                np.copyto(self.output[y0:y1, width - shift:], incoming[y0:y1, :shift])
+            else:
+                cv2.addWeighted(self.outgoing[y0:y1], 1 - progress, incoming[y0:y1], progress, 0,
+                                dst=self.output[y0:y1])
+
+        if self.tiles is None:
+            blend(0, self.output.shape[0])
+        else:
+            self.tiles.run(self.output.shape[0], blend)
+        self.frame_times.append(time.perf_counter() - started)
+        return self.output
+
+    def reset(self):
+        """Забывает сцену прошлого сеанса: следующий кадр выводится без перехода"""
+        self.current = self.previous = None
+        self.frame_times = []
+
+    def finish(self):
+        """Запоминает процентили времени сборки кадров завершенного перехода"""
+        if self.frame_times:
+            self.last_times = np.percentile(self.frame_times, (50, 95)) * 1000
+            self.frame_times = []
+
+# Файлы шрифтов для семейств из вкладки "Текст"
+FONT_FILES = {
+    "Arial": "arial.ttf",
+    "Times New Roman": "times.ttf",
+    "Courier New": "cour.ttf",
+    "Verdana": "verdana.ttf",
+}
+
+@functools.lru_cache(maxsize=64)
+def load_font(family, size):
+    """Загружает шрифт один раз для каждой пары семейство/размер"""
+    for filename in (FONT_FILES.get(family, "arial.ttf"), "arial.ttf"):
+        try:
+            return ImageFont.truetype(filename, size)
+        except Exception:
+            continue
+    return ImageFont.load_default()
+
+class Sprite:
+    """Предрастеризованное изображение с премультиплицированной альфой.
+
+    Наложение выполняется только в области спрайта и пишет результат прямо
+    в кадр через собственный буфер scratch, без выделения памяти.
+    """
+    __slots__ = ("premultiplied", "inv_alpha", "scratch", "width", "height", "offset_x", "offset_y")
+
+    def __init__(self, premultiplied, alpha, offset_x=0, offset_y=0):
+        self.premultiplied = np.clip(premultiplied + 0.5, 0, 255).astype(np.uint8)
+        self.inv_alpha = np.repeat(255 - alpha[..., None], 3, axis=2).astype(np.uint8)
+        self.scratch = np.empty_like(self.premultiplied)
+        self.height, self.width = alpha.shape
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+def blend_sprite(frame, sprite, x, y):
+    """Накладывает спрайт на кадр в точке (x, y) с обрезкой по границам"""
+    frame_h, frame_w = frame.shape[:2]
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(frame_w, x + sprite.width), min(frame_h, y + sprite.height)
+    if x1 <= x0 or y1 <= y0:
+        return
+    sx0, sy0 = x0 - x, y0 - y
+    sx1, sy1 = sx0 + (x1 - x0), sy0 + (y1 - y0)
+    roi = frame[y0:y1, x0:x1]
+    scratch = sprite.scratch[sy0:sy1, sx0:sx1]
+    cv2.multiply(roi, sprite.inv_alpha[sy0:sy1, sx0:sx1], dst=scratch, scale=1 / 255.0)
+    cv2.add(scratch, sprite.premultiplied[sy0:sy1, sx0:sx1], dst=roi)
+
+def parse_color(color, default=(255, 255, 255)):
+    """Преобразует цвет Tk/PIL ("#RRGGBB", имя) в кортеж RGB"""
+    try:
+        return ImageColor.getrgb(color)[:3]
+    except Exception:
+        return default
+
+def render_text_sprite(text, font, font_color, background_color=None, background_alpha=0):
+    """Растеризует текст (и подложку) в спрайт"""
+    if not text:
+        return None
+    left, top, right, bottom = font.getbbox(text)
+    width, height = max(1, right - left), max(1, bottom - top)
+
+    mask = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, fill=255, font=font)
+    return sprite_from_mask(np.asarray(mask, dtype=np.uint8), left, top,
+                            font_color, background_color, background_alpha)
+
+def sprite_from_mask(mask, left, top, font_color, background_color=None, background_alpha=0):
+    """Окрашивает маску текста (и подложку) в спрайт со смещением (left, top)"""
+    text_alpha = mask.astype(np.float32)[..., None] / 255.0
+    text_bgr = np.array(parse_color(font_color)[::-1], dtype=np.float32)
+
+    if background_color and background_alpha > 0:
+        bg_alpha = background_alpha / 255.0
+        bg_bgr = np.array(parse_color(background_color, (0, 0, 0))[::-1], dtype=np.float32)
+        alpha = text_alpha + bg_alpha * (1.0 - text_alpha)
+        premultiplied = text_bgr * text_alpha + bg_bgr * bg_alpha * (1.0 - text_alpha)
+    else:
+        alpha = text_alpha
+        premultiplied = text_bgr * text_alpha
+
+    return Sprite(premultiplied, (alpha[..., 0] * 255 + 0.5).astype(np.uint8), left, top)
+
+@functools.lru_cache(maxsize=16)
+def load_overlay_image(path, mtime):
+    """Декодирует файл изображения один раз для данного времени изменения.
+
+    Возвращает (премультиплицированный BGR float32, альфа float32 0..1)
+    в исходном размере; массивы общие для всех выходов и не изменяются.
+    Для нечитаемого файла возвращает None: неудача тоже кэшируется, и
+    ошибка печатается один раз, а не на каждом кадре.
+    """
+    try:
+        image = read_image(path, cv2.IMREAD_UNCHANGED)
+    except Exception as e:
+        print(f"Ошибка чтения изображения {path}: {e}")
+        return None
+    if image is None:
+        print(f"Ошибка чтения изображения {path}: формат не распознан")
+        return None
+    if image.dtype == np.uint16:
+        image = (image // 257).astype(np.uint8)
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGRA)
+    elif image.shape[2] == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    alpha = image[..., 3].astype(np.float32) / 255.0
+    premultiplied = image[..., :3].astype(np.float32) * alpha[..., None]
+    return premultiplied, alpha
+
+# Поля шаблонного текста: {time}, {time:%H:%M}, {date}, {elapsed}, {scene}, {frame:06d}
+TEMPLATE_FIELD = re.compile(r"\{(time|date|elapsed|scene|frame)(?::([^}]*))?\}")
+
+def is_template(text):
+    return "{" in text and TEMPLATE_FIELD.search(text) is not None
+
+def format_overlay_text(template, context):
+    """Подставляет значения полей шаблона; неизвестные форматы остаются как есть"""
+    now = context.get("now") or datetime.now()
+
+    def field(match):
+        name, spec = match.group(1), match.group(2)
+        try:
+            if name == "time":
+                return now.strftime(spec or "%H:%M:%S")
+            if name == "date":
+                return now.strftime(spec or "%d.%m.%Y")
+            if name == "elapsed":
+                seconds = int(context.get("elapsed", 0))
+                return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+            if name == "scene":
+                return context.get("scene", "")
+            return format(context.get("frame", 0), spec or "d")
+        except ValueError:
+            return match.group(0)
+
+    return TEMPLATE_FIELD.sub(field, template)
+
+class GlyphAtlas:
+    """Кэш растеризованных глифов одного шрифта и размера.
+
+    Строка собирается из масок отдельных символов по их ширине продвижения,
+    поэтому смена цифр в часах не требует растеризации всей строки шрифтом.
+    Кернинг между символами не учитывается.
+    """
+    def __init__(self, font):
+        self.font = font
+        self.glyphs = {}  # символ -> (маска или None, left, top, продвижение)
+
+    def glyph(self, char):
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            left, top, right, bottom = self.font.getbbox(char)
+            mask = None
+            if right > left and bottom > top:
+                image = Image.new('L', (right - left, bottom - top), 0)
+                ImageDraw.Draw(image).text((-left, -top), char, fill=255, font=self.font)
+                mask = np.asarray(image, dtype=np.uint8)
+            glyph = (mask, left, top, self.font.getlength(char))
+            self.glyphs[char] = glyph
+        return glyph
+
+    def render_mask(self, text):
+        """Собирает маску строки; возвращает (маска, left, top) или None"""
+        placed = []
+        pen = 0.0
+        x0 = y0 = float('inf')
+        x1 = y1 = float('-inf')
+        for char in text:
+            mask, left, top, advance = self.glyph(char)
+            if mask is not None:
+                x = int(round(pen)) + left
+                placed.append((mask, x, top))
+                x0, y0 = min(x0, x), min(y0, top)
+                x1, y1 = max(x1, x + mask.shape[1]), max(y1, top + mask.shape[0])
+            pen += advance
+        if not placed:
+            return None
+        result = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        for mask, x, top in placed:
+            region = result[top - y0:top - y0 + mask.shape[0], x - x0:x - x0 + mask.shape[1]]
+            np.maximum(region, mask, out=region)
+        return result, x0, y0
+
+@functools.lru_cache(maxsize=32)
+def glyph_atlas(family, size):
+    return GlyphAtlas(load_font(family, size))
+
+class OverlayRenderer:
+    """Накладывает текстовые объекты на кадр одного выходного разрешения.
+
+    Геометрия наложений хранится в нормализованных координатах, а каждый
+    рендерер растеризует спрайты сразу в размере своего выхода, поэтому
+    текст в предпросмотре и в записи совпадает без масштабирования кадров.
+    У каждого выхода свой рендерер и свой кэш спрайтов.
+    """
+    MAX_SPRITES = 256
+    HIT_CELL = 64  # Размер ячейки сетки индекса попаданий, пикселей
+
+    MTIME_CHECK_INTERVAL = 1.0  # Как часто проверять, не изменился ли файл изображения
+
+    def __init__(self, out_size):
+        self.out_size = out_size
+        self.lock = threading.Lock()
+        self._sprites = {}
+        self._dynamic = {}  # Шаблонные тексты: ключ -> (последняя строка, спрайт)
+        self._image_sprites = {}
+        self._mtimes = {}  # Путь -> (время следующей проверки, mtime)
+        self._hit_version = None
+        self._hit_grid = {}
+
+    def pixel_font_size(self, text_obj):
+        """Размер шрифта в пикселях этого выхода"""
+        return max(1, int(round(text_obj.font_size * text_obj.scale * self.out_size[1] / REFERENCE_SIZE[1])))
+
+    def placement(self, text_obj, context=None):
+        """Возвращает спрайт текста и его левый верхний угол в пикселях выхода"""
+        sprite = self.sprite_for(text_obj, context)
+        if sprite is None:
+            return None, 0, 0
+        x = int(round(text_obj.x * self.out_size[0])) + sprite.offset_x
+        y = int(round(text_obj.y * self.out_size[1])) + sprite.offset_y
+        return sprite, x, y
+
+    def sprite_for(self, text_obj, context=None):
+        font_size = self.pixel_font_size(text_obj)
+        key = (text_obj.text, text_obj.font_family, font_size, text_obj.font_color,
+               text_obj.background_color, text_obj.background_alpha)
+        if is_template(text_obj.text):
+            return self.dynamic_sprite(key, text_obj, font_size, context)
+        with self.lock:
+            sprite = self._sprites.get(key)
+            if sprite is None and key not in self._sprites:
+                if len(self._sprites) >= self.MAX_SPRITES:
+                    self._sprites.clear()
+                font = load_font(text_obj.font_family, font_size)
+                sprite = render_text_sprite(
+                    text_obj.text, font, text_obj.font_color,
+                    text_obj.background_color, text_obj.background_alpha)
+                self._sprites[key] = sprite
+            return sprite
+
+    def dynamic_sprite(self, key, text_obj, font_size, context):
+        """Спрайт шаблонного текста: пересобирается только при смене строки.
+
+        Без контекста (проверка попадания) возвращается последний спрайт.
+        """
+        with self.lock:
+            cached = self._dynamic.get(key)
+            if context is None:
+                if cached is not None:
+                    return cached[1]
+                context = {}
+            text = format_overlay_text(text_obj.text, context)
+            if cached is not None and cached[0] == text:
+                return cached[1]
+            rendered = glyph_atlas(text_obj.font_family, font_size).render_mask(text)
+            sprite = None
+            if rendered is not None:
+                mask, left, top = rendered
+                sprite = sprite_from_mask(mask, left, top, text_obj.font_color,
+                                          text_obj.background_color, text_obj.background_alpha)
+            if cached is None and len(self._dynamic) >= self.MAX_SPRITES:
+                self._dynamic.clear()
+            self._dynamic[key] = (text, sprite)
+            return sprite
+
+    def file_mtime(self, path):
+        """Время изменения файла, перечитываемое не чаще MTIME_CHECK_INTERVAL"""
+        now = time.monotonic()
+        cached = self._mtimes.get(path)
+        if cached is not None and now < cached[0]:
+            return cached[1]
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        self._mtimes[path] = (now + self.MTIME_CHECK_INTERVAL, mtime)
+        return mtime
+
+    def image_placement(self, image_obj):
+        """Возвращает спрайт изображения в размере выхода и его левый верхний угол"""
+        mtime = self.file_mtime(image_obj.path)
+        if mtime is None:
+            return None, 0, 0
+        out_w, out_h = self.out_size
+        pixel_width = max(1, int(round(image_obj.width * out_w)))
+        key = (image_obj.path, mtime, pixel_width, image_obj.opacity)
+        with self.lock:
+            sprite = self._image_sprites.get(key)
+            if sprite is None:
+                # Файл изменился или поменялся размер: старые спрайты этого файла не нужны
+                for old_key in [k for k in self._image_sprites if k[0] == image_obj.path]:
+                    if old_key[1] != mtime or len(self._image_sprites) >= self.MAX_SPRITES:
+                        del self._image_sprites[old_key]
+                loaded = load_overlay_image(image_obj.path, mtime)
+                if loaded is None:
+                    return None, 0, 0
+                premultiplied, alpha = loaded
+                pixel_height = max(1, int(round(pixel_width * alpha.shape[0] / alpha.shape[1])))
+                size = (pixel_width, pixel_height)
+                scaled = cv2.resize(premultiplied, size, interpolation=cv2.INTER_AREA) * image_obj.opacity
+                scaled_alpha = cv2.resize(alpha, size, interpolation=cv2.INTER_AREA) * image_obj.opacity
+                sprite = Sprite(scaled.reshape(pixel_height, pixel_width, 3),
+                                (scaled_alpha * 255 + 0.5).astype(np.uint8))
+                self._image_sprites[key] = sprite
+
+        margin = int(round(image_obj.margin * out_h))
+        anchor = image_obj.anchor
+        if anchor == "center":
+            return sprite, (out_w - sprite.width) // 2, (out_h - sprite.height) // 2
+        x = out_w - sprite.width - margin if anchor.endswith("right") else margin
+        y = out_h - sprite.height - margin if anchor.startswith("bottom") else margin
+        return sprite, x, y
+
+    def _build_hit_index(self, scene):
+        """Строит сетку ячеек с прямоугольниками видимых текстов (верхние первыми)"""
+        grid = {}
+        cell = self.HIT_CELL
+        for index in range(len(scene.text_objects) - 1, -1, -1):
+            text_obj = scene.text_objects[index]
+            if not text_obj.visible:
+                continue
+            sprite, x0, y0 = self.placement(text_obj)
+            if sprite is None:
+                continue
+            rect = (index, x0, y0, x0 + sprite.width, y0 + sprite.height)
+            for cy in range(y0 // cell, (rect[4] - 1) // cell + 1):
+                for cx in range(x0 // cell, (rect[3] - 1) // cell + 1):
+                    grid.setdefault((cx, cy), []).append(rect)
+        self._hit_grid = grid
+        self._hit_version = scene.version
+
+    def hit_test(self, scene, x, y):
+        """Возвращает индекс верхнего текста в точке или -1.
+
+        Индекс перестраивается только при смене версии снимка сцены.
+        """
+        if self._hit_version != scene.version:
+            self._build_hit_index(scene)
+        for index, x0, y0, x1, y1 in self._hit_grid.get((int(x) // self.HIT_CELL, int(y) // self.HIT_CELL), ()):
+            if x0 <= x < x1 and y0 <= y < y1:
+                return index
+        return -1
+
+    def apply(self, frame, text_objects, image_objects=(), context=None, tiles=None):
+        """Накладывает видимые изображения, а поверх них тексты, на кадр на месте.
+
+        context - значения полей шаблонов ("elapsed", "scene", "frame"); номер
+        кадра задает вызывающий, так как за один выходной кадр apply может
+        вызываться для двух сцен перехода. Время добавляется здесь. С пулом
+        полос tiles спрайты готовятся последовательно, а смешиваются по
+        полосам кадра.
+        """
+        context = dict(context or {}, now=datetime.now())
+        placed = []
+        for image_obj in image_objects:
+            if not image_obj.visible:
+                continue
+            try:
+                sprite, x, y = self.image_placement(image_obj)
+                if sprite is not None:
+                    placed.append((sprite, x, y))
+            except Exception as e:
+                print(f"Ошибка наложения изображения: {e}")
+        for text_obj in text_objects:
+            if not text_obj.visible:
+                continue
+            try:
+                sprite, x, y = self.placement(text_obj, context)
+                if sprite is not None:
+                    placed.append((sprite, x, y))
+            except Exception as e:
+                print(f"Ошибка наложения текста: {e}")
+
+        # Буфер scratch принадлежит спрайту, поэтому повторно размещенный
+        # спрайт нельзя смешивать в разных полосах одновременно
+        if tiles is None or tiles.threads == 1 or len({id(item[0]) for item in placed}) != len(placed):
+            for sprite, x, y in placed:
+                blend_sprite(frame, sprite, x, y)
+        elif placed:
+            def blend(y0, y1):
+                band = frame[y0:y1]
+                for sprite, x, y in placed:
+                    blend_sprite(band, sprite, x, y - y0)
+            tiles.run(frame.shape[0], blend)
+        return frame
+
+class ReplayBuffer:
+    """Кольцевой буфер последних секунд видео и аудио в памяти.
+
+    Кадры хранятся сжатыми в JPEG, поэтому каждый кадр ключевой и буфер
+    можно резать на любом кадре. Старые кадры вытесняются по длительности
+    и по бюджету памяти, так что объем не растет со временем работы.
+    Кадры записи приходят через offer_frame: поток записи только копирует
+    кадр в свободный буфер, а сжимает его поток буфера повтора.
+    """
+    PENDING_FRAMES = 3  # Буферы несжатых кадров между потоком записи и сжатием
+
+    def __init__(self, seconds=60, budget_mb=512, jpeg_quality=85):
+        self.seconds = seconds
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        self.lock = threading.Lock()
+        self.frames = collections.deque()  # (время, JPEG)
+        self.audio = collections.deque()  # (время, блок int16)
+        self.size_bytes = 0
+        self.active = False
+        self.pending = queue.Queue()  # (время, кадр), ждущие сжатия
+        self.spare = queue.Queue()  # Освободившиеся буферы кадров
+        self.allocated = 0
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.audio.clear()
+            self.size_bytes = 0
+
+    def push_frame(self, frame, timestamp):
+        """Сжимает кадр и добавляет его в буфер"""
+        ok, encoded = cv2.imencode('.jpg', frame, self.encode_params)
+        if not ok:
+            return
+        with self.lock:
+            self.frames.append((timestamp, encoded))
+            self.size_bytes += encoded.nbytes
+            self._trim(timestamp)
+
+    def offer_frame(self, frame, timestamp):
+        """Копирует кадр в свободный буфер и ставит в очередь на сжатие.
+
+        Если все буферы заняты, кадр пропускается: поток записи никогда
+        не ждет буфер повтора.
+        """
+        try:
+            buffer = self.spare.get_nowait()
+        except queue.Empty:
+            if self.allocated >= self.PENDING_FRAMES:
+                return
+            self.allocated += 1
+            buffer = None
+        if buffer is None or buffer.shape != frame.shape:
+            buffer = np.empty(frame.shape, dtype=frame.dtype)
+        np.copyto(buffer, frame)
+        self.pending.put((timestamp, buffer))
+
+    def encode_pending(self, timeout=0):
+        """Сжимает один кадр из очереди offer_frame; False, если очередь пуста"""
+        try:
+            timestamp, buffer = self.pending.get(timeout=timeout) if timeout else self.pending.get_nowait()
+        except queue.Empty:
+            return False
+        try:
+            self.push_frame(buffer, timestamp)
+        finally:
+            self.spare.put(buffer)
+        return True
+
+    def push_audio(self, block, timestamp):
+        """Добавляет блок аудио (float32 [-1, 1]) в буфер"""
+        samples = (np.clip(block, -1.0, 1.0) * 32767).astype(np.int16)
+        with self.lock:
+            self.audio.append((timestamp, samples))
+            self.size_bytes += samples.nbytes
+            self._trim(timestamp)
+
+    def _trim(self, now):
+        """Вытесняет старые данные; вызывается и для кадров, и для аудио.
+
+        Аудио обрезается по времени независимо от кадров, поэтому буфер не
+        растет, даже когда кадры не поступают (например, на паузе записи).
+        """
+        cutoff = now - self.seconds
+        while self.frames and (self.frames[0][0] < cutoff or self.size_bytes > self.budget_bytes):
+            _, encoded = self.frames.popleft()
+            self.size_bytes -= encoded.nbytes
+        # Пока есть кадры, аудио начинается не раньше первого из них
+        start = max(cutoff, self.frames[0][0]) if self.frames else cutoff
+        while self.audio and (self.audio[0][0] < start or self.size_bytes > self.budget_bytes):
+            _, samples = self.audio.popleft()
+            self.size_bytes -= samples.nbytes
+
+    def snapshot(self):
+        """Возвращает копии списков кадров и аудио для сохранения"""
+        with self.lock:
+            return list(self.frames), list(self.audio)
+
+def save_replay_file(frames, audio, video_path, sample_rate, frame_size):
+    """Записывает содержимое буфера повтора в AVI (и WAV рядом с ним)"""
+    duration = frames[-1][0] - frames[0][0]
+    fps = (len(frames) - 1) / duration if duration > 0 else 30.0
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'XVID'), fps, frame_size)
+    try:
+        for _, encoded in frames:
+            frame = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+            if frame is not None:
+                writer.write(frame)
+    finally:
+        writer.release()
+
+    if audio:
+        samples = np.concatenate([block for _, block in audio])
+        write(os.path.splitext(video_path)[0] + ".wav", sample_rate, samples)
+
+class LatencyTracker:
+    """Отметки времени каждого кадра на этапах конвейера.
+
+    Кадр получает слот в кольцевом массиве при захвате, и каждый этап
+    ставит в этот слот свое время. Поток-производитель пишет в слот без
+    блокировок, а интерфейс считает процентили по копии массива:
+    недописанные строки просто не попадают в статистику.
+    """
+    def __init__(self, name, hops, size=4096):
+        self.name = name
+        self.hops = hops
+        self.hop_index = {hop: i for i, hop in enumerate(hops)}
+        self.size = size
+        self.times = np.full((size, len(hops)), np.nan)
+        self.frame_ids = np.full(size, -1, dtype=np.int64)
+        self.next_frame = 0
+
+    def begin(self):
+        """Отмечает захват нового кадра и возвращает его слот"""
+        frame_id = self.next_frame
+        self.next_frame += 1
+        slot = frame_id % self.size
+        self.times[slot] = np.nan
+        self.frame_ids[slot] = frame_id
+        self.times[slot, 0] = time.perf_counter()
+        return slot
+
+    def mark(self, slot, hop):
+        self.times[slot, self.hop_index[hop]] = time.perf_counter()
+
+    def percentiles(self, q=(50, 95, 99)):
+        """Процентили задержки от захвата до последнего этапа, мс"""
+        times = self.times.copy()
+        total = times[:, -1] - times[:, 0]
+        total = total[~np.isnan(total)]
+        if not len(total):
+            return None
+        return np.percentile(total, q) * 1000
+
+    def write_trace(self, f):
+        """Пишет строки CSV: конвейер, кадр, этап, время, мс от захвата"""
+        times = self.times.copy()
+        frame_ids = self.frame_ids.copy()
+        for slot in np.argsort(frame_ids):
+            if frame_ids[slot] < 0 or np.isnan(times[slot, 0]):
+                continue
+            grab = times[slot, 0]
+            for hop, stamp in zip(self.hops, times[slot]):
+                if not np.isnan(stamp):
+                    f.write(f"{self.name},{frame_ids[slot]},{hop},{stamp:.6f},{(stamp - grab) * 1000:.3f}\n")
+
+# Имена потоков, созданных не модулем threading (callback-и аудио), для профилировщика
+native_thread_names = {}
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик всех потоков программы.
+
+    Отдельный поток с заданным интервалом снимает стеки через
+    sys._current_frames() и считает одинаковые стеки по потокам. Это видит
+    потоки предпросмотра, записи и аудио, которые cProfile не охватывает,
+    и почти не замедляет их. Результат - текстовый отчет по потокам и файл
+    свернутых стеков для flamegraph.pl или speedscope.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()  # (поток, кадры от корня) -> число сэмплов
+        self.labels = {}  # объект кода -> подпись кадра
+        self.samples = 0
+        self.running = False
+        self.thread = None
+        self.started_at = None
+        self.duration = 0.0
+
+    def start(self):
+        self.running = True
+        self.started_at = time.perf_counter()
+        self.thread = threading.Thread(target=self.sample_loop, daemon=True, name="profiler")
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        self.duration = time.perf_counter() - self.started_at
+
+    def frame_label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self.labels[code] = label
+        return label
+
+    def sample_loop(self):
+        own_ident = threading.get_ident()
+        while self.running:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self.frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                name = names.get(ident) or native_thread_names.get(ident, f"thread-{ident}")
+                self.stacks[(name, tuple(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def write_collapsed(self, path):
+        """Пишет стеки в свернутом формате: поток;кадр;кадр число"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for (thread_name, stack), count in sorted(self.stacks.items()):
+                f.write(";".join((thread_name,) + stack) + f" {count}\n")
+
+    def write_report(self, path, top=15):
+        """Пишет отчет: для каждого потока функции по собственному и полному времени"""
+        per_thread = collections.defaultdict(lambda: (collections.Counter(), collections.Counter()))
+        totals = collections.Counter()
+        for (thread_name, stack), count in self.stacks.items():
+            own, inclusive = per_thread[thread_name]
+            totals[thread_name] += count
+            if stack:
+                own[stack[-1]] += count
+            for label in set(stack):
+                inclusive[label] += count
+
+        lines = [f"Профиль: {self.duration:.1f} с, {self.samples} сэмплов, интервал {self.interval * 1000:.1f} мс", ""]
+        for thread_name, total in totals.most_common():
+            own, inclusive = per_thread[thread_name]
+            lines.append(f"== Поток {thread_name}: {total} сэмплов ==")
+            lines.append("  Собственное время:")
+            for label, count in own.most_common(top):
+                lines.append(f"    {count / total * 100:6.1f}%  {label}")
+            lines.append("  Полное время:")
+            for label, count in inclusive.most_common(top):
+                lines.append(f"    {count / total * 100:6.1f}%  {label}")
+            lines.append("")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines))
+
+METER_FLOOR_DB = -60.0  # Нижняя граница шкалы индикатора уровня
+METER_WIDTH = 200
+
+def level_to_fraction(level):
+    """Переводит линейный уровень в долю шкалы индикатора (в децибелах)"""
+    if level <= 0:
+        return 0.0
+    db = 20 * math.log10(level)
+    return max(0.0, min(1.0, (db - METER_FLOOR_DB) / -METER_FLOOR_DB))
+
+def open_wave_writer(path, channels, sample_rate):
+    """Открывает 16-битный WAV для последовательной записи блоков"""
+    writer = wave.open(path, 'wb')
+    writer.setnchannels(channels)
+    writer.setsampwidth(2)
+    writer.setframerate(sample_rate)
+    return writer
+
+class AudioTrack:
+    """Один аудиовход со своим потоком sounddevice и кольцевым буфером.
+
+    Callback только копирует блок в заранее выделенное кольцо и сдвигает
+    счетчик записанных сэмплов. Время первого сэмпла запоминается, чтобы
+    микшер мог выровнять дорожки разных устройств между собой.
+    """
+    RING_SECONDS = 4.0
+
+    def __init__(self, name, device=None, gain=1.0, muted=False, slot=0, dsp=False):
+        self.name = name
+        self.dsp = dsp  # Пропускать ли дорожку через цепочку обработки сцены
+        self.dsp_chain = None
+        self.slot = slot  # Номер дорожки в настройках сцены
+        self.device = device
+        self.gain = gain
+        self.muted = muted
+        info = sd.query_devices(device, 'input')
+        self.channels = max(1, min(2, int(info['max_input_channels'])))
+        self.sample_rate = int(info['default_samplerate'])
+        self.capacity = int(self.sample_rate * self.RING_SECONDS)
+        self.ring = np.zeros((self.capacity, self.channels), dtype=np.float32)
+        self.written = 0  # Всего записано сэмплов, растет монотонно
+        self.start_time = None
+        self.position = None  # Дробная позиция чтения микшера в сэмплах дорожки
+        self.stream = None
+        # Индикаторы уровня: callback накапливает пик и сумму квадратов в
+        # заранее выделенных массивах, интерфейс забирает их и обнуляет
+        self.meter_scratch = np.empty((4096, self.channels), dtype=np.float32)
+        self.meter_block_peak = np.zeros(self.channels, dtype=np.float32)
+        self.meter_block_sum = np.zeros(self.channels, dtype=np.float64)
+        self.meter_peak = np.zeros(self.channels, dtype=np.float32)
+        self.meter_sum = np.zeros(self.channels, dtype=np.float64)
+        self.meter_count = 0
+
+    def start(self):
+        self.stream = sd.InputStream(device=self.device, channels=self.channels,
+                                     samplerate=self.sample_rate, dtype='float32',
+                                     callback=self.callback)
+        self.stream.start()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def callback(self, indata, frames, time_info, status):
+        """Callback функция записи аудио: копирует блок в кольцо"""
+        if status:
+            print(f"Аудио ошибка ({self.name}): {status}")
+        if self.start_time is None:
+            # Callback идет в потоке PortAudio без имени - подписываем его для профилировщика
+            native_thread_names[threading.get_ident()] = f"audio-{self.name}"
+            self.start_time = time.monotonic() - frames / self.sample_rate
+        pos = self.written % self.capacity
+        first = min(frames, self.capacity - pos)
+        self.ring[pos:pos + first] = indata[:first]
+        if first < frames:
+            self.ring[:frames - first] = indata[first:]
+        self.written += frames
+        self.measure(indata, frames)
+
+    def measure(self, indata, frames):
+        """Накапливает пик и сумму квадратов блока по каналам без выделения памяти"""
+        if frames > len(self.meter_scratch):
+            self.meter_scratch = np.empty((frames, self.channels), dtype=np.float32)
+        scratch = self.meter_scratch[:frames]
+        np.abs(indata, out=scratch)
+        np.max(scratch, axis=0, out=self.meter_block_peak)
+        np.maximum(self.meter_peak, self.meter_block_peak, out=self.meter_peak)
+        np.multiply(scratch, scratch, out=scratch)
+        np.sum(scratch, axis=0, out=self.meter_block_sum)
+        np.add(self.meter_sum, self.meter_block_sum, out=self.meter_sum)
+        self.meter_count += frames
+
+    def read_levels(self):
+        """Возвращает (пики, RMS) по каналам с прошлого чтения и обнуляет накопители.
+
+        Вызывается из потока интерфейса без блокировок: если callback успеет
+        добавить блок между чтением и обнулением, потеряется один блок
+        индикации, что на глаз незаметно.
+        """
+        count = self.meter_count
+        peaks = self.meter_peak.tolist()
+        sums = self.meter_sum.tolist()
+        self.meter_peak.fill(0)
+        self.meter_sum.fill(0)
+        self.meter_count = 0
+        rms = [math.sqrt(total / count) if count else 0.0 for total in sums]
+        return peaks, rms
+
+    def prepare(self, block, out_rate):
+        """Выделяет буферы передискретизации под блок микшера"""
+        self.step = self.sample_rate / out_rate
+        self.offsets = np.arange(block, dtype=np.float64) * self.step
+        self.pos = np.empty(block, dtype=np.float64)
+        self.pos_floor = np.empty(block, dtype=np.float64)
+        self.index = np.empty(block, dtype=np.intp)
+        self.index_next = np.empty(block, dtype=np.intp)
+        self.frac = np.empty((block, 1), dtype=np.float32)
+        self.frac_flat = self.frac[:, 0]
+        self.left = np.empty((block, self.channels), dtype=np.float32)
+        self.right = np.empty((block, self.channels), dtype=np.float32)
+        self.scaled = np.empty((block, self.channels), dtype=np.float32)
+        self.pcm = np.zeros((block, self.channels), dtype=np.int16)
+        self.block_span = block * self.step
+
+    def ready(self):
+        """Есть ли в кольце все сэмплы для следующего блока"""
+        return self.position is not None and self.written >= self.position + self.block_span + 2
+
+    def read_block(self):
+        """Читает следующий блок в частоте микшера с линейной интерполяцией"""
+        # Если микшер отстал больше чем на кольцо, старые сэмплы уже затерты
+        if self.written - self.position > self.capacity - self.block_span - 2:
+            self.position = float(self.written - self.capacity // 2)
+        np.add(self.offsets, self.position, out=self.pos)
+        np.floor(self.pos, out=self.pos_floor)
+        np.subtract(self.pos, self.pos_floor, out=self.frac_flat)
+        np.copyto(self.index, self.pos_floor, casting='unsafe')
+        np.add(self.index, 1, out=self.index_next)
+        # mode='wrap' сам обрабатывает переход через конец кольца; отрицательные
+        # позиции в начале записи попадают в еще не заполненную (нулевую) часть
+        np.take(self.ring, self.index, axis=0, out=self.left, mode='wrap')
+        np.take(self.ring, self.index_next, axis=0, out=self.right, mode='wrap')
+        np.subtract(self.right, self.left, out=self.right)
+        np.multiply(self.right, self.frac, out=self.right)
+        np.add(self.left, self.right, out=self.left)
+        self.position += self.block_span
+        return self.left
+
+    def skip_block(self):
+        """Пропускает блок, для которого устройство не успело дать данные"""
+        if self.position is not None:
+            self.position += self.block_span
+
+class AudioDSPConfig:
+    """Настройки цепочки обработки сцены, которые меняются во время записи.
+
+    Интерфейс правит словарь сцены source и вызывает refresh: под замком
+    публикуется копия настроек с новой версией. Поток микшера сверяет
+    версию раз в блок и перенастраивает цепочки дорожек.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.lock = threading.Lock()
+        self.version = 0
+        self.config = copy.deepcopy(source)
+
+    def refresh(self):
+        """Публикует текущие настройки сцены (вызывается из потока интерфейса)"""
+        with self.lock:
+            self.config = copy.deepcopy(self.source)
+            self.version += 1
+
+    def snapshot(self):
+        """Возвращает (версия, настройки); настройки после публикации не меняются"""
+        with self.lock:
+            return self.version, self.config
+
+class AudioDSPChain:
+    """Потоковая обработка дорожки: срез НЧ, шумовой гейт, компрессор и лимитер.
+
+    Работает в потоке микшера поблочно. Фильтр хранит состояние между
+    блоками (zi для sosfilt), а гейт и компрессор считают уровень блока и
+    плавно ведут усиление линейной рампой внутри блока, поэтому на стыках
+    блоков нет щелчков. Настройки можно сменить на ходу через configure.
+    """
+    def __init__(self, config, sample_rate, channels, block):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_time = block / sample_rate
+        self.highpass_key = None
+        self.sos = None
+        self.configure(config)
+        self.gate_gain = 1.0
+        self.comp_gain = 1.0
+        self.ramp = np.linspace(0.0, 1.0, block, endpoint=False, dtype=np.float32)[:, None]
+        self.gain_curve = np.empty((block, 1), dtype=np.float32)
+        self.scratch = np.empty((block, channels), dtype=np.float32)
+
+    def configure(self, config):
+        """Применяет настройки; фильтр и его состояние пересоздаются, только если он изменился"""
+        highpass = config["highpass"]
+        highpass_key = (highpass["enabled"], highpass["cutoff"])
+        if highpass_key != self.highpass_key:
+            self.highpass_key = highpass_key
+            self.sos = None
+            if highpass["enabled"]:
+                self.sos = butter(2, highpass["cutoff"], btype='highpass', fs=self.sample_rate, output='sos')
+                self.zi = np.zeros((self.sos.shape[0], 2, self.channels), dtype=np.float64)
+        self.config = config
+
+    def coefficient(self, time_ms):
+        """Коэффициент сглаживания за один блок для постоянной времени"""
+        return math.exp(-self.block_time / max(time_ms / 1000.0, 1e-4))
+
+    def block_level_db(self, samples):
+        np.multiply(samples, samples, out=self.scratch)
+        mean_square = float(self.scratch.mean())
+        return 10 * math.log10(mean_square) if mean_square > 1e-12 else -120.0
+
+    def apply_gain(self, samples, start, end):
+        """Умножает блок на усиление, линейно меняющееся от start к end"""
+        np.multiply(self.ramp, end - start, out=self.gain_curve)
+        np.add(self.gain_curve, start, out=self.gain_curve)
+        np.multiply(samples, self.gain_curve, out=samples)
+
+    def process(self, samples):
+        """Обрабатывает блок float32 на месте"""
+        if self.sos is not None:
+            filtered, self.zi = sosfilt(self.sos, samples, axis=0, zi=self.zi)
+            samples[...] = filtered
+
+        gate = self.config["gate"]
+        if gate["enabled"]:
+            target = 1.0 if self.block_level_db(samples) > gate["threshold_db"] else 0.0
+            # Открывается гейт за attack, закрывается за release
+            coef = self.coefficient(gate["attack_ms"] if target > self.gate_gain else gate["release_ms"])
+            new_gain = target + (self.gate_gain - target) * coef
+            self.apply_gain(samples, self.gate_gain, new_gain)
+            self.gate_gain = new_gain
+
+        comp = self.config["compressor"]
+        if comp["enabled"]:
+            over = self.block_level_db(samples) - comp["threshold_db"]
+            reduction_db = over * (1.0 - 1.0 / comp["ratio"]) if over > 0 else 0.0
+            target = 10 ** ((comp["makeup_db"] - reduction_db) / 20)
+            # Усиление снижается за attack, восстанавливается за release
+            coef = self.coefficient(comp["attack_ms"] if target < self.comp_gain else comp["release_ms"])
+            new_gain = target + (self.comp_gain - target) * coef
+            self.apply_gain(samples, self.comp_gain, new_gain)
+            self.comp_gain = new_gain
+            # Жесткий лимитер страхует от перегрузки на быстрых пиках
+            ceiling = 10 ** (comp["ceiling_db"] / 20)
+            np.clip(samples, -ceiling, ceiling, out=samples)
+        return samples
+
+class AudioMixer:
+    """Сводит несколько аудиодорожек в один поток и пишет его в WAV.
+
+    Работает в отдельном потоке блоками по BLOCK сэмплов: дорожки
+    выравниваются по времени первого сэмпла, приводятся к частоте микшера,
+    умножаются на усиление и складываются. Все буферы выделяются при
+    старте, поэтому на каждый блок память не выделяется. Без path файл не
+    пишется; sink(блок, время начала блока) получает каждый сведенный блок
+    (так буфер повтора слушает те же дорожки и обработку, что и запись).
+    """
+    BLOCK = 1024
+    CHANNELS = 2
+    STALL_TIMEOUT = 0.25  # Через сколько секунд отставшая дорожка сводится тишиной
+
+    def __init__(self, tracks, path, sample_rate=48000, stems=False, dsp_config=None, sink=None):
+        self.tracks = tracks
+        self.dsp_config = dsp_config  # AudioDSPConfig сцены или None
+        self.dsp_version = None
+        self.sink = sink
+        self.path = path
+        self.sample_rate = sample_rate
+        self.stems = stems
+        self.running = False
+        self.paused = False
+        self.thread = None
+        self.blocks = 0
+        self.start_time = None
+        self.writer = None
+        self.stem_writers = []
+        self.mix = np.zeros((self.BLOCK, self.CHANNELS), dtype=np.float32)
+        self.scaled = np.empty_like(self.mix)
+        self.pcm = np.empty((self.BLOCK, self.CHANNELS), dtype=np.int16)
+
+    def stem_path(self, index):
+        return f"{os.path.splitext(self.path)[0]}_track{index + 1}.wav"
+
+    def start(self):
+        try:
+            if self.path:
+                self.writer = open_wave_writer(self.path, self.CHANNELS, self.sample_rate)
+            if self.path and self.stems:
+                self.stem_writers = [open_wave_writer(self.stem_path(i), track.channels, self.sample_rate)
+                                     for i, track in enumerate(self.tracks)]
+            dsp = None
+            if self.dsp_config is not None:
+                self.dsp_version, dsp = self.dsp_config.snapshot()
+            for track in self.tracks:
+                track.prepare(self.BLOCK, self.sample_rate)
+                if track.dsp and dsp is not None:
+                    track.dsp_chain = AudioDSPChain(dsp, self.sample_rate, track.channels, self.BLOCK)
+                track.start()
+        except Exception:
+            self.stop()
+            raise
+        self.start_time = time.monotonic()
+        self.running = True
+        self.thread = threading.Thread(target=self.worker, daemon=True, name="audio-mixer")
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+            self.thread = None
+        for track in self.tracks:
+            track.stop()
+        for writer in [self.writer] + self.stem_writers:
+            if writer is not None:
+                writer.close()
+        self.writer = None
+        self.stem_writers = []
+
+    def write_pcm(self, writer, samples, scaled, pcm):
+        """Переводит float32 блок в int16 без выделения памяти и пишет его"""
+        np.clip(samples, -1.0, 1.0, out=scaled)
+        np.multiply(scaled, 32767, out=scaled)
+        np.copyto(pcm, scaled, casting='unsafe')
+        writer.writeframes(pcm)
+
+    def worker(self):
+        block_time = self.BLOCK / self.sample_rate
+        while self.running:
+            block_start = self.start_time + self.blocks * block_time
+            for track in self.tracks:
+                if track.position is None and track.start_time is not None:
+                    # Первый блок дорожки: позиция, соответствующая началу текущего блока
+                    track.position = (block_start - track.start_time) * track.sample_rate
+
+            if not all(track.ready() for track in self.tracks) and \
+                    time.monotonic() < block_start + block_time + self.STALL_TIMEOUT:
+                time.sleep(block_time / 4)
+                continue
+
+            try:
+                self.mix_block(block_start)
+            except Exception as e:
+                print(f"Ошибка сведения аудио: {e}")
+            self.blocks += 1
+
+    def mix_block(self, block_start):
+        """Сводит один блок всех дорожек, записывает его и передает в sink"""
+        if self.dsp_config is not None and self.dsp_config.version != self.dsp_version:
+            self.dsp_version, dsp = self.dsp_config.snapshot()
+            for track in self.tracks:
+                if track.dsp_chain is not None:
+                    track.dsp_chain.configure(dsp)
+        self.mix.fill(0)
+        for index, track in enumerate(self.tracks):
+            samples = None
+            if track.ready():
+                samples = track.read_block()
+                if track.dsp_chain is not None:
+                    samples = track.dsp_chain.process(samples)
+            else:
+                track.skip_block()
+
+            if self.stem_writers and not self.paused:
+                if samples is not None:
+                    self.write_pcm(self.stem_writers[index], samples, track.scaled, track.pcm)
+                else:
+                    track.pcm.fill(0)
+                    self.stem_writers[index].writeframes(track.pcm)
+
+            if samples is not None and not track.muted:
+                np.multiply(samples, track.gain, out=samples)
+                np.add(self.mix, samples, out=self.mix)  # Моно дорожка расходится на оба канала
+
+        if self.sink is not None:
+            self.sink(self.mix, block_start)
+        if self.writer is not None and not self.paused:
+            self.write_pcm(self.writer, self.mix, self.scaled, self.pcm)
+
+# Очередь и событие прогресса процессов постобработки (задаются инициализатором пула)
+job_progress_queue = None
+job_throttle_event = None
+
+FFMPEG = shutil.which("ffmpeg")
+
+def init_job_worker(progress_queue, throttle_event):
+    """Инициализатор процесса пула: сохраняет каналы связи и понижает приоритет"""
+    global job_progress_queue, job_throttle_event
+    job_progress_queue = progress_queue
+    job_throttle_event = throttle_event
+    if PSUTIL_AVAILABLE:
+        try:
+            process = psutil.Process()
+            if os.name == 'nt':
+                process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+            else:
+                process.nice(10)
+        except Exception as e:
+            print(f"Ошибка понижения приоритета задания: {e}")
+
+def report_job_progress(job_id, fraction):
+    if job_progress_queue is not None:
+        job_progress_queue.put((job_id, max(0.0, min(1.0, fraction))))
+
+def wait_while_throttled():
+    """Ждет, пока идет запись: задания не должны отнимать процессор у захвата"""
+    while job_throttle_event is not None and job_throttle_event.is_set():
+        time.sleep(0.5)
+
+def video_duration(path):
+    cap = cv2.VideoCapture(path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        return cap.get(cv2.CAP_PROP_FRAME_COUNT) / fps
+    finally:
+        cap.release()
+
+def run_ffmpeg(job_id, args, duration):
+    """Запускает ffmpeg с отчетом о прогрессе; во время записи процесс приостанавливается"""
+    proc = subprocess.Popen([FFMPEG, '-y', '-nostats', '-loglevel', 'error', '-progress', 'pipe:1'] + args,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in proc.stdout:
+        if line.startswith('out_time_ms=') and duration > 0:
+            try:
+                report_job_progress(job_id, int(line.split('=', 1)[1]) / 1e6 / duration)
+            except ValueError:
+                pass
+        if job_throttle_event is not None and job_throttle_event.is_set() and PSUTIL_AVAILABLE:
+            ffmpeg_process = psutil.Process(proc.pid)
+            ffmpeg_process.suspend()
+            try:
+                wait_while_throttled()
+            finally:
+                ffmpeg_process.resume()
+    errors = proc.stderr.read()
+    if proc.wait() != 0:
+        raise RuntimeError(f"ffmpeg завершился с кодом {proc.returncode}: {errors.strip()[-300:]}")
+
+def job_mux(job_id, video, audio, output):
+    """Объединяет видео и WAV в MKV без перекодирования"""
+    if FFMPEG is None:
+        return "skipped"
+    if not os.path.exists(audio):
+        return "skipped"
+    run_ffmpeg(job_id, ['-i', video, '-i', audio, '-map', '0:v', '-map', '1:a', '-c', 'copy', output],
+               video_duration(video))
+    return "done"
+
+def job_transcode(job_id, video, audio, output):
+    """Перекодирует XVID в H.264/AAC (без ffmpeg - в MPEG-4 средствами OpenCV)"""
+    if FFMPEG is not None:
+        args = ['-i', video]
+        if os.path.exists(audio):
+            args += ['-i', audio, '-map', '0:v', '-map', '1:a', '-c:a', 'aac', '-b:a', '160k']
+        args += ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', output]
+        run_ffmpeg(job_id, args, video_duration(video))
+        return "done"
+
+    cap = cv2.VideoCapture(video)
+    writer = None
+    try:
+        total = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 1
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        index = 0
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if writer is None:
+                writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*'mp4v'), fps,
+                                         (frame.shape[1], frame.shape[0]))
+            writer.write(frame)
+            index += 1
+            if index % 60 == 0:
+                report_job_progress(job_id, index / total)
+                wait_while_throttled()
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+    return "done"
+
+def job_thumbnail(job_id, video, output):
+    """Сохраняет миниатюру кадра из первой десятой части записи"""
+    cap = cv2.VideoCapture(video)
+    try:
+        total = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(total * 0.1))
+        ok, frame = cap.read()
+    finally:
+        cap.release()
+    if not ok:
+        raise RuntimeError("не удалось прочитать кадр")
+    height = int(frame.shape[0] * 320 / frame.shape[1])
+    cv2.imwrite(output, cv2.resize(frame, (320, height), interpolation=cv2.INTER_AREA))
+    return "done"
+
+def job_checksum(job_id, path, output):
+    """Считает SHA-256 файла и записывает его в формате sha256sum"""
+    digest = hashlib.sha256()
+    total = os.path.getsize(path) or 1
+    done = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(4 * 1024 * 1024), b''):
+            digest.update(chunk)
+            done += len(chunk)
+            report_job_progress(job_id, done / total)
+            wait_while_throttled()
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write(f"{digest.hexdigest()}  {os.path.basename(path)}\n")
+    return "done"
+
+JOB_FUNCTIONS = {"mux": job_mux, "transcode": job_transcode,
+                 "thumbnail": job_thumbnail, "checksum": job_checksum}
+JOB_PRIORITIES = {"thumbnail": 0, "mux": 1, "checksum": 2, "transcode": 3}  # Меньше - раньше
+JOB_TITLES = {"mux": "сборка", "transcode": "перекодирование",
+              "thumbnail": "миниатюра", "checksum": "контрольная сумма"}
+
+class PostProcessQueue:
+    """Очередь постобработки записей на ограниченном пуле процессов.
+
+    Задания выбираются по приоритету и зависимостям, состояние очереди
+    сохраняется в JSON в папке записей после каждого изменения, поэтому
+    после падения программы незавершенные задания запускаются снова.
+    Пока идет запись, новые задания не запускаются, а текущие ждут.
+    """
+    STATE_FILE = ".recordstudio_jobs.json"
+
+    def __init__(self, folder, max_workers=2):
+        self.state_path = os.path.join(folder, self.STATE_FILE)
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.jobs = {}  # id -> описание задания
+        self.heap = []  # (приоритет, порядковый номер, id)
+        self.progress = {}  # id -> доля выполнения
+        self.running = set()
+        self.executor = None
+        self.progress_queue = multiprocessing.Queue()
+        self.throttle = multiprocessing.Event()
+        self.stopped = False
+        self.next_id = 1
+        self.load()
+        self.thread = threading.Thread(target=self.dispatch_loop, daemon=True, name="postprocess")
+        self.thread.start()
+
+    def load(self):
+        """Загружает сохраненные задания; прерванные падением снова ставятся в очередь"""
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                jobs = json.load(f)
+        except Exception as e:
+            print(f"Ошибка загрузки очереди заданий: {e}")
+            return
+        for job in jobs:
+            if job['status'] == 'running':
+                job['status'] = 'pending'
+            self.jobs[job['id']] = job
+            self.next_id = max(self.next_id, job['id'] + 1)
+            if job['status'] == 'pending':
+                heapq.heappush(self.heap, (job['priority'], job['id'], job['id']))
+
+    def save(self):
+        """Сохраняет незавершенные задания (вызывать под self.lock)"""
+        jobs = [job for job in self.jobs.values() if job['status'] in ('pending', 'running')]
+        try:
+            temp_path = self.state_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(jobs, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.state_path)
+        except Exception as e:
+            print(f"Ошибка сохранения очереди заданий: {e}")
+
+    def add(self, kind, args, depends=None):
+        """Ставит задание в очередь и возвращает его номер"""
+        with self.lock:
+            job_id = self.next_id
+            self.next_id += 1
+            self.jobs[job_id] = {'id': job_id, 'kind': kind, 'args': list(args), 'depends': depends,
+                                 'priority': JOB_PRIORITIES[kind], 'status': 'pending', 'error': None}
+            heapq.heappush(self.heap, (JOB_PRIORITIES[kind], job_id, job_id))
+            self.save()
+        self.wakeup.set()
+        return job_id
+
+    def add_recording(self, video_path, options):
+        """Ставит стандартный набор заданий для законченной записи"""
+        base = os.path.splitext(video_path)[0]
+        audio_path = base + ".wav"
+        if options.get('thumbnail', True):
+            self.add('thumbnail', [video_path, base + ".jpg"])
+        if options.get('mux', True):
+            self.add('mux', [video_path, audio_path, base + ".mkv"])
+        checksum = None
+        if options.get('checksum', True):
+            checksum = self.add('checksum', [video_path, video_path + ".sha256"])
+        if options.get('transcode', False):
+            # Перекодирование - самое тяжелое, запускается после остальных
+            self.add('transcode', [video_path, audio_path, base + ".mp4"], depends=checksum)
+
+    def set_throttled(self, throttled):
+        """Включает торможение заданий на время записи"""
+        if throttled:
+            self.throttle.set()
+        else:
+            self.throttle.clear()
+            self.wakeup.set()
+
+    def next_job(self):
+        """Берет из кучи самое приоритетное задание с выполненными зависимостями"""
+        deferred = []
+        job = None
+        while self.heap:
+            item = heapq.heappop(self.heap)
+            candidate = self.jobs.get(item[2])
+            if candidate is None or candidate['status'] != 'pending':
+                continue
+            dependency = self.jobs.get(candidate['depends'])
+            if dependency is not None and dependency['status'] in ('pending', 'running'):
+                deferred.append(item)
+                continue
+            job = candidate
+            break
+        for item in deferred:
+            heapq.heappush(self.heap, item)
+        return job
+
+    def dispatch_loop(self):
+        while not self.stopped:
+            self.wakeup.wait(1.0)
+            self.wakeup.clear()
+            while not self.stopped and not self.throttle.is_set():
+                with self.lock:
+                    if len(self.running) >= self.max_workers:
+                        break
+                    job = self.next_job()
+                    if job is None:
+                        break
+                    job['status'] = 'running'
+                    self.running.add(job['id'])
+                    self.progress[job['id']] = 0.0
+                    self.save()
+                self.submit(job)
+
+    def submit(self, job):
+        try:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers, initializer=init_job_worker,
+                    initargs=(self.progress_queue, self.throttle))
+            future = self.executor.submit(JOB_FUNCTIONS[job['kind']], job['id'], *job['args'])
+            future.add_done_callback(lambda f, job_id=job['id']: self.finish(job_id, f))
+        except Exception as e:
+            self.finish(job['id'], None, e)
+
+    def finish(self, job_id, future, error=None):
+        if future is not None:
+            error = future.exception() if not future.cancelled() else RuntimeError("отменено")
+        if isinstance(error, concurrent.futures.BrokenExecutor):
+            self.executor = None  # Процесс пула упал - следующий запуск создаст новый пул
+        with self.lock:
+            job = self.jobs[job_id]
+            if self.stopped:
+                return  # Задание прервано выходом и будет повторено при следующем запуске
+            if error is not None:
+                job['status'] = 'failed'
+                job['error'] = str(error)
+                print(f"Ошибка задания {JOB_TITLES[job['kind']]} ({job['args'][0]}): {error}")
+            else:
+                job['status'] = future.result()
+            self.running.discard(job_id)
+            self.progress.pop(job_id, None)
+            self.save()
+        self.wakeup.set()
+
+    def poll_progress(self):
+        """Забирает сообщения о прогрессе от процессов (вызывается из потока интерфейса)"""
+        while True:
+            try:
+                job_id, fraction = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                if job_id in self.progress:
+                    self.progress[job_id] = fraction
+
+    def status_text(self):
+        """Краткое описание состояния очереди для строки состояния"""
+        self.poll_progress()
+        with self.lock:
+            pending = sum(1 for job in self.jobs.values() if job['status'] == 'pending')
+            running = [(self.jobs[job_id], self.progress.get(job_id, 0.0)) for job_id in self.running]
+        if not pending and not running:
+            return ""
+        parts = [f"{JOB_TITLES[job['kind']]} {fraction * 100:.0f}%" for job, fraction in running]
+        text = "Обработка: " + (", ".join(parts) if parts else "ожидание")
+        if pending:
+            text += f" (+{pending} в очереди)"
+        if self.throttle.is_set():
+            text += " - пауза на время записи"
+        return text
+
+    def shutdown(self):
+        """Останавливает очередь; незавершенные задания останутся в файле состояния"""
+        with self.lock:
+            self.stopped = True
+        self.wakeup.set()
+        if self.executor is not None:
+            terminate = getattr(self.executor, 'terminate_workers', None)
+            if terminate is not None:
+                terminate()
+            else:
+                for process in list(getattr(self.executor, '_processes', {}).values()):
+                    process.terminate()
+                self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+class RecordingsLibrary:
+    """Индекс записей в папке сохранения на SQLite.
+
+    Для каждого файла хранятся длительность, разрешение, размер, сцена и
+    полоска миниатюр в JPEG. Сканирование инкрементальное: OpenCV открывает
+    только новые файлы и файлы с изменившимися размером или временем, поэтому
+    открытие библиотеки не зависит от числа записей.
+    """
+    DB_FILE = ".recordstudio_library.sqlite"
+    PATTERNS = ("record_", "replay_")
+    STRIP_FRAMES = 4
+    THUMB_SIZE = (96, 54)
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.db_path = os.path.join(folder, self.DB_FILE)
+        self.scan_lock = threading.Lock()
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS recordings (
+                path TEXT PRIMARY KEY, mtime REAL, size INTEGER, duration REAL,
+                width INTEGER, height INTEGER, fps REAL, scene TEXT, created REAL, thumbs BLOB)""")
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Открывает соединение для текущего потока и фиксирует изменения"""
+        db = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def entries(self):
+        """Возвращает записи из индекса, новые первыми (без полосок миниатюр)"""
+        with self.connect() as db:
+            return db.execute("""SELECT path, duration, width, height, size, scene, created
+                                 FROM recordings ORDER BY created DESC""").fetchall()
+
+    def thumbnail_strip(self, path):
+        with self.connect() as db:
+            row = db.execute("SELECT thumbs FROM recordings WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def register(self, path, scene_name):
+        """Запоминает сцену законченной записи; метаданные заполнит сканирование"""
+        with self.connect() as db:
+            db.execute("""INSERT INTO recordings (path, mtime, size, scene, created) VALUES (?, 0, 0, ?, ?)
+                          ON CONFLICT(path) DO UPDATE SET scene = excluded.scene, mtime = 0""",
+                       (path, scene_name, time.time()))
+
+    def probe(self, path):
+        """Читает метаданные файла и собирает полоску миниатюр"""
+        cap = cv2.VideoCapture(path)
+        try:
+            if not cap.isOpened():
+                return None
+            fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+            total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            strip = np.zeros((self.THUMB_SIZE[1], self.THUMB_SIZE[0] * self.STRIP_FRAMES, 3), dtype=np.uint8)
+            for i in range(self.STRIP_FRAMES):
+                cap.set(cv2.CAP_PROP_POS_FRAMES, int(total * (i + 0.5) / self.STRIP_FRAMES))
+                ok, frame = cap.read()
+                if ok:
+                    x = i * self.THUMB_SIZE[0]
+                    strip[:, x:x + self.THUMB_SIZE[0]] = cv2.resize(frame, self.THUMB_SIZE,
+                                                                   interpolation=cv2.INTER_AREA)
+            ok, encoded = cv2.imencode('.jpg', strip, [cv2.IMWRITE_JPEG_QUALITY, 80])
+            return total / fps, width, height, fps, encoded.tobytes() if ok else None
+        finally:
+            cap.release()
+
+    def scan(self):
+        """Сверяет индекс с папкой и возвращает число обновленных записей"""
+        with self.scan_lock:
+            files = {}
+            for entry in os.scandir(self.folder):
+                if entry.is_file() and entry.name.startswith(self.PATTERNS) and entry.name.endswith(".avi"):
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_mtime, stat.st_size)
+
+            with self.connect() as db:
+                known = {path: (mtime, size) for path, mtime, size in
+                         db.execute("SELECT path, mtime, size FROM recordings")}
+                removed = [(path,) for path in known if path not in files]
+                db.executemany("DELETE FROM recordings WHERE path = ?", removed)
+
+            changed = 0
+            for path, (mtime, size) in files.items():
+                if known.get(path) == (mtime, size):
+                    continue
+                try:
+                    info = self.probe(path)
+                except Exception as e:
+                    print(f"Ошибка чтения записи {path}: {e}")
+                    info = None
+                if info is None:
+                    continue
+                duration, width, height, fps, thumbs = info
+                with self.connect() as db:
+                    db.execute("""INSERT INTO recordings (path, mtime, size, duration, width, height, fps, created, thumbs)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                  ON CONFLICT(path) DO UPDATE SET mtime = excluded.mtime, size = excluded.size,
+                                  duration = excluded.duration, width = excluded.width, height = excluded.height,
+                                  fps = excluded.fps, thumbs = excluded.thumbs""",
+                               (path, mtime, size, duration, width, height, fps, mtime, thumbs))
+                changed += 1
+            return changed + len(removed)
+
 class ModernButton(ttk.Frame):
     """Современная кнопка с иконкой и текстом"""
     def __init__(self, parent, text, command, icon=None, width=120, height=30, style="Modern.TButton"):
@@ -156,8 +3226,15 @@ class RecordStudio:
         
         parser = argparse.ArgumentParser(description='Record Studio Pro - программа для записи экрана')
         parser.add_argument('-f', '--fullscreen', action='store_true', help='Запуск в полноэкранном режиме')
+        parser.add_argument('--profile', type=float, nargs='?', const=30.0, default=None, metavar='СЕКУНДЫ',
+                            help='Профилировать потоки программы заданное время (по умолчанию 30 с)')
         args, _ = parser.parse_known_args()
         
+        self.profiler = None
+        self.profile_timer = None
+        if args.profile:
+            self.root.after(1000, lambda: self.start_profiling(args.profile))
+        
         self.fullscreen_mode = args.fullscreen
         if self.fullscreen_mode:
             self.root.after(100, self.enter_fullscreen)
@@ -175,30 +3252,66 @@ class RecordStudio:
         self.current_scene_index = 0
         self.selected_window = None
         self.windows_list = []
-        self.audio_data = queue.Queue()
-        self.sample_rate = 44100
+        self.sample_rate = 48000
         self.video_writer = None
         self.recording_thread = None
-        self.audio_stream = None
+        self.audio_mixer = None
+        self.recording_path = None
         self.recording_start_time = None
         self.pause_start_time = None
         self.total_paused_time = 0
         self.recording_timer = None
+        self.meter_timer = None
         self.preview_timer = None
-        self.camera = None
+        self.source_pool = SourcePool()
         self.available_cameras = self.get_available_cameras()
         self.selected_text_index = -1
+        self.selected_image_index = -1
         
         # Инициализация MSS и многопоточных компонентов
         self.sct = None
         self.monitor = None
-        self.preview_queue = queue.Queue(maxsize=1)
+        self.monitor_layout = MonitorLayout()
+        self.preview_queue = queue.Queue(maxsize=1)  # (кадр, слот трассировки задержки)
+        self.preview_latency = LatencyTracker("preview", ("grab", "composited", "queued", "displayed"))
+        self.record_latency = LatencyTracker("record", ("grab", "composited", "encoder", "written"))
+        self.preview_base = None  # Последний захваченный кадр без наложений
+        self.preview_frame_index = 0
+        self.preview_display = np.zeros((PREVIEW_SIZE[1], PREVIEW_SIZE[0], 3), dtype=np.uint8)
+        self.preview_rgb = np.zeros_like(self.preview_display)
+        self.preview_photo = None
         self.preview_thread = None
         self.preview_running = True
+
+        # Компоновщики кадра для предпросмотра и записи
+        # (запись собирается в configure_record_output после загрузки настроек)
+        self.preview_compositor = Compositor(self, PREVIEW_SIZE)
+        self.preview_overlays = OverlayRenderer(PREVIEW_SIZE)
+        self.cursor = CursorTracker()
+        self.color_corrections = ColorCorrectionCache()
+        self.preview_transition = SceneTransition(PREVIEW_SIZE)
+        self.record_size = RECORD_SIZE
+        self.compose_threads = 0  # 0 - автоматически: полосы только для выходов больше 1080p
+        self.compose_tiles = None
         
         self.sections_expanded = {'sources': True, 'scenes': True, 'text': True, 'transform': True}
         self.control_window = None
-        self.hotkeys = {'start_recording': 'Ctrl+R', 'stop_recording': 'Ctrl+S', 'toggle_pause': 'Ctrl+P', 'toggle_fullscreen': 'F11'}
+        self.hotkeys = {'start_recording': 'Ctrl+R', 'stop_recording': 'Ctrl+S', 'toggle_pause': 'Ctrl+P', 'toggle_fullscreen': 'F11',
+                        'toggle_replay': 'Ctrl+Shift+B', 'save_replay': 'Ctrl+B'}
+        self.replay_seconds = 60
+        self.replay_budget_mb = 512
+        self.replay_buffer = None
+        self.replay_thread = None
+        self.replay_audio_mixer = None
+        # Кадры записи собирают то поток записи, то поток буфера повтора; компоновщик
+        # записи и его холст у них общие, поэтому кадр собирается и расходуется под замком
+        self.record_output_lock = threading.Lock()
+        self.record_frame_index = 0
+        self.postprocess_options = {'thumbnail': True, 'mux': True, 'checksum': True, 'transcode': False}
+        self.postprocess_workers = 2
+        self.transition_kind = "fade"
+        self.transition_ms = 500
+        self.job_queue = None
         self.dragging = False
         self.drag_start_x = 0
         self.drag_start_y = 0
@@ -206,21 +3319,33 @@ class RecordStudio:
         self.selected_transform_index = 0
         
         self.load_settings()
+        self.configure_record_output()
         if not os.path.exists(self.save_path):
             os.makedirs(self.save_path)
+        self.start_job_queue()
+        self.library = None
+        self.library_window = None
+        self.open_library_index()
             
         self.load_scenes()
         if not self.scenes:
             self.scenes.append(Scene("Основная сцена"))
         
+        self.scene_version = 0
+        self.scene_snapshot = None
+        self.save_scenes_timer = None
+        self.publish_scene()
+        
         self.setup_ui()
         self.setup_hotkeys()
+        self.source_pool.prewarm(self.scenes[self.current_scene_index])
+        self.maintain_source_pool()
         self.start_preview_thread()
         
     def start_preview_thread(self):
         """Запускает поток для захвата предпросмотра"""
         self.preview_running = True
-        self.preview_thread = threading.Thread(target=self.preview_worker, daemon=True)
+        self.preview_thread = threading.Thread(target=self.preview_worker, daemon=True, name="preview")
         self.preview_thread.start()
         self.update_preview()
         
@@ -240,7 +3365,6 @@ class RecordStudio:
         thread_sct = None
         try:
             thread_sct = mss.mss()
-            monitor = thread_sct.monitors[1]
         except Exception as e:
             print(f"Ошибка инициализации MSS в потоке предпросмотра: {e}")
             return
@@ -250,14 +3374,18 @@ class RecordStudio:
                 if not self.preview_running:
                     break
                     
-                preview_frame = self.capture_preview_frame(thread_sct, monitor)
+                self.monitor_layout.refresh_if_changed()
+                slot = self.preview_latency.begin()
+                preview_frame = self.capture_preview_frame(thread_sct)
                 if preview_frame is not None:
+                    self.preview_latency.mark(slot, "composited")
                     if self.preview_queue.full():
                         try:
                             self.preview_queue.get_nowait()
                         except queue.Empty:
                             pass
-                    self.preview_queue.put(preview_frame)
+                    self.preview_queue.put((preview_frame, slot))
+                    self.preview_latency.mark(slot, "queued")
                 time.sleep(0.033)  # ~30 FPS
             except Exception as e:
                 print(f"Ошибка в потоке предпросмотра: {e}")
@@ -270,139 +3398,26 @@ class RecordStudio:
             except:
                 pass
     
-    def capture_preview_frame(self, sct, monitor):
-        """Захватывает кадр для предпросмотра (вызывается из потока)"""
+    def capture_preview_frame(self, sct):
+        """Захватывает базовый кадр предпросмотра без наложений (вызывается из потока)"""
         try:
-            scene = self.scenes[self.current_scene_index]
-            preview_image = None
-            
-            # Определяем активный источник видео
-            active_source = None
-            if scene.video_sources["full_screen"]:
-                active_source = "full_screen"
-            elif scene.video_sources["window"] and scene.window_rect:
-                active_source = "window"
-            elif scene.video_sources["camera"]:
-                active_source = "camera"
-            
-            if active_source == "full_screen" and sct is not None:
-                try:
-                    screenshot = sct.grab(monitor)
-                    img = np.array(screenshot)
-                    img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-                    preview_image = img
-                    
-                    # Применяем трансформации для экрана
-                    if scene.screen_scale != 1.0 or scene.screen_offset_x != 0 or scene.screen_offset_y != 0:
-                        h, w = preview_image.shape[:2]
-                        new_w = int(w * scene.screen_scale)
-                        new_h = int(h * scene.screen_scale)
-                        preview_image = cv2.resize(preview_image, (new_w, new_h))
-                        background = np.zeros((h, w, 3), dtype=np.uint8)
-                        x = max(0, min(w - new_w, scene.screen_offset_x))
-                        y = max(0, min(h - new_h, scene.screen_offset_y))
-                        if y + new_h <= h and x + new_w <= w:
-                            background[y:y+new_h, x:x+new_w] = preview_image
-                        preview_image = background
-                        
-                except Exception as e:
-                    print(f"Ошибка захвата экрана в предпросмотре: {e}")
-                    preview_image = np.zeros((480, 640, 3), dtype=np.uint8)
-                    
-            elif active_source == "window" and scene.window_rect:
-                try:
-                    # Захватываем область окна
-                    left, top, right, bottom = scene.window_rect
-                    width = right - left
-                    height = bottom - top
-                    
-                    if width > 0 and height > 0:
-                        # Создаем область для захвата
-                        capture_area = {
-                            "left": max(0, left),
-                            "top": max(0, top),
-                            "width": min(width, 3840),  # Ограничиваем максимальный размер
-                            "height": min(height, 2160)
-                        }
-                        
-                        screenshot = sct.grab(capture_area)
-                        img = np.array(screenshot)
-                        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-                        preview_image = img
-                        
-                        # Применяем трансформации для окна
-                        if scene.window_scale != 1.0 or scene.window_offset_x != 0 or scene.window_offset_y != 0:
-                            h, w = preview_image.shape[:2]
-                            new_w = int(w * scene.window_scale)
-                            new_h = int(h * scene.window_scale)
-                            preview_image = cv2.resize(preview_image, (new_w, new_h))
-                            background = np.zeros((480, 640, 3), dtype=np.uint8)
-                            x = max(0, min(640 - new_w, 320 - new_w//2 + scene.window_offset_x))
-                            y = max(0, min(480 - new_h, 240 - new_h//2 + scene.window_offset_y))
-                            if y + new_h <= 480 and x + new_w <= 640:
-                                background[y:y+new_h, x:x+new_w] = preview_image
-                            preview_image = background
-                    else:
-                        preview_image = np.zeros((480, 640, 3), dtype=np.uint8)
-                        cv2.putText(preview_image, "Неверные размеры окна", (50, 50), 
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-                        
-                except Exception as e:
-                    print(f"Ошибка захвата окна в предпросмотре: {e}")
-                    preview_image = np.zeros((480, 640, 3), dtype=np.uint8)
-                    cv2.putText(preview_image, "Ошибка захвата окна", (50, 50), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-                    
-            elif active_source == "camera":
-                try:
-                    preview_image = self.capture_camera()
-                    if scene.camera_scale != 1.0 or scene.camera_offset_x != 0 or scene.camera_offset_y != 0:
-                        h, w = preview_image.shape[:2]
-                        new_w = int(w * scene.camera_scale)
-                        new_h = int(h * scene.camera_scale)
-                        preview_image = cv2.resize(preview_image, (new_w, new_h))
-                        background = np.zeros((480, 640, 3), dtype=np.uint8)
-                        x = max(0, min(640 - new_w, 320 - new_w//2 + scene.camera_offset_x))
-                        y = max(0, min(480 - new_h, 240 - new_h//2 + scene.camera_offset_y))
-                        if y + new_h <= 480 and x + new_w <= 640:
-                            background[y:y+new_h, x:x+new_w] = preview_image
-                        preview_image = background
-                except Exception as e:
-                    print(f"Ошибка захвата камеры в предпросмотре: {e}")
-                    preview_image = np.zeros((480, 640, 3), dtype=np.uint8)
-            else:
-                preview_image = np.zeros((480, 640, 3), dtype=np.uint8)
-                cv2.putText(preview_image, "Выберите источник видео", (50, 50), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            
-            if preview_image is not None:
-                preview_image = cv2.resize(preview_image, (640, 480))
-                preview_image = self.apply_text_overlays(preview_image, scene.text_objects)
-                
-                if self.is_recording:
-                    cv2.putText(preview_image, "REC", (10, 30), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                    if self.is_paused:
-                        cv2.putText(preview_image, "PAUSED", (10, 60), 
-                                   cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-                
-                return preview_image
-                
+            # Копия нужна, так как холст компоновщика переиспользуется
+            frame = self.preview_transition.render(
+                self.scene_snapshot, lambda scene, target: self.preview_compositor.compose(scene, sct))
+            return frame.copy()
         except Exception as e:
             print(f"Общая ошибка захвата предпросмотра: {e}")
-        return np.zeros((480, 640, 3), dtype=np.uint8)
+        return np.zeros((PREVIEW_SIZE[1], PREVIEW_SIZE[0], 3), dtype=np.uint8)
 
     def update_preview(self):
         """Обновляет предпросмотр в основном потоке Tkinter"""
         try:
             if not self.preview_queue.empty():
-                preview_image = self.preview_queue.get_nowait()
-                preview_image = cv2.cvtColor(preview_image, cv2.COLOR_BGR2RGB)
-                preview_image = Image.fromarray(preview_image)
-                preview_image = ImageTk.PhotoImage(preview_image)
-                self.preview_label.config(image=preview_image)
-                self.preview_label.image = preview_image
-            else:
+                self.preview_base, slot = self.preview_queue.get_nowait()
+                self.preview_frame_index += 1
+                self.render_preview()
+                self.preview_latency.mark(slot, "displayed")
+            elif self.preview_base is None:
                 self.preview_label.config(text="Загрузка предпросмотра...", foreground="#666", background="#000")
             
         except Exception as e:
@@ -412,136 +3427,74 @@ class RecordStudio:
         if self.preview_running:
             self.preview_timer = self.root.after(50, self.update_preview)
 
-    def capture_screen(self):
-        """Захватывает экран или окно для записи"""
+    def render_preview(self):
+        """Накладывает слой наложений на последний захваченный кадр и выводит его.
+
+        Вызывается и при новом кадре, и при правке сцены, поэтому
+        перетаскивание текста видно сразу, не дожидаясь нового захвата.
+        """
+        if self.preview_base is None:
+            return
+        frame = self.preview_display
+        np.copyto(frame, self.preview_base)
+        scene = self.scene_snapshot
+        self.preview_overlays.apply(frame, scene.text_objects, scene.image_objects,
+                                    self.overlay_context(scene, self.preview_frame_index))
+        
+        if self.is_recording:
+            cv2.putText(frame, "REC", (10, 30), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            if self.is_paused:
+                cv2.putText(frame, "PAUSED", (10, 60), 
+                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+        
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.preview_rgb)
+        image = Image.fromarray(self.preview_rgb)
+        if self.preview_photo is None:
+            self.preview_photo = ImageTk.PhotoImage(image)
+            self.preview_label.config(image=self.preview_photo)
+            self.preview_label.image = self.preview_photo
+        else:
+            # Переиспользуем изображение Tk вместо создания нового
+            self.preview_photo.paste(image)
+
+    def capture_screen(self, sct, scene):
+        """Захватывает кадр сцены в разрешении записи"""
         try:
-            scene = self.scenes[self.current_scene_index]
-            
-            # Определяем активный источник видео
-            active_source = None
-            if scene.video_sources["full_screen"]:
-                active_source = "full_screen"
-            elif scene.video_sources["window"] and scene.window_rect:
-                active_source = "window"
-            elif scene.video_sources["camera"]:
-                active_source = "camera"
-            
-            if active_source == "full_screen":
-                with mss.mss() as sct:
-                    monitor = sct.monitors[1]
-                    screenshot = sct.grab(monitor)
-                    img = np.array(screenshot)
-                    img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-                    
-                    # Применяем трансформации для экрана
-                    if scene.screen_scale != 1.0 or scene.screen_offset_x != 0 or scene.screen_offset_y != 0:
-                        h, w = img.shape[:2]
-                        new_w = int(w * scene.screen_scale)
-                        new_h = int(h * scene.screen_scale)
-                        img = cv2.resize(img, (new_w, new_h))
-                        background = np.zeros((h, w, 3), dtype=np.uint8)
-                        x = max(0, min(w - new_w, scene.screen_offset_x))
-                        y = max(0, min(h - new_h, scene.screen_offset_y))
-                        if y + new_h <= h and x + new_w <= w:
-                            background[y:y+new_h, x:x+new_w] = img
-                        img = background
-                    
-                    return img
-                    
-            elif active_source == "window" and scene.window_rect:
-                with mss.mss() as sct:
-                    left, top, right, bottom = scene.window_rect
-                    width = right - left
-                    height = bottom - top
-                    
-                    if width > 0 and height > 0:
-                        capture_area = {
-                            "left": max(0, left),
-                            "top": max(0, top),
-                            "width": min(width, 3840),
-                            "height": min(height, 2160)
-                        }
-                        
-                        screenshot = sct.grab(capture_area)
-                        img = np.array(screenshot)
-                        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-                        
-                        # Применяем трансформации для окна
-                        if scene.window_scale != 1.0 or scene.window_offset_x != 0 or scene.window_offset_y != 0:
-                            h, w = img.shape[:2]
-                            new_w = int(w * scene.window_scale)
-                            new_h = int(h * scene.window_scale)
-                            img = cv2.resize(img, (new_w, new_h))
-                            background = np.zeros((1080, 1920, 3), dtype=np.uint8)
-                            x = max(0, min(1920 - new_w, 960 - new_w//2 + scene.window_offset_x))
-                            y = max(0, min(1080 - new_h, 540 - new_h//2 + scene.window_offset_y))
-                            if y + new_h <= 1080 and x + new_w <= 1920:
-                                background[y:y+new_h, x:x+new_w] = img
-                            img = background
-                        
-                        return img
-                    else:
-                        return np.zeros((1080, 1920, 3), dtype=np.uint8)
-                        
-            elif active_source == "camera":
-                img = self.capture_camera()
-                # Масштабируем до Full HD для записи
-                img = cv2.resize(img, (1920, 1080))
-                return img
-                
-            else:
-                return np.zeros((1080, 1920, 3), dtype=np.uint8)
-                
+            return self.record_compositor.compose(scene, sct)
         except Exception as e:
             print(f"Ошибка захвата для записи: {e}")
-            return np.zeros((1080, 1920, 3), dtype=np.uint8)
+            return np.zeros((self.record_size[1], self.record_size[0], 3), dtype=np.uint8)
 
-    def capture_camera(self):
-        """Захватывает изображение с камеры"""
+    def media_source(self, scene):
+        """Возвращает медиаисточник сцены из пула источников"""
         try:
-            if self.camera is None or not self.camera.isOpened():
-                scene = self.scenes[self.current_scene_index]
-                self.camera = cv2.VideoCapture(scene.camera_index)
-                width, height = map(int, scene.camera_resolution.split('x'))
-                self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-                self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-            
-            ret, frame = self.camera.read()
-            return frame if ret else np.zeros((480, 640, 3), dtype=np.uint8)
+            return self.source_pool.media(scene.media_path, scene.media_loop)
         except Exception as e:
-            print(f"Ошибка захвата камеры: {e}")
-            return np.zeros((480, 640, 3), dtype=np.uint8)
+            print(f"Ошибка открытия медиаисточника: {e}")
+            return None
+
+    def camera_source(self, scene):
+        """Камера сцены; разрешение устройства задает только текущая сцена"""
+        current = self.scene_snapshot
+        reconfigure = current is None or current.scene_id == scene.scene_id
+        return self.source_pool.camera(scene.camera_index, scene.camera_resolution, reconfigure)
 
-    def apply_text_overlays(self, frame, text_objects):
-        """Накладывает текстовые объекты на кадр"""
+    def capture_camera(self, scene):
+        """Возвращает последний кадр камеры сцены из пула источников"""
         try:
-            pil_img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            draw = ImageDraw.Draw(pil_img)
-            
-            for text_obj in text_objects:
-                if not text_obj.visible:
-                    continue
-                    
-                try:
-                    font_size = int(text_obj.font_size * text_obj.scale)
-                    font = ImageFont.truetype("arial.ttf", font_size)
-                except:
-                    font = ImageFont.load_default()
-                
-                if text_obj.background_color and text_obj.background_alpha > 0:
-                    bbox = draw.textbbox((text_obj.x, text_obj.y), text_obj.text, font=font)
-                    overlay = Image.new('RGBA', pil_img.size, (0, 0, 0, 0))
-                    overlay_draw = ImageDraw.Draw(overlay)
-                    overlay_draw.rectangle(bbox, fill=text_obj.background_color + (text_obj.background_alpha,))
-                    pil_img = Image.alpha_composite(pil_img.convert('RGBA'), overlay).convert('RGB')
-                    draw = ImageDraw.Draw(pil_img)
-                
-                draw.text((text_obj.x, text_obj.y), text_obj.text, fill=text_obj.font_color, font=font)
-            
-            return cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+            return self.camera_source(scene).read()
+        except Exception as e:
+            print(f"Ошибка захвата камеры: {e}")
+            return None
+
+    def capture_keyed_camera(self, scene):
+        """Возвращает (кадр, маска хромакея) камеры сцены или None"""
+        try:
+            return self.camera_source(scene).read_keyed(scene.camera_chroma)
         except Exception as e:
-            print(f"Ошибка наложения текста: {e}")
-            return frame
+            print(f"Ошибка захвата камеры: {e}")
+            return None
 
     def setup_styles(self):
         """Настраивает современные стили для интерфейса"""
@@ -580,6 +3533,30 @@ class RecordStudio:
         style.configure('TCombobox', fieldbackground='#2d2d2d', foreground='white', background='#3498db')
         style.configure('Horizontal.TProgressbar', background='#3498db', troughcolor='#2d2d2d', borderwidth=0)
         
+    def open_library_index(self):
+        """Открывает индекс записей в папке сохранения"""
+        try:
+            self.library = RecordingsLibrary(self.save_path)
+        except Exception as e:
+            print(f"Ошибка открытия библиотеки записей: {e}")
+            self.library = None
+    
+    def start_job_queue(self):
+        """Запускает очередь постобработки для папки записей"""
+        try:
+            self.job_queue = PostProcessQueue(self.save_path, self.postprocess_workers)
+        except Exception as e:
+            print(f"Ошибка запуска очереди постобработки: {e}")
+            self.job_queue = None
+    
+    def get_audio_input_devices(self):
+        """Получает список имен устройств ввода звука"""
+        try:
+            return [device['name'] for device in sd.query_devices() if device['max_input_channels'] > 0]
+        except Exception as e:
+            print(f"Ошибка получения списка аудиоустройств: {e}")
+            return []
+    
     def get_available_cameras(self):
         """Получает список доступных камер"""
         cameras = []
@@ -610,12 +3587,16 @@ class RecordStudio:
             keyboard.add_hotkey('ctrl+r', self.start_recording_hotkey)
             keyboard.add_hotkey('ctrl+s', self.stop_recording_hotkey)
             keyboard.add_hotkey('ctrl+p', self.toggle_pause_hotkey)
+            keyboard.add_hotkey('ctrl+shift+b', self.toggle_replay_buffer)
+            keyboard.add_hotkey('ctrl+b', self.save_replay_hotkey)
             
         except ImportError:
             self.has_global_hotkeys = False
             self.root.bind('<Control-r>', lambda e: self.start_recording_hotkey())
             self.root.bind('<Control-s>', lambda e: self.stop_recording_hotkey())
             self.root.bind('<Control-p>', lambda e: self.toggle_pause_hotkey())
+            self.root.bind('<Control-B>', lambda e: self.toggle_replay_buffer())
+            self.root.bind('<Control-b>', lambda e: self.save_replay_hotkey())
             
     def start_recording_hotkey(self):
         """Обработчик горячей клавиши для начала записи"""
@@ -632,6 +3613,11 @@ class RecordStudio:
         if self.is_recording:
             self.toggle_pause()
         
+    def save_replay_hotkey(self):
+        """Обработчик горячей клавиши для сохранения повтора"""
+        if self.replay_buffer is not None and self.replay_buffer.active:
+            self.save_replay()
+        
     def toggle_fullscreen(self, event=None):
         """Переключает полноэкранный режим"""
         self.fullscreen_mode = not self.fullscreen_mode
@@ -647,7 +3633,15 @@ class RecordStudio:
                 with open(settings_path, 'r', encoding='utf-8') as f:
                     settings = json.load(f)
                     self.save_path = settings.get('save_path', default_path)
-                    self.hotkeys = settings.get('hotkeys', self.hotkeys)
+                    self.hotkeys.update(settings.get('hotkeys', {}))
+                    self.replay_seconds = settings.get('replay_seconds', self.replay_seconds)
+                    self.replay_budget_mb = settings.get('replay_budget_mb', self.replay_budget_mb)
+                    self.postprocess_options.update(settings.get('postprocess_options', {}))
+                    self.postprocess_workers = settings.get('postprocess_workers', self.postprocess_workers)
+                    self.transition_kind = settings.get('transition_kind', self.transition_kind)
+                    self.transition_ms = settings.get('transition_ms', self.transition_ms)
+                    self.record_size = tuple(settings.get('record_size', self.record_size))
+                    self.compose_threads = settings.get('compose_threads', self.compose_threads)
                     
                     loaded_sections = settings.get('sections_expanded', {})
                     self.sections_expanded = {
@@ -671,7 +3665,15 @@ class RecordStudio:
             settings = {
                 'save_path': self.save_path,
                 'hotkeys': self.hotkeys,
-                'sections_expanded': self.sections_expanded
+                'sections_expanded': self.sections_expanded,
+                'replay_seconds': self.replay_seconds,
+                'replay_budget_mb': self.replay_budget_mb,
+                'postprocess_options': self.postprocess_options,
+                'postprocess_workers': self.postprocess_workers,
+                'transition_kind': self.transition_kind,
+                'transition_ms': self.transition_ms,
+                'record_size': list(self.record_size),
+                'compose_threads': self.compose_threads
             }
             with open(settings_path, 'w', encoding='utf-8') as f:
                 json.dump(settings, f, ensure_ascii=False, indent=2)
@@ -691,6 +3693,21 @@ class RecordStudio:
                 print(f"Ошибка загрузки сцен: {e}")
                 self.scenes = []
     
+    def publish_scene(self):
+        """Публикует неизменяемый снимок текущей сцены для потоков захвата"""
+        self.scene_version += 1
+        # Присваивание ссылки атомарно, потоки увидят либо старый, либо новый снимок
+        self.scene_snapshot = SceneSnapshot(self.scenes[self.current_scene_index], self.scene_version)
+        self.source_pool.active_keys = frozenset(self.source_pool.scene_keys(self.scene_snapshot))
+    
+    def scene_changed(self):
+        """Публикует снимок после правки сцены и откладывает сохранение на диск"""
+        self.publish_scene()
+        self.render_preview()
+        if self.save_scenes_timer:
+            self.root.after_cancel(self.save_scenes_timer)
+        self.save_scenes_timer = self.root.after(500, self.save_scenes)
+    
     def save_scenes(self):
         """Сохраняет сцены в файл"""
         scenes_path = os.path.join(os.path.expanduser("~"), ".recordstudio_scenes.json")
@@ -748,6 +3765,22 @@ class RecordStudio:
         self.pause_button.pack(side=tk.LEFT, padx=5)
         self.pause_button.config(state="disabled")
         
+        # Буфер повтора
+        self.replay_button = ttk.Button(center_top_frame, 
+                                       text=f"⟲ ПОВТОР ({self.hotkeys['toggle_replay']})", 
+                                       command=self.toggle_replay_buffer,
+                                       style='TButton',
+                                       width=20)
+        self.replay_button.pack(side=tk.LEFT, padx=5)
+        
+        self.save_replay_button = ttk.Button(center_top_frame, 
+                                            text=f"💾 ({self.hotkeys['save_replay']})", 
+                                            command=self.save_replay,
+                                            style='Success.TButton',
+                                            width=10)
+        self.save_replay_button.pack(side=tk.LEFT, padx=5)
+        self.save_replay_button.config(state="disabled")
+        
         # Правый блок верхней панели
         right_top_frame = ttk.Frame(top_frame, style='Header.TFrame')
         right_top_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=10)
@@ -766,6 +3799,20 @@ class RecordStudio:
                                         style='TButton')
         self.hotkeys_button.pack(side=tk.RIGHT, padx=5)
         
+        # Кнопка профилировщика
+        self.profile_button = ttk.Button(right_top_frame, text="⏱", 
+                                        command=self.toggle_profiling, 
+                                        width=3,
+                                        style='TButton')
+        self.profile_button.pack(side=tk.RIGHT, padx=5)
+        
+        # Кнопка библиотеки записей
+        self.library_button = ttk.Button(right_top_frame, text="🎞", 
+                                        command=self.show_library, 
+                                        width=3,
+                                        style='TButton')
+        self.library_button.pack(side=tk.RIGHT, padx=5)
+        
         # Кнопка выбора пути сохранения
         self.path_button = ttk.Button(right_top_frame, text="📁", 
                                      command=self.select_save_path, 
@@ -869,6 +3916,17 @@ class RecordStudio:
                                    command=self.on_source_change)
         screen_cb.pack(anchor=tk.W, pady=2)
         
+        # Выбор монитора
+        monitor_frame = ttk.Frame(content_frame)
+        monitor_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(monitor_frame, text="Монитор:").pack(side=tk.LEFT)
+        self.monitor_combo = ttk.Combobox(monitor_frame, state="readonly", width=18,
+                                         postcommand=self.update_monitor_list)
+        self.monitor_combo.pack(side=tk.RIGHT)
+        self.monitor_combo.bind('<<ComboboxSelected>>', self.on_monitor_change)
+        self.update_monitor_list()
+        
         # Окно
         self.window_var = tk.BooleanVar()
         window_cb = ttk.Checkbutton(content_frame, text="Окно", 
@@ -888,6 +3946,16 @@ class RecordStudio:
                                      foreground="#666", font=("Arial", 8))
         self.window_label.pack(anchor=tk.W, pady=(0, 10))
         
+        # Курсор на захвате экрана и окна
+        cursor_frame = ttk.Frame(content_frame)
+        cursor_frame.pack(fill=tk.X, pady=(0, 5))
+        self.cursor_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(cursor_frame, text="Курсор", variable=self.cursor_var,
+                        command=self.on_cursor_change).pack(side=tk.LEFT)
+        self.cursor_clicks_var = tk.BooleanVar()
+        ttk.Checkbutton(cursor_frame, text="Подсветка щелчков", variable=self.cursor_clicks_var,
+                        command=self.on_cursor_change).pack(side=tk.LEFT, padx=(10, 0))
+        
         # Камера
         self.camera_var = tk.BooleanVar()
         camera_cb = ttk.Checkbutton(content_frame, text="Камера", 
@@ -918,6 +3986,43 @@ class RecordStudio:
         self.res_combo.set("640x480")
         self.res_combo.bind('<<ComboboxSelected>>', self.on_resolution_change)
         
+        # Хромакей камеры
+        chroma_frame = ttk.Frame(content_frame)
+        chroma_frame.pack(fill=tk.X, pady=5)
+        self.chroma_var = tk.BooleanVar()
+        ttk.Checkbutton(chroma_frame, text="Хромакей", variable=self.chroma_var,
+                        command=self.on_chroma_change).pack(side=tk.LEFT)
+        self.chroma_color_button = ttk.Button(chroma_frame, text="Цвет фона", width=10,
+                                              command=self.choose_chroma_color)
+        self.chroma_color_button.pack(side=tk.RIGHT)
+        
+        tolerance_frame = ttk.Frame(content_frame)
+        tolerance_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(tolerance_frame, text="Допуск:").pack(side=tk.LEFT)
+        self.chroma_tolerance_scale = ttk.Scale(tolerance_frame, from_=5, to=90, orient=tk.HORIZONTAL,
+                                                command=self.on_chroma_change)
+        self.chroma_tolerance_scale.pack(side=tk.RIGHT, fill=tk.X, expand=True, padx=(10, 0))
+        self.chroma_tolerance_scale.set(DEFAULT_CHROMA_KEY["tolerance"])
+        
+        # Медиафайл
+        self.media_var = tk.BooleanVar()
+        ttk.Checkbutton(content_frame, text="Медиафайл", 
+                        variable=self.media_var,
+                        command=self.on_source_change).pack(anchor=tk.W, pady=2)
+        
+        media_frame = ttk.Frame(content_frame)
+        media_frame.pack(fill=tk.X, pady=5)
+        ttk.Button(media_frame, text="Файл", command=self.select_media_file, width=6).pack(side=tk.LEFT, padx=(0, 2))
+        ttk.Button(media_frame, text="Папка", command=self.select_media_folder, width=6).pack(side=tk.LEFT, padx=2)
+        ttk.Button(media_frame, text="⏮", command=self.restart_media, width=3).pack(side=tk.LEFT, padx=2)
+        self.media_loop_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(media_frame, text="Повтор", variable=self.media_loop_var,
+                        command=self.on_media_loop_change).pack(side=tk.RIGHT)
+        
+        self.media_label = ttk.Label(content_frame, text="Файл не выбран", 
+                                    foreground="#666", font=("Arial", 8))
+        self.media_label.pack(anchor=tk.W, pady=(0, 10))
+        
         # Аудио
         audio_label = ttk.Label(content_frame, text="Аудио:")
         audio_label.pack(anchor=tk.W, pady=(10, 5))
@@ -928,6 +4033,63 @@ class RecordStudio:
                                   command=self.on_audio_change)
         audio_cb.pack(anchor=tk.W, pady=2)
         
+        # Аудиодорожки: микрофон и дополнительный вход
+        self.audio_devices = self.get_audio_input_devices()
+        self.audio_device_combos = []
+        self.audio_gain_scales = []
+        self.audio_mute_vars = []
+        self.audio_meters = []
+        for slot, (title, empty) in enumerate([("Микрофон:", "По умолчанию"), ("Второй вход:", "Нет")]):
+            device_frame = ttk.Frame(content_frame)
+            device_frame.pack(fill=tk.X, pady=2)
+            ttk.Label(device_frame, text=title).pack(side=tk.LEFT)
+            combo = ttk.Combobox(device_frame, values=[empty] + self.audio_devices,
+                                 state="readonly", width=18)
+            combo.pack(side=tk.RIGHT)
+            combo.set(empty)
+            combo.bind('<<ComboboxSelected>>', lambda e, s=slot: self.on_audio_device_change(s))
+            self.audio_device_combos.append(combo)
+            
+            gain_frame = ttk.Frame(content_frame)
+            gain_frame.pack(fill=tk.X, pady=(0, 5))
+            ttk.Label(gain_frame, text="Усиление:").pack(side=tk.LEFT)
+            mute_var = tk.BooleanVar(value=False)
+            ttk.Checkbutton(gain_frame, text="Без звука", variable=mute_var,
+                            command=lambda s=slot: self.on_audio_mute_change(s)).pack(side=tk.RIGHT)
+            gain_scale = ttk.Scale(gain_frame, from_=0.0, to=2.0, orient=tk.HORIZONTAL, length=90,
+                                   command=lambda value, s=slot: self.on_audio_gain_change(s))
+            self.audio_gain_scales.append(gain_scale)
+            self.audio_mute_vars.append(mute_var)
+            gain_scale.set(1.0)
+            gain_scale.pack(side=tk.RIGHT, padx=5)
+            
+            # Индикатор уровня: по полосе на канал, RMS заливкой и пик чертой
+            meter = tk.Canvas(content_frame, width=METER_WIDTH, height=11, bg='#2d2d2d',
+                              highlightthickness=0)
+            meter.pack(anchor=tk.W, pady=(0, 5))
+            bars = []
+            for channel in range(2):
+                top = 1 + channel * 5
+                rms_bar = meter.create_rectangle(0, top, 0, top + 4, fill="#2ecc71", width=0)
+                peak_mark = meter.create_line(0, top, 0, top + 4, fill="#f1c40f")
+                bars.append((rms_bar, peak_mark, top))
+            self.audio_meters.append((meter, bars))
+        
+        self.audio_stems_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(content_frame, text="Сохранять дорожки отдельно",
+                        variable=self.audio_stems_var,
+                        command=self.on_audio_stems_change).pack(anchor=tk.W, pady=2)
+        
+        # Обработка микрофона (параметры ступеней хранятся в сцене)
+        ttk.Label(content_frame, text="Обработка микрофона:").pack(anchor=tk.W, pady=(5, 2))
+        self.audio_dsp_vars = {}
+        for stage, title in [("highpass", "Срез низких частот"), ("gate", "Шумовой гейт"),
+                             ("compressor", "Компрессор и лимитер")]:
+            var = tk.BooleanVar(value=False)
+            ttk.Checkbutton(content_frame, text=title, variable=var,
+                            command=self.on_audio_dsp_change).pack(anchor=tk.W, pady=1)
+            self.audio_dsp_vars[stage] = var
+        
         # Макет
         layout_label = ttk.Label(content_frame, text="Макет:")
         layout_label.pack(anchor=tk.W, pady=(10, 5))
@@ -975,6 +4137,40 @@ class RecordStudio:
         ttk.Button(scenes_buttons_frame, text="Дублировать", 
                   command=self.duplicate_scene).pack(side=tk.LEFT, padx=2)
         
+        # Переход между сценами
+        transition_frame = ttk.Frame(content_frame)
+        transition_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(transition_frame, text="Переход:").pack(side=tk.LEFT)
+        self.transition_ms_spin = ttk.Spinbox(transition_frame, from_=100, to=3000, increment=100, width=6,
+                                              command=self.on_transition_change)
+        self.transition_ms_spin.pack(side=tk.RIGHT)
+        self.transition_ms_spin.set(self.transition_ms)
+        self.transition_ms_spin.bind('<FocusOut>', self.on_transition_change)
+        ttk.Label(transition_frame, text="мс").pack(side=tk.RIGHT, padx=(5, 2))
+        self.transition_combo = ttk.Combobox(transition_frame, values=list(TRANSITION_KINDS.values()),
+                                             state="readonly", width=10)
+        self.transition_combo.pack(side=tk.RIGHT)
+        self.transition_combo.set(TRANSITION_KINDS.get(self.transition_kind, TRANSITION_KINDS["cut"]))
+        self.transition_combo.bind('<<ComboboxSelected>>', self.on_transition_change)
+        
+        # Разрешение записи и потоки компоновки
+        output_frame = ttk.Frame(content_frame)
+        output_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(output_frame, text="Запись:").pack(side=tk.LEFT)
+        self.compose_threads_spin = ttk.Spinbox(output_frame, from_=0, to=32, width=4,
+                                                command=self.on_output_change)
+        self.compose_threads_spin.pack(side=tk.RIGHT)
+        self.compose_threads_spin.set(self.compose_threads)
+        self.compose_threads_spin.bind('<FocusOut>', self.on_output_change)
+        ttk.Label(output_frame, text="потоки (0 - авто)").pack(side=tk.RIGHT, padx=(5, 2))
+        self.record_size_combo = ttk.Combobox(output_frame, values=[f"{w}x{h}" for w, h in RECORD_SIZES],
+                                              state="readonly", width=10)
+        self.record_size_combo.pack(side=tk.RIGHT)
+        self.record_size_combo.set(f"{self.record_size[0]}x{self.record_size[1]}")
+        self.record_size_combo.bind('<<ComboboxSelected>>', self.on_output_change)
+        
         # Настройки текущей сцены
         scene_settings_label = ttk.Label(content_frame, text="Настройки сцены:")
         scene_settings_label.pack(anchor=tk.W, pady=(10, 5))
@@ -1030,6 +4226,8 @@ class RecordStudio:
         self.text_entry = ttk.Entry(text_frame)
         self.text_entry.pack(side=tk.RIGHT, fill=tk.X, expand=True, padx=(10, 0))
         self.text_entry.bind('<KeyRelease>', self.on_text_change)
+        ttk.Label(content_frame, text="Поля: {time}, {date}, {elapsed}, {scene}, {frame}",
+                  foreground="#666", font=("Arial", 8)).pack(anchor=tk.W)
         
         # Шрифт и размер
         font_frame = ttk.Frame(content_frame)
@@ -1046,8 +4244,8 @@ class RecordStudio:
         size_frame.pack(fill=tk.X, pady=5)
         
         ttk.Label(size_frame, text="Размер:").pack(side=tk.LEFT)
-        self.size_scale = ttk.Scale(size_frame, from_=8, to=72, orient=tk.HORIZONTAL, length=120)
-        self.size_scale.set(24)
+        self.size_scale = ttk.Scale(size_frame, from_=8, to=200, orient=tk.HORIZONTAL, length=120)
+        self.size_scale.set(48)
         self.size_scale.pack(side=tk.RIGHT)
         self.size_scale.bind('<ButtonRelease-1>', self.on_size_change)
         
@@ -1094,6 +4292,46 @@ class RecordStudio:
                                     variable=self.visible_var,
                                     command=self.on_visibility_change)
         visible_cb.pack(anchor=tk.W, pady=5)
+        
+        # Изображения (логотипы, водяные знаки)
+        ttk.Label(content_frame, text="Изображения:").pack(anchor=tk.W, pady=(10, 5))
+        
+        self.image_listbox = tk.Listbox(content_frame, bg='#2d2d2d', fg='white', 
+                                       selectbackground='#3498db', borderwidth=0,
+                                       font=('Arial', 9), height=3, exportselection=False)
+        self.image_listbox.pack(fill=tk.X, padx=5, pady=5)
+        self.image_listbox.bind('<<ListboxSelect>>', self.on_image_select)
+        
+        image_buttons_frame = ttk.Frame(content_frame)
+        image_buttons_frame.pack(fill=tk.X, pady=5)
+        ttk.Button(image_buttons_frame, text="Добавить", 
+                  command=self.add_image).pack(side=tk.LEFT, padx=2)
+        ttk.Button(image_buttons_frame, text="Удалить", 
+                  command=self.delete_image).pack(side=tk.LEFT, padx=2)
+        
+        anchor_frame = ttk.Frame(content_frame)
+        anchor_frame.pack(fill=tk.X, pady=5)
+        ttk.Label(anchor_frame, text="Положение:").pack(side=tk.LEFT)
+        self.image_anchor_combo = ttk.Combobox(anchor_frame, values=list(IMAGE_ANCHORS.values()),
+                                              state="readonly", width=15)
+        self.image_anchor_combo.pack(side=tk.RIGHT)
+        self.image_anchor_combo.bind('<<ComboboxSelected>>', self.on_image_settings_change)
+        
+        image_size_frame = ttk.Frame(content_frame)
+        image_size_frame.pack(fill=tk.X, pady=5)
+        ttk.Label(image_size_frame, text="Ширина:").pack(side=tk.LEFT)
+        self.image_width_scale = ttk.Scale(image_size_frame, from_=0.02, to=1.0, orient=tk.HORIZONTAL, length=120)
+        self.image_width_scale.set(0.15)
+        self.image_width_scale.pack(side=tk.RIGHT)
+        self.image_width_scale.bind('<ButtonRelease-1>', self.on_image_settings_change)
+        
+        image_opacity_frame = ttk.Frame(content_frame)
+        image_opacity_frame.pack(fill=tk.X, pady=5)
+        ttk.Label(image_opacity_frame, text="Непрозрачность:").pack(side=tk.LEFT)
+        self.image_opacity_scale = ttk.Scale(image_opacity_frame, from_=0.0, to=1.0, orient=tk.HORIZONTAL, length=120)
+        self.image_opacity_scale.set(1.0)
+        self.image_opacity_scale.pack(side=tk.RIGHT)
+        self.image_opacity_scale.bind('<ButtonRelease-1>', self.on_image_settings_change)
     
     def setup_transform_tab(self, parent):
         """Настраивает вкладку трансформации"""
@@ -1107,7 +4345,7 @@ class RecordStudio:
         ttk.Label(source_frame, text="Источник:").pack(anchor=tk.W)
         
         self.transform_var = tk.StringVar(value="screen")
-        transform_sources = [("Экран", "screen"), ("Камера", "camera"), ("Окно", "window")]
+        transform_sources = [("Экран", "screen"), ("Камера", "camera"), ("Окно", "window"), ("Медиа", "media")]
         
         for text, value in transform_sources:
             rb = ttk.Radiobutton(source_frame, text=text, value=value,
@@ -1172,6 +4410,27 @@ class RecordStudio:
                   command=self.reset_position).pack(side=tk.LEFT, padx=2)
         ttk.Button(reset_frame, text="Сбросить масштаб", 
                   command=self.reset_scale).pack(side=tk.LEFT, padx=2)
+        
+        # Цветокоррекция выбранного источника
+        ttk.Label(content_frame, text="Цвет:").pack(anchor=tk.W, pady=(10, 5))
+        self.color_scales = {}
+        for key, title, low, high in (("brightness", "Яркость", -100, 100), ("contrast", "Контраст", 0.2, 3.0),
+                                      ("saturation", "Насыщенность", 0.0, 3.0)):
+            row = ttk.Frame(content_frame)
+            row.pack(fill=tk.X, pady=2)
+            ttk.Label(row, text=f"{title}:").pack(side=tk.LEFT)
+            scale = ttk.Scale(row, from_=low, to=high, orient=tk.HORIZONTAL,
+                              value=DEFAULT_COLOR_CORRECTION[key])
+            scale.pack(side=tk.RIGHT, fill=tk.X, expand=True, padx=(10, 0))
+            scale.bind('<ButtonRelease-1>', self.on_color_correction_change)
+            self.color_scales[key] = scale
+        
+        lut_frame = ttk.Frame(content_frame)
+        lut_frame.pack(fill=tk.X, pady=5)
+        ttk.Button(lut_frame, text="LUT (.cube)", command=self.choose_color_lut).pack(side=tk.LEFT, padx=2)
+        ttk.Button(lut_frame, text="Сбросить цвет", command=self.reset_color_correction).pack(side=tk.LEFT, padx=2)
+        self.color_lut_label = ttk.Label(content_frame, text="LUT не выбран", foreground="#666", font=("Arial", 8))
+        self.color_lut_label.pack(anchor=tk.W)
     
     def setup_status_bar(self, parent):
         """Настраивает статус бар"""
@@ -1195,9 +4454,55 @@ class RecordStudio:
                                           foreground="#666", font=("Arial", 8))
         self.performance_label.pack(side=tk.RIGHT)
         
+        # Задержка кадров; двойной щелчок сохраняет покадровую трассировку в CSV
+        self.latency_label = ttk.Label(right_status, text="", foreground="#666", font=("Arial", 8),
+                                      cursor="hand2")
+        self.latency_label.pack(side=tk.RIGHT, padx=10)
+        self.latency_label.bind('<Double-1>', lambda e: self.export_latency_trace())
+        self.update_latency_status()
+        
+        self.jobs_label = ttk.Label(right_status, text="", foreground="#3498db", font=("Arial", 8))
+        self.jobs_label.pack(side=tk.RIGHT, padx=10)
+        self.update_jobs_status()
+        
         # Обновление производительности
         self.update_performance()
     
+    def update_latency_status(self):
+        """Показывает процентили задержки захват-экран и захват-диск и сборки кадров перехода"""
+        parts = []
+        for title, tracker in (("экран", self.preview_latency), ("диск", self.record_latency)):
+            values = tracker.percentiles((50, 95))
+            if values is not None:
+                parts.append(f"{title} {values[0]:.0f}/{values[1]:.0f}")
+        for title, transition in (("переход экран", self.preview_transition),
+                                  ("переход диск", self.record_transition)):
+            values = transition.last_times
+            if values is not None:
+                parts.append(f"{title} {values[0]:.0f}/{values[1]:.0f}")
+        self.latency_label.config(text="Задержка p50/p95, мс: " + ", ".join(parts) if parts else "")
+        self.root.after(1000, self.update_latency_status)
+    
+    def export_latency_trace(self):
+        """Сохраняет покадровые отметки времени обоих конвейеров в CSV"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(self.save_path, f"latency_{timestamp}.csv")
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write("pipeline,frame,hop,time_s,since_grab_ms\n")
+                self.preview_latency.write_trace(f)
+                self.record_latency.write_trace(f)
+            self.status_label.config(text=f"Трассировка задержки: {os.path.basename(path)}", foreground="#2ecc71")
+        except Exception as e:
+            print(f"Ошибка сохранения трассировки задержки: {e}")
+            self.status_label.config(text="Ошибка сохранения трассировки", foreground="red")
+    
+    def update_jobs_status(self):
+        """Показывает прогресс постобработки в строке состояния"""
+        if self.job_queue is not None:
+            self.jobs_label.config(text=self.job_queue.status_text())
+        self.root.after(500, self.update_jobs_status)
+    
     def update_performance(self):
         """Обновляет информацию о производительности"""
         try:
@@ -1213,31 +4518,260 @@ class RecordStudio:
         
         self.root.after(2000, self.update_performance)
     
+    def maintain_source_pool(self):
+        """Периодически закрывает простаивающие источники неактивных сцен"""
+        scene = self.scenes[self.current_scene_index]
+        self.source_pool.evict_idle(keep=self.source_pool.scene_keys(scene))
+        self.root.after(5000, self.maintain_source_pool)
+    
     def on_source_change(self):
         """Обработчик изменения источников видео"""
         scene = self.scenes[self.current_scene_index]
         scene.video_sources = {
             "full_screen": self.screen_var.get(),
             "window": self.window_var.get(),
-            "camera": self.camera_var.get()
+            "camera": self.camera_var.get(),
+            "media": self.media_var.get()
         }
         
         # Обновляем состояние кнопки выбора окна
         self.window_button.config(state="normal" if self.window_var.get() else "disabled")
         
-        self.save_scenes()
+        self.source_pool.prewarm(scene)
+        self.scene_changed()
+    
+    def on_cursor_change(self):
+        """Обработчик настроек курсора"""
+        scene = self.scenes[self.current_scene_index]
+        scene.show_cursor = self.cursor_var.get()
+        scene.cursor_clicks = self.cursor_clicks_var.get()
+        self.scene_changed()
+    
+    def set_media_path(self, path):
+        scene = self.scenes[self.current_scene_index]
+        scene.media_path = path
+        scene.video_sources["media"] = True
+        self.media_var.set(True)
+        self.media_label.config(text=os.path.basename(path.rstrip("/\\")) or path)
+        self.source_pool.prewarm(scene)
+        self.scene_changed()
+    
+    def select_media_file(self):
+        """Выбирает видеофайл или изображение для медиаисточника"""
+        path = filedialog.askopenfilename(filetypes=[
+            ("Видео и изображения", "*.mp4 *.avi *.mkv *.mov *.webm *.png *.jpg *.jpeg *.bmp"),
+            ("Все файлы", "*.*")])
+        if path:
+            self.set_media_path(path)
+    
+    def select_media_folder(self):
+        """Выбирает папку с последовательностью изображений"""
+        path = filedialog.askdirectory()
+        if path:
+            self.set_media_path(path)
+    
+    def on_chroma_change(self, value=None):
+        """Обработчик изменения хромакея камеры"""
+        if not 0 <= self.current_scene_index < len(self.scenes):
+            return
+        scene = self.scenes[self.current_scene_index]
+        chroma = {"enabled": self.chroma_var.get(),
+                  "tolerance": int(float(self.chroma_tolerance_scale.get()))}
+        if any(scene.camera_chroma[key] != value for key, value in chroma.items()):
+            scene.camera_chroma.update(chroma)
+            self.scene_changed()
+    
+    def choose_chroma_color(self):
+        """Выбирает цвет фона для хромакея"""
+        scene = self.scenes[self.current_scene_index]
+        color = colorchooser.askcolor(color=scene.camera_chroma["color"], title="Цвет фона")
+        if color[1]:
+            scene.camera_chroma["color"] = color[1]
+            self.scene_changed()
+    
+    def on_media_loop_change(self):
+        scene = self.scenes[self.current_scene_index]
+        scene.media_loop = self.media_loop_var.get()
+        self.source_pool.prewarm(scene)
+        self.scene_changed()
+    
+    def restart_media(self):
+        """Перематывает медиаисточник сцены в начало"""
+        scene = self.scenes[self.current_scene_index]
+        if scene.media_path:
+            media = self.media_source(scene)
+            if media is not None:
+                media.seek(0)
+    
+    def update_monitor_list(self):
+        """Обновляет список вариантов выбора монитора"""
+        self.monitor_layout.refresh_if_changed()
+        values = [f"Монитор {i} ({m['width']}x{m['height']})"
+                  for i, m in enumerate(self.monitor_layout.monitors, start=1)]
+        values += ["Все мониторы", "Набор мониторов..."]
+        self.monitor_combo.config(values=values)
+    
+    def monitor_choice_text(self, scene):
+        """Возвращает подпись выбора монитора для сцены"""
+        if scene.monitor_mode == "span":
+            return "Все мониторы"
+        if scene.monitor_mode == "subset":
+            return "Мониторы " + ", ".join(str(i) for i in scene.monitor_subset)
+        monitors = self.monitor_layout.monitors
+        if 1 <= scene.monitor_index <= len(monitors):
+            monitor = monitors[scene.monitor_index - 1]
+            return f"Монитор {scene.monitor_index} ({monitor['width']}x{monitor['height']})"
+        return f"Монитор {scene.monitor_index}"
+    
+    def on_monitor_change(self, event=None):
+        """Обработчик выбора монитора"""
+        scene = self.scenes[self.current_scene_index]
+        selected = self.monitor_combo.get()
+        if selected == "Все мониторы":
+            scene.monitor_mode = "span"
+        elif selected == "Набор мониторов...":
+            self.select_monitor_subset()
+            return
+        elif selected.startswith("Монитор "):
+            scene.monitor_mode = "single"
+            scene.monitor_index = int(selected.split()[1])
+        self.scene_changed()
+    
+    def select_monitor_subset(self):
+        """Диалог выбора нескольких мониторов для сшитого захвата"""
+        scene = self.scenes[self.current_scene_index]
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Набор мониторов")
+        dialog.configure(bg='#2d2d2d')
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        ttk.Label(dialog, text="Захватывать мониторы:").pack(anchor=tk.W, padx=10, pady=(10, 5))
+        
+        variables = []
+        for i, monitor in enumerate(self.monitor_layout.monitors, start=1):
+            var = tk.BooleanVar(value=i in scene.monitor_subset)
+            ttk.Checkbutton(dialog, text=f"Монитор {i} ({monitor['width']}x{monitor['height']}, "
+                                         f"{monitor['left']}, {monitor['top']})",
+                            variable=var).pack(anchor=tk.W, padx=10, pady=2)
+            variables.append(var)
+        
+        def apply_subset():
+            subset = [i for i, var in enumerate(variables, start=1) if var.get()]
+            if not subset:
+                messagebox.showwarning("Предупреждение", "Выберите хотя бы один монитор", parent=dialog)
+                return
+            scene.monitor_mode = "subset"
+            scene.monitor_subset = subset
+            self.monitor_combo.set(self.monitor_choice_text(scene))
+            self.scene_changed()
+            dialog.destroy()
+        
+        def cancel():
+            self.monitor_combo.set(self.monitor_choice_text(scene))
+            dialog.destroy()
+        
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Button(button_frame, text="Применить", command=apply_subset).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="Отмена", command=cancel).pack(side=tk.RIGHT, padx=5)
+        dialog.protocol("WM_DELETE_WINDOW", cancel)
     
     def on_audio_change(self):
         """Обработчик изменения настроек аудио"""
         scene = self.scenes[self.current_scene_index]
         scene.audio_enabled = self.audio_var.get()
-        self.save_scenes()
+        self.scene_changed()
+    
+    def on_audio_device_change(self, slot):
+        """Обработчик выбора устройства для аудиодорожки"""
+        scene = self.scenes[self.current_scene_index]
+        choice = self.audio_device_combos[slot].get()
+        device = choice if choice in self.audio_devices else None
+        if slot == 0:
+            scene.audio_tracks[0]["device"] = device
+        elif device is None:
+            del scene.audio_tracks[1:]
+        elif len(scene.audio_tracks) > 1:
+            scene.audio_tracks[1]["device"] = device
+        else:
+            scene.audio_tracks.append({"name": "Второй вход", "device": device,
+                                       "gain": float(self.audio_gain_scales[1].get()),
+                                       "muted": self.audio_mute_vars[1].get()})
+        self.scene_changed()
+    
+    def live_audio_track(self, slot):
+        """Возвращает дорожку идущей записи для слота, если она есть"""
+        mixer = self.audio_mixer
+        if mixer is not None:
+            for track in mixer.tracks:
+                if track.slot == slot:
+                    return track
+        return None
+    
+    def on_audio_gain_change(self, slot):
+        """Обработчик изменения усиления дорожки (применяется и во время записи)"""
+        scene = self.scenes[self.current_scene_index]
+        gain = float(self.audio_gain_scales[slot].get())
+        if slot < len(scene.audio_tracks) and scene.audio_tracks[slot].get("gain") != gain:
+            scene.audio_tracks[slot]["gain"] = gain
+            track = self.live_audio_track(slot)
+            if track is not None:
+                track.gain = gain
+            self.scene_changed()
+    
+    def on_audio_mute_change(self, slot):
+        """Обработчик отключения звука дорожки"""
+        scene = self.scenes[self.current_scene_index]
+        muted = self.audio_mute_vars[slot].get()
+        if slot < len(scene.audio_tracks):
+            scene.audio_tracks[slot]["muted"] = muted
+            track = self.live_audio_track(slot)
+            if track is not None:
+                track.muted = muted
+            self.scene_changed()
+    
+    def update_audio_meters(self):
+        """Опрашивает уровни дорожек (~15 раз в секунду) и перерисовывает индикаторы"""
+        recording_audio = self.audio_mixer is not None
+        for slot, (meter, bars) in enumerate(self.audio_meters):
+            track = self.live_audio_track(slot)
+            peaks, rms = track.read_levels() if track is not None else ([0.0], [0.0])
+            for channel, (rms_bar, peak_mark, top) in enumerate(bars):
+                index = min(channel, len(peaks) - 1)  # Моно дорожка показывается в обеих полосах
+                rms_x = level_to_fraction(rms[index]) * METER_WIDTH
+                peak_x = level_to_fraction(peaks[index]) * METER_WIDTH
+                meter.coords(rms_bar, 0, top, rms_x, top + 4)
+                meter.coords(peak_mark, peak_x, top, peak_x, top + 4)
+                meter.itemconfig(peak_mark, fill="#e74c3c" if peaks[index] >= 0.99 else "#f1c40f")
+        
+        if recording_audio:
+            self.meter_timer = self.root.after(66, self.update_audio_meters)
+        else:
+            self.meter_timer = None
+    
+    def on_audio_dsp_change(self):
+        """Обработчик включения ступеней обработки звука"""
+        scene = self.scenes[self.current_scene_index]
+        for stage, var in self.audio_dsp_vars.items():
+            scene.audio_dsp[stage]["enabled"] = var.get()
+        # Идущие запись и буфер повтора этой сцены подхватывают настройки сразу
+        for mixer in (self.audio_mixer, self.replay_audio_mixer):
+            if mixer is not None and mixer.dsp_config is not None and mixer.dsp_config.source is scene.audio_dsp:
+                mixer.dsp_config.refresh()
+        self.scene_changed()
+    
+    def on_audio_stems_change(self):
+        """Обработчик включения записи отдельных дорожек"""
+        scene = self.scenes[self.current_scene_index]
+        scene.audio_stems = self.audio_stems_var.get()
+        self.scene_changed()
     
     def on_layout_change(self):
         """Обработчик изменения макета"""
         scene = self.scenes[self.current_scene_index]
         scene.layout = self.layout_var.get()
-        self.save_scenes()
+        self.scene_changed()
     
     def on_camera_change(self, event=None):
         """Обработчик изменения камеры"""
@@ -1246,29 +4780,78 @@ class RecordStudio:
         if selected.startswith("Камера"):
             index = int(selected.split()[-1])
             scene.camera_index = index
-            # Переоткрываем камеру с новым индексом
-            if self.camera is not None:
-                self.camera.release()
-                self.camera = None
-            self.save_scenes()
+            # Новая камера открывается в фоне, прежняя остается в пуле
+            self.source_pool.prewarm(scene)
+            self.scene_changed()
     
     def on_resolution_change(self, event=None):
         """Обработчик изменения разрешения камеры"""
         scene = self.scenes[self.current_scene_index]
         scene.camera_resolution = self.res_combo.get()
-        # Переоткрываем камеру с новым разрешением
-        if self.camera is not None:
-            self.camera.release()
-            self.camera = None
-        self.save_scenes()
+        # Поток камеры сам переоткрывает устройство с новым разрешением
+        self.source_pool.prewarm(scene)
+        self.scene_changed()
     
     def on_scene_select(self, event=None):
         """Обработчик выбора сцены"""
         selection = self.scenes_listbox.curselection()
         if selection:
             self.current_scene_index = selection[0]
+            self.publish_scene()
+            self.source_pool.prewarm(self.scenes[self.current_scene_index])
             self.load_scene_settings()
     
+    def configure_record_output(self):
+        """Создает компоновщик, наложения и переход записи под разрешение и число потоков"""
+        threads = self.compose_threads
+        if threads <= 0:
+            large = self.record_size[0] * self.record_size[1] > RECORD_SIZE[0] * RECORD_SIZE[1]
+            threads = min(8, os.cpu_count() or 1) if large else 1
+        old_tiles = self.compose_tiles
+        self.compose_tiles = TilePool(threads) if threads > 1 else None
+        self.record_compositor = Compositor(self, self.record_size, self.compose_tiles)
+        self.record_overlays = OverlayRenderer(self.record_size)
+        self.record_frame = np.zeros((self.record_size[1], self.record_size[0], 3), dtype=np.uint8)
+        self.record_transition = SceneTransition(self.record_size, tiles=self.compose_tiles)
+        self.configure_transitions()
+        if old_tiles is not None:
+            old_tiles.shutdown()
+    
+    def on_output_change(self, event=None):
+        """Обработчик изменения разрешения записи или числа потоков компоновки"""
+        try:
+            width, height = map(int, self.record_size_combo.get().split('x'))
+            threads = max(0, int(self.compose_threads_spin.get()))
+        except ValueError:
+            return
+        if ((width, height), threads) == (self.record_size, self.compose_threads):
+            return
+        if self.is_recording or (self.replay_buffer is not None and self.replay_buffer.active):
+            messagebox.showinfo("Вывод", "Остановите запись и буфер повтора, чтобы изменить вывод")
+            self.record_size_combo.set(f"{self.record_size[0]}x{self.record_size[1]}")
+            self.compose_threads_spin.set(self.compose_threads)
+            return
+        self.record_size = (width, height)
+        self.compose_threads = threads
+        self.configure_record_output()
+        self.save_settings()
+    
+    def configure_transitions(self):
+        for transition in (self.preview_transition, self.record_transition):
+            transition.kind = self.transition_kind
+            transition.duration = self.transition_ms / 1000
+    
+    def on_transition_change(self, event=None):
+        """Обработчик изменения вида или длительности перехода между сценами"""
+        kinds = {title: kind for kind, title in TRANSITION_KINDS.items()}
+        self.transition_kind = kinds.get(self.transition_combo.get(), "cut")
+        try:
+            self.transition_ms = max(0, int(self.transition_ms_spin.get()))
+        except ValueError:
+            self.transition_ms_spin.set(self.transition_ms)
+        self.configure_transitions()
+        self.save_settings()
+    
     def on_scene_name_change(self, event=None):
         """Обработчик изменения имени сцены"""
         if 0 <= self.current_scene_index < len(self.scenes):
@@ -1276,7 +4859,7 @@ class RecordStudio:
             scene.name = self.scene_name_entry.get()
             # Обновляем список сцен
             self.update_scenes_list()
-            self.save_scenes()
+            self.scene_changed()
     
     def on_text_select(self, event=None):
         """Обработчик выбора текстового объекта"""
@@ -1293,28 +4876,28 @@ class RecordStudio:
             text_obj = self.scenes[self.current_scene_index].text_objects[self.selected_text_index]
             text_obj.text = self.text_entry.get()
             self.update_text_list()
-            self.save_scenes()
+            self.scene_changed()
     
     def on_font_change(self, event=None):
         """Обработчик изменения шрифта"""
         if 0 <= self.selected_text_index < len(self.scenes[self.current_scene_index].text_objects):
             text_obj = self.scenes[self.current_scene_index].text_objects[self.selected_text_index]
             text_obj.font_family = self.font_combo.get()
-            self.save_scenes()
+            self.scene_changed()
     
     def on_size_change(self, event=None):
         """Обработчик изменения размера шрифта"""
         if 0 <= self.selected_text_index < len(self.scenes[self.current_scene_index].text_objects):
             text_obj = self.scenes[self.current_scene_index].text_objects[self.selected_text_index]
             text_obj.font_size = int(self.size_scale.get())
-            self.save_scenes()
+            self.scene_changed()
     
     def on_visibility_change(self):
         """Обработчик изменения видимости текста"""
         if 0 <= self.selected_text_index < len(self.scenes[self.current_scene_index].text_objects):
             text_obj = self.scenes[self.current_scene_index].text_objects[self.selected_text_index]
             text_obj.visible = self.visible_var.get()
-            self.save_scenes()
+            self.scene_changed()
     
     def on_bg_toggle(self):
         """Обработчик включения/выключения фона текста"""
@@ -1327,18 +4910,18 @@ class RecordStudio:
             if not self.bg_var.get():
                 text_obj.background_color = None
                 text_obj.background_alpha = 0
-            self.save_scenes()
+            self.scene_changed()
     
     def on_alpha_change(self, event=None):
         """Обработчик изменения прозрачности фона"""
         if 0 <= self.selected_text_index < len(self.scenes[self.current_scene_index].text_objects):
             text_obj = self.scenes[self.current_scene_index].text_objects[self.selected_text_index]
             text_obj.background_alpha = int(self.alpha_scale.get())
-            self.save_scenes()
+            self.scene_changed()
     
     def on_transform_source_change(self):
         """Обработчик изменения источника для трансформации"""
-        self.selected_transform_index = {"screen": 0, "camera": 1, "window": 2}[self.transform_var.get()]
+        self.selected_transform_index = {"screen": 0, "camera": 1, "window": 2, "media": 3}[self.transform_var.get()]
         self.load_transform_settings()
     
     def on_scale_change(self, event=None):
@@ -1396,8 +4979,12 @@ class RecordStudio:
                 scene.window_scale = scale
                 scene.window_offset_x = x
                 scene.window_offset_y = y
+            elif self.transform_var.get() == "media":
+                scene.media_scale = scale
+                scene.media_offset_x = x
+                scene.media_offset_y = y
             
-            self.save_scenes()
+            self.scene_changed()
         except ValueError:
             pass
     
@@ -1418,9 +5005,49 @@ class RecordStudio:
             self.y_var.set("0")
             self.x_slider.set(0)
             self.y_slider.set(0)
+        elif self.transform_var.get() == "media":
+            self.x_var.set("0")
+            self.y_var.set("0")
+            self.x_slider.set(0)
+            self.y_slider.set(0)
         
         self.apply_transform_settings()
     
+    def color_correction_params(self):
+        """Возвращает словарь цветокоррекции источника, выбранного во вкладке трансформации"""
+        source = self.transform_var.get()
+        scene = self.scenes[self.current_scene_index]
+        return scene.color_correction["full_screen" if source == "screen" else source]
+    
+    def on_color_correction_change(self, event=None):
+        """Обработчик изменения яркости, контраста или насыщенности"""
+        params = self.color_correction_params()
+        params["brightness"] = int(float(self.color_scales["brightness"].get()))
+        params["contrast"] = round(float(self.color_scales["contrast"].get()), 2)
+        params["saturation"] = round(float(self.color_scales["saturation"].get()), 2)
+        self.scene_changed()
+    
+    def choose_color_lut(self):
+        """Выбирает файл 3D LUT для источника"""
+        path = filedialog.askopenfilename(filetypes=[("3D LUT", "*.cube"), ("Все файлы", "*.*")])
+        if path:
+            self.color_correction_params()["lut_path"] = path
+            self.color_lut_label.config(text=os.path.basename(path))
+            self.scene_changed()
+    
+    def reset_color_correction(self):
+        """Сбрасывает цветокоррекцию выбранного источника"""
+        self.color_correction_params().update(DEFAULT_COLOR_CORRECTION)
+        self.load_color_correction()
+        self.scene_changed()
+    
+    def load_color_correction(self):
+        params = self.color_correction_params()
+        for key, scale in self.color_scales.items():
+            scale.set(params[key])
+        self.color_lut_label.config(text=os.path.basename(params["lut_path"]) if params["lut_path"]
+                                    else "LUT не выбран")
+    
     def reset_scale(self):
         """Сбрасывает масштаб выбранного источника"""
         self.scale_var.set("1.0")
@@ -1436,9 +5063,29 @@ class RecordStudio:
             self.screen_var.set(scene.video_sources["full_screen"])
             self.window_var.set(scene.video_sources["window"])
             self.camera_var.set(scene.video_sources["camera"])
+            self.media_var.set(scene.video_sources["media"])
+            self.media_loop_var.set(scene.media_loop)
+            self.cursor_var.set(scene.show_cursor)
+            self.cursor_clicks_var.set(scene.cursor_clicks)
+            self.chroma_var.set(scene.camera_chroma["enabled"])
+            self.chroma_tolerance_scale.set(scene.camera_chroma["tolerance"])
+            self.media_label.config(text=os.path.basename(scene.media_path.rstrip("/\\")) if scene.media_path
+                                    else "Файл не выбран")
+            
+            # Монитор
+            self.monitor_combo.set(self.monitor_choice_text(scene))
             
             # Аудио
             self.audio_var.set(scene.audio_enabled)
+            self.audio_stems_var.set(scene.audio_stems)
+            for stage, var in self.audio_dsp_vars.items():
+                var.set(scene.audio_dsp[stage]["enabled"])
+            for slot, combo in enumerate(self.audio_device_combos):
+                config = scene.audio_tracks[slot] if slot < len(scene.audio_tracks) else {}
+                device = config.get("device")
+                combo.set(device if device else combo.cget('values')[0])
+                self.audio_gain_scales[slot].set(config.get("gain", 1.0))
+                self.audio_mute_vars[slot].set(config.get("muted", False))
             
             # Окно
             self.window_label.config(text=scene.window_info)
@@ -1455,8 +5102,11 @@ class RecordStudio:
             self.scene_name_entry.delete(0, tk.END)
             self.scene_name_entry.insert(0, scene.name)
             
-            # Текстовые объекты
+            # Текстовые объекты и изображения
             self.update_text_list()
+            self.selected_image_index = 0 if scene.image_objects else -1
+            self.update_image_list()
+            self.load_image_settings()
             
             # Трансформация
             self.load_transform_settings()
@@ -1510,6 +5160,14 @@ class RecordStudio:
             self.x_slider.set(scene.window_offset_x)
             self.y_var.set(str(scene.window_offset_y))
             self.y_slider.set(scene.window_offset_y)
+        elif self.transform_var.get() == "media":
+            self.scale_var.set(f"{scene.media_scale:.2f}")
+            self.scale_slider.set(scene.media_scale)
+            self.x_var.set(str(scene.media_offset_x))
+            self.x_slider.set(scene.media_offset_x)
+            self.y_var.set(str(scene.media_offset_y))
+            self.y_slider.set(scene.media_offset_y)
+        self.load_color_correction()
     
     def update_scenes_list(self):
         """Обновляет список сцен"""
@@ -1531,6 +5189,65 @@ class RecordStudio:
         if scene.text_objects and 0 <= self.selected_text_index < len(scene.text_objects):
             self.text_listbox.selection_set(self.selected_text_index)
     
+    def update_image_list(self):
+        """Обновляет список изображений сцены"""
+        self.image_listbox.delete(0, tk.END)
+        scene = self.scenes[self.current_scene_index]
+        for image_obj in scene.image_objects:
+            self.image_listbox.insert(tk.END, os.path.basename(image_obj.path))
+        if 0 <= self.selected_image_index < len(scene.image_objects):
+            self.image_listbox.selection_set(self.selected_image_index)
+    
+    def load_image_settings(self):
+        """Загружает настройки выбранного изображения"""
+        scene = self.scenes[self.current_scene_index]
+        if 0 <= self.selected_image_index < len(scene.image_objects):
+            image_obj = scene.image_objects[self.selected_image_index]
+            self.image_anchor_combo.set(IMAGE_ANCHORS.get(image_obj.anchor, ""))
+            self.image_width_scale.set(image_obj.width)
+            self.image_opacity_scale.set(image_obj.opacity)
+    
+    def on_image_select(self, event=None):
+        """Обработчик выбора изображения в списке"""
+        selection = self.image_listbox.curselection()
+        if selection:
+            self.selected_image_index = selection[0]
+            self.load_image_settings()
+    
+    def on_image_settings_change(self, event=None):
+        """Применяет положение, ширину и непрозрачность к выбранному изображению"""
+        scene = self.scenes[self.current_scene_index]
+        if 0 <= self.selected_image_index < len(scene.image_objects):
+            image_obj = scene.image_objects[self.selected_image_index]
+            anchors = {title: anchor for anchor, title in IMAGE_ANCHORS.items()}
+            image_obj.anchor = anchors.get(self.image_anchor_combo.get(), image_obj.anchor)
+            image_obj.width = round(float(self.image_width_scale.get()), 3)
+            image_obj.opacity = round(float(self.image_opacity_scale.get()), 2)
+            self.scene_changed()
+    
+    def add_image(self):
+        """Добавляет изображение-наложение из файла"""
+        path = filedialog.askopenfilename(filetypes=[
+            ("Изображения", "*.png *.jpg *.jpeg *.bmp *.webp *.tif *.tiff"), ("Все файлы", "*.*")])
+        if not path:
+            return
+        scene = self.scenes[self.current_scene_index]
+        scene.image_objects.append(ImageObject(path))
+        self.selected_image_index = len(scene.image_objects) - 1
+        self.update_image_list()
+        self.load_image_settings()
+        self.scene_changed()
+    
+    def delete_image(self):
+        """Удаляет выбранное изображение"""
+        scene = self.scenes[self.current_scene_index]
+        if 0 <= self.selected_image_index < len(scene.image_objects):
+            del scene.image_objects[self.selected_image_index]
+            self.selected_image_index = min(self.selected_image_index, len(scene.image_objects) - 1)
+            self.update_image_list()
+            self.load_image_settings()
+            self.scene_changed()
+    
     def add_scene(self):
         """Добавляет новую сцену"""
         new_scene = Scene(f"Сцена {len(self.scenes) + 1}")
@@ -1538,7 +5255,7 @@ class RecordStudio:
         self.current_scene_index = len(self.scenes) - 1
         self.update_scenes_list()
         self.load_scene_settings()
-        self.save_scenes()
+        self.scene_changed()
     
     def delete_scene(self):
         """Удаляет текущую сцену"""
@@ -1547,7 +5264,7 @@ class RecordStudio:
             self.current_scene_index = min(self.current_scene_index, len(self.scenes) - 1)
             self.update_scenes_list()
             self.load_scene_settings()
-            self.save_scenes()
+            self.scene_changed()
         else:
             messagebox.showwarning("Предупреждение", "Нельзя удалить последнюю сцену")
     
@@ -1560,29 +5277,30 @@ class RecordStudio:
                 self.scenes[self.current_scene_index].name = new_name
                 self.update_scenes_list()
                 self.load_scene_settings()
-                self.save_scenes()
+                self.scene_changed()
     
     def duplicate_scene(self):
         """Дублирует текущую сцену"""
         if 0 <= self.current_scene_index < len(self.scenes):
             original_scene = self.scenes[self.current_scene_index]
             duplicated_scene = copy.deepcopy(original_scene)
+            duplicated_scene.scene_id = next(scene_ids)
             duplicated_scene.name = f"{original_scene.name} (копия)"
             self.scenes.append(duplicated_scene)
             self.current_scene_index = len(self.scenes) - 1
             self.update_scenes_list()
             self.load_scene_settings()
-            self.save_scenes()
+            self.scene_changed()
     
     def add_text(self):
         """Добавляет новый текстовый объект"""
         scene = self.scenes[self.current_scene_index]
-        new_text = TextObject("Новый текст", 100, 100)
+        new_text = TextObject("Новый текст")
         scene.text_objects.append(new_text)
         self.selected_text_index = len(scene.text_objects) - 1
         self.update_text_list()
         self.load_text_settings()
-        self.save_scenes()
+        self.scene_changed()
     
     def delete_text(self):
         """Удаляет текущий текстовый объект"""
@@ -1592,7 +5310,7 @@ class RecordStudio:
             self.selected_text_index = min(self.selected_text_index, len(scene.text_objects) - 1)
             self.update_text_list()
             self.load_text_settings()
-            self.save_scenes()
+            self.scene_changed()
     
     def move_text_up(self):
         """Перемещает текстовый объект вверх по списку"""
@@ -1602,7 +5320,7 @@ class RecordStudio:
                 scene.text_objects[self.selected_text_index - 1], scene.text_objects[self.selected_text_index]
             self.selected_text_index -= 1
             self.update_text_list()
-            self.save_scenes()
+            self.scene_changed()
     
     def move_text_down(self):
         """Перемещает текстовый объект вниз по списку"""
@@ -1612,7 +5330,7 @@ class RecordStudio:
                 scene.text_objects[self.selected_text_index + 1], scene.text_objects[self.selected_text_index]
             self.selected_text_index += 1
             self.update_text_list()
-            self.save_scenes()
+            self.scene_changed()
     
     def choose_text_color(self):
         """Выбирает цвет текста"""
@@ -1621,7 +5339,7 @@ class RecordStudio:
             if color[1]:
                 text_obj = self.scenes[self.current_scene_index].text_objects[self.selected_text_index]
                 text_obj.font_color = color[1]
-                self.save_scenes()
+                self.scene_changed()
     
     def choose_bg_color(self):
         """Выбирает цвет фона текста"""
@@ -1630,7 +5348,7 @@ class RecordStudio:
             if color[1]:
                 text_obj = self.scenes[self.current_scene_index].text_objects[self.selected_text_index]
                 text_obj.background_color = color[1]
-                self.save_scenes()
+                self.scene_changed()
     
     def select_window(self):
         """Улучшенная функция выбора окон с несколькими методами"""
@@ -1927,7 +5645,7 @@ class RecordStudio:
             self.on_source_change()
             
             self.status_label.config(text=f"Выбрано окно: {window_info['title']}")
-            self.save_scenes()
+            self.scene_changed()
             
             messagebox.showinfo("Успех", f"Окно '{window_info['title']}' выбрано для записи")
             
@@ -2042,7 +5760,7 @@ class RecordStudio:
                         self.on_source_change()
                         
                         self.status_label.config(text=f"Выбрано окно: {window_title}")
-                        self.save_scenes()
+                        self.scene_changed()
                         
                         # Закрываем окна
                         overlay.destroy()
@@ -2130,7 +5848,7 @@ class RecordStudio:
                         self.on_source_change()
                         
                         self.status_label.config(text=f"Выбрано активное окно: {window_title}")
-                        self.save_scenes()
+                        self.scene_changed()
                         
                         messagebox.showinfo("Успех", f"Окно '{window_title}' выбрано для записи")
                     else:
@@ -2159,12 +5877,182 @@ class RecordStudio:
     
     def select_save_path(self):
         """Выбирает путь для сохранения записей"""
+        if self.is_recording:
+            messagebox.showinfo("Путь сохранения", "Остановите запись, чтобы сменить папку")
+            return
         path = filedialog.askdirectory(initialdir=self.save_path)
         if path:
             self.save_path = path
             self.save_settings()
+            # Очередь хранит состояние в папке записей: незавершенные задания прежней
+            # папки продолжатся, когда она снова будет выбрана
+            if self.job_queue is not None:
+                self.job_queue.shutdown()
+            self.start_job_queue()
+            self.open_library_index()
+            # Открытое окно библиотеки переключаем на записи новой папки
+            if self.library_window is not None and self.library_window.winfo_exists():
+                if self.library is None:
+                    self.library_window.destroy()
+                else:
+                    self.library_thumb.config(image="")
+                    self.library_thumb_photo = None
+                    self.fill_library_tree()
+                    self.refresh_library()
             self.status_label.config(text=f"Путь сохранения: {path}")
     
+    def toggle_profiling(self):
+        """Включает или выключает профилирование потоков"""
+        if self.profiler is None:
+            self.start_profiling()
+        else:
+            self.stop_profiling()
+    
+    def start_profiling(self, seconds=None):
+        """Запускает сэмплирующий профилировщик (на seconds секунд или до повторного нажатия)"""
+        if self.profiler is not None:
+            return
+        self.profiler = SamplingProfiler()
+        self.profiler.start()
+        self.profile_button.config(text="⏹")
+        self.status_label.config(text="Профилирование потоков...", foreground="#3498db")
+        if seconds:
+            self.profile_timer = self.root.after(int(seconds * 1000), self.stop_profiling)
+    
+    def stop_profiling(self):
+        """Останавливает профилировщик и сохраняет отчет и свернутые стеки"""
+        if self.profiler is None:
+            return
+        if self.profile_timer:
+            self.root.after_cancel(self.profile_timer)
+            self.profile_timer = None
+        profiler = self.profiler
+        self.profiler = None
+        profiler.stop()
+        self.profile_button.config(text="⏱")
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        report_path = os.path.join(self.save_path, f"profile_{timestamp}.txt")
+        try:
+            profiler.write_report(report_path)
+            profiler.write_collapsed(os.path.join(self.save_path, f"profile_{timestamp}.folded"))
+            self.status_label.config(text=f"Профиль сохранен: {os.path.basename(report_path)}",
+                                     foreground="#2ecc71")
+        except Exception as e:
+            print(f"Ошибка сохранения профиля: {e}")
+            self.status_label.config(text="Ошибка сохранения профиля", foreground="red")
+    
+    def show_library(self):
+        """Показывает окно библиотеки записей"""
+        if self.library is None:
+            messagebox.showerror("Ошибка", "Библиотека записей недоступна")
+            return
+        if self.library_window is not None and self.library_window.winfo_exists():
+            self.library_window.lift()
+            self.refresh_library()
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title("Библиотека записей")
+        window.configure(bg='#2d2d2d')
+        window.geometry("760x480")
+        self.library_window = window
+        
+        columns = ("scene", "duration", "resolution", "size", "date")
+        tree = ttk.Treeview(window, columns=columns, show="tree headings", selectmode="browse")
+        tree.heading("#0", text="Файл")
+        tree.column("#0", width=200)
+        for column, title, width in [("scene", "Сцена", 140), ("duration", "Длительность", 90),
+                                     ("resolution", "Разрешение", 90), ("size", "Размер", 80),
+                                     ("date", "Дата", 130)]:
+            tree.heading(column, text=title)
+            tree.column(column, width=width, anchor=tk.W)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 5))
+        self.library_tree = tree
+        
+        # Полоска миниатюр выбранной записи (декодируется только при выборе)
+        self.library_thumb = ttk.Label(window)
+        self.library_thumb.pack(pady=5)
+        self.library_thumb_photo = None
+        
+        button_frame = ttk.Frame(window)
+        button_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        ttk.Button(button_frame, text="Открыть", command=self.open_library_selection).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Папка", command=lambda: self.open_path(self.save_path)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Обновить", command=self.refresh_library).pack(side=tk.LEFT, padx=5)
+        
+        tree.bind('<<TreeviewSelect>>', self.on_library_select)
+        tree.bind('<Double-1>', lambda e: self.open_library_selection())
+        
+        # Сначала показываем то, что уже есть в индексе, затем досканируем папку
+        self.fill_library_tree()
+        self.refresh_library()
+    
+    def fill_library_tree(self):
+        """Заполняет список библиотеки из индекса"""
+        if self.library_window is None or not self.library_window.winfo_exists():
+            return
+        tree = self.library_tree
+        selected = tree.selection()
+        tree.delete(*tree.get_children())
+        for path, duration, width, height, size, scene, created in self.library.entries():
+            duration = duration or 0
+            tree.insert("", tk.END, iid=path, text=os.path.basename(path), values=(
+                scene or "", f"{int(duration // 60):02d}:{int(duration % 60):02d}",
+                f"{width}x{height}" if width else "", f"{(size or 0) / (1024 * 1024):.1f} МБ",
+                datetime.fromtimestamp(created).strftime("%Y-%m-%d %H:%M") if created else ""))
+        if selected and tree.exists(selected[0]):
+            tree.selection_set(selected[0])
+    
+    def refresh_library(self):
+        """Инкрементально сканирует папку в фоне и обновляет открытое окно"""
+        library = self.library
+        if library is None:
+            return
+        
+        def worker():
+            try:
+                changed = library.scan()
+            except Exception as e:
+                print(f"Ошибка сканирования библиотеки: {e}")
+                return
+            if changed:
+                self.root.after(0, self.fill_library_tree)
+        
+        threading.Thread(target=worker, daemon=True, name="library-scan").start()
+    
+    def on_library_select(self, event=None):
+        """Показывает полоску миниатюр выбранной записи"""
+        selection = self.library_tree.selection()
+        if not selection:
+            return
+        try:
+            thumbs = self.library.thumbnail_strip(selection[0])
+            if thumbs:
+                strip = cv2.imdecode(np.frombuffer(thumbs, dtype=np.uint8), cv2.IMREAD_COLOR)
+                image = Image.fromarray(cv2.cvtColor(strip, cv2.COLOR_BGR2RGB))
+                self.library_thumb_photo = ImageTk.PhotoImage(image)
+                self.library_thumb.config(image=self.library_thumb_photo)
+            else:
+                self.library_thumb.config(image="")
+        except Exception as e:
+            print(f"Ошибка загрузки миниатюр: {e}")
+    
+    def open_library_selection(self):
+        selection = self.library_tree.selection()
+        if selection:
+            self.open_path(selection[0])
+    
+    def open_path(self, path):
+        """Открывает файл или папку в системном приложении"""
+        try:
+            if hasattr(os, 'startfile'):
+                os.startfile(path)
+            else:
+                subprocess.Popen(['xdg-open', path])
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось открыть {path}: {str(e)}")
+    
     def show_hotkeys_settings(self):
         """Показывает настройки горячих клавиш"""
         messagebox.showinfo("Горячие клавиши", 
@@ -2172,37 +6060,36 @@ class RecordStudio:
                            f"{self.hotkeys['start_recording']} - Начать запись\n"
                            f"{self.hotkeys['stop_recording']} - Остановить запись\n"
                            f"{self.hotkeys['toggle_pause']} - Пауза/Продолжить\n"
+                           f"{self.hotkeys['toggle_replay']} - Буфер повтора вкл/выкл\n"
+                           f"{self.hotkeys['save_replay']} - Сохранить повтор\n"
                            f"{self.hotkeys['toggle_fullscreen']} - Полноэкранный режим")
     
+    def preview_coords(self, event):
+        """Переводит координаты мыши в координаты кадра предпросмотра"""
+        # Кадр выводится в натуральном размере по центру метки
+        offset_x = (self.preview_label.winfo_width() - PREVIEW_SIZE[0]) / 2
+        offset_y = (self.preview_label.winfo_height() - PREVIEW_SIZE[1]) / 2
+        return event.x - offset_x, event.y - offset_y
+    
     def on_preview_click(self, event):
-        """Обработчик клика по предпросмотру для перемещения текста"""
-        if self.selected_text_index >= 0:
-            scene = self.scenes[self.current_scene_index]
-            text_obj = scene.text_objects[self.selected_text_index]
-            
-            # Преобразуем координаты клика в координаты предпросмотра (640x480)
-            scale_x = 640 / self.preview_label.winfo_width()
-            scale_y = 480 / self.preview_label.winfo_height()
-            
-            click_x = event.x * scale_x
-            click_y = event.y * scale_y
-            
-            # Проверяем, был ли клик рядом с текстом
-            text_rect = self.get_text_rect(text_obj)
-            if text_rect and self.is_point_in_rect(click_x, click_y, text_rect):
-                self.dragging = True
-                self.drag_start_x = click_x
-                self.drag_start_y = click_y
-                self.current_drag_type = "text"
+        """Обработчик клика по предпросмотру: выбор верхнего текста под курсором"""
+        click_x, click_y = self.preview_coords(event)
+        
+        hit = self.preview_overlays.hit_test(self.scene_snapshot, click_x, click_y)
+        if hit >= 0:
+            if hit != self.selected_text_index:
+                self.selected_text_index = hit
+                self.update_text_list()
+                self.load_text_settings()
+            self.dragging = True
+            self.drag_start_x = click_x
+            self.drag_start_y = click_y
+            self.current_drag_type = "text"
     
     def on_preview_drag(self, event):
         """Обработчик перемещения мыши при перетаскивании"""
         if self.dragging:
-            scale_x = 640 / self.preview_label.winfo_width()
-            scale_y = 480 / self.preview_label.winfo_height()
-            
-            current_x = event.x * scale_x
-            current_y = event.y * scale_y
+            current_x, current_y = self.preview_coords(event)
             
             if self.current_drag_type == "text" and self.selected_text_index >= 0:
                 scene = self.scenes[self.current_scene_index]
@@ -2211,12 +6098,13 @@ class RecordStudio:
                 dx = current_x - self.drag_start_x
                 dy = current_y - self.drag_start_y
                 
-                text_obj.x = max(0, min(640, text_obj.x + dx))
-                text_obj.y = max(0, min(480, text_obj.y + dy))
+                # Координаты текста нормализованы относительно кадра
+                text_obj.x = max(0.0, min(1.0, text_obj.x + dx / PREVIEW_SIZE[0]))
+                text_obj.y = max(0.0, min(1.0, text_obj.y + dy / PREVIEW_SIZE[1]))
                 
                 self.drag_start_x = current_x
                 self.drag_start_y = current_y
-                self.save_scenes()
+                self.scene_changed()
     
     def on_preview_release(self, event):
         """Обработчик отпускания кнопки мыши"""
@@ -2234,25 +6122,7 @@ class RecordStudio:
             else:
                 text_obj.scale = max(0.5, text_obj.scale - 0.1)
             
-            self.save_scenes()
-    
-    def get_text_rect(self, text_obj):
-        """Возвращает прямоугольник, занимаемый текстом"""
-        try:
-            # Создаем временное изображение для измерения текста
-            temp_img = Image.new('RGB', (640, 480))
-            draw = ImageDraw.Draw(temp_img)
-            font_size = int(text_obj.font_size * text_obj.scale)
-            font = ImageFont.truetype("arial.ttf", font_size)
-            
-            bbox = draw.textbbox((text_obj.x, text_obj.y), text_obj.text, font=font)
-            return bbox
-        except:
-            return None
-    
-    def is_point_in_rect(self, x, y, rect):
-        """Проверяет, находится ли точка внутри прямоугольника"""
-        return rect[0] <= x <= rect[2] and rect[1] <= y <= rect[3]
+            self.scene_changed()
     
     def toggle_recording(self):
         """Переключает состояние записи"""
@@ -2267,16 +6137,19 @@ class RecordStudio:
             self.is_recording = True
             self.is_paused = False
             self.recording_start_time = time.time()
+            if self.job_queue is not None:
+                self.job_queue.set_throttled(True)
             self.total_paused_time = 0
             
             # Создаем имя файла с временной меткой
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"record_{timestamp}.avi"
             filepath = os.path.join(self.save_path, filename)
+            self.recording_path = filepath
             
             # Настройки видео
             fps = 30
-            frame_size = (1920, 1080)  # Full HD
+            frame_size = self.record_size
             
             # Создаем видеописатель
             fourcc = cv2.VideoWriter_fourcc(*'XVID')
@@ -2285,17 +6158,25 @@ class RecordStudio:
             if self.video_writer is None:
                 raise Exception("Не удалось создать видеофайл")
             
-            # Начинаем запись аудио, если включено
-            if self.scenes[self.current_scene_index].audio_enabled:
-                self.audio_stream = sd.InputStream(
-                    samplerate=self.sample_rate,
-                    channels=2,
-                    callback=self.audio_callback
-                )
-                self.audio_stream.start()
+            # Снимок сцены прошлого сеанса мог устареть (и сцена - быть удалена)
+            with self.record_output_lock:
+                self.record_transition.reset()
+            
+            # Начинаем запись аудио, если включено: все дорожки сводятся в WAV рядом с видео
+            scene = self.scenes[self.current_scene_index]
+            if scene.audio_enabled:
+                tracks = self.create_audio_tracks(scene)
+                if tracks:
+                    mixer = AudioMixer(tracks, os.path.splitext(filepath)[0] + ".wav",
+                                       self.sample_rate, scene.audio_stems,
+                                       AudioDSPConfig(scene.audio_dsp))
+                    mixer.start()
+                    self.audio_mixer = mixer
+                    if self.meter_timer is None:
+                        self.update_audio_meters()
             
             # Запускаем поток записи
-            self.recording_thread = threading.Thread(target=self.recording_worker, daemon=True)
+            self.recording_thread = threading.Thread(target=self.recording_worker, daemon=True, name="recording")
             self.recording_thread.start()
             
             # Обновляем интерфейс
@@ -2308,6 +6189,9 @@ class RecordStudio:
             
         except Exception as e:
             self.is_recording = False
+            self.recording_path = None
+            if self.job_queue is not None:
+                self.job_queue.set_throttled(False)
             messagebox.showerror("Ошибка", f"Не удалось начать запись: {str(e)}")
             self.status_label.config(text="Ошибка начала записи", foreground="red")
     
@@ -2315,16 +6199,37 @@ class RecordStudio:
         """Останавливает запись"""
         self.is_recording = False
         
-        # Останавливаем аудиопоток
-        if self.audio_stream is not None:
-            self.audio_stream.stop()
-            self.audio_stream.close()
-            self.audio_stream = None
+        # Останавливаем аудио
+        if self.audio_mixer is not None:
+            self.audio_mixer.stop()
+            self.audio_mixer = None
+        
+        # Дожидаемся последнего кадра потока записи, чтобы файл был дописан
+        # до регистрации в библиотеке и постобработки
+        if self.recording_thread is not None and self.recording_thread.is_alive():
+            self.recording_thread.join(timeout=2.0)
+        self.recording_thread = None
+        
+        # Закрываем видеописатель; замок - на случай, если поток не успел завершиться
+        with self.record_output_lock:
+            if self.video_writer is not None:
+                self.video_writer.release()
+                self.video_writer = None
+        
+        # Заносим запись в библиотеку
+        if self.library is not None and self.recording_path:
+            try:
+                self.library.register(self.recording_path, self.scenes[self.current_scene_index].name)
+            except Exception as e:
+                print(f"Ошибка добавления записи в библиотеку: {e}")
+            self.refresh_library()
         
-        # Закрываем видеописатель
-        if self.video_writer is not None:
-            self.video_writer.release()
-            self.video_writer = None
+        # Ставим готовый файл в очередь постобработки
+        if self.job_queue is not None:
+            if self.recording_path and os.path.exists(self.recording_path):
+                self.job_queue.add_recording(self.recording_path, self.postprocess_options)
+            self.job_queue.set_throttled(False)
+        self.recording_path = None
         
         # Останавливаем таймер
         if self.recording_timer:
@@ -2343,6 +6248,8 @@ class RecordStudio:
             return
             
         self.is_paused = not self.is_paused
+        if self.audio_mixer is not None:
+            self.audio_mixer.paused = self.is_paused
         
         if self.is_paused:
             self.pause_start_time = time.time()
@@ -2353,40 +6260,99 @@ class RecordStudio:
             self.pause_button.config(text="⏸ ПАУЗА")
             self.status_label.config(text="Запись...", foreground="#e74c3c")
     
-    def audio_callback(self, indata, frames, time, status):
-        """Callback функция для записи аудио"""
-        if status:
-            print(f"Аудио ошибка: {status}")
-        self.audio_data.put(indata.copy())
+    def create_audio_tracks(self, scene):
+        """Создает дорожки записи по настройкам сцены, пропуская недоступные устройства"""
+        tracks = []
+        for slot, config in enumerate(scene.audio_tracks):
+            try:
+                tracks.append(AudioTrack(config.get("name", "Дорожка"), config.get("device"),
+                                         config.get("gain", 1.0), config.get("muted", False), slot,
+                                         config.get("dsp", slot == 0)))
+            except Exception as e:
+                print(f"Ошибка открытия аудиоустройства {config.get('device')}: {e}")
+        return tracks
+    
+    def overlay_context(self, scene, frame_index):
+        """Значения полей шаблонного текста для кадра frame_index выхода"""
+        elapsed = 0
+        if self.is_recording and self.recording_start_time is not None:
+            elapsed = time.time() - self.recording_start_time - self.total_paused_time
+            if self.is_paused and self.pause_start_time is not None:
+                elapsed -= time.time() - self.pause_start_time
+        return {"elapsed": max(0, elapsed), "scene": scene.name, "frame": frame_index}
+    
+    def render_record_frame(self, sct):
+        """Собирает кадр в разрешении записи вместе с наложениями"""
+        # Захватываем сцену в разрешении записи
+        self.monitor_layout.refresh_if_changed()
+        scene = self.scene_snapshot  # Один снимок сцены на весь кадр
+        self.record_frame_index += 1
+        frame_index = self.record_frame_index
+        frame = self.record_transition.render(
+            scene, lambda snapshot, target: self.render_scene_frame(sct, snapshot, frame_index, target))
+        
+        if frame is not None:
+            # Добавляем индикатор записи
+            if self.is_recording:
+                cv2.putText(frame, "REC", (10, 30), 
+                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+                if self.is_paused:
+                    cv2.putText(frame, "PAUSED", (10, 60), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+        return frame
+    
+    def render_scene_frame(self, sct, scene, frame_index, target=None):
+        """Собирает кадр одной сцены в разрешении записи с ее наложениями.
+
+        Наложения рисуются в отдельном буфере (target или record_frame):
+        холст компоновщика остается чистым, и если источник сцены еще не
+        дал кадр (в том числе новой сцены во время перехода), на удержанный
+        кадр не ложатся наложения предыдущего. Без видимых наложений и без
+        target возвращается сам холст, без копирования.
+        """
+        canvas = self.capture_screen(sct, scene)
+        if canvas is None:
+            return None
+        visible = (any(obj.visible for obj in scene.text_objects) or
+                   any(obj.visible for obj in scene.image_objects))
+        if target is None and not visible:
+            return canvas
+        frame = self.record_frame if target is None else target
+        np.copyto(frame, canvas)
+        if visible:
+            self.record_overlays.apply(frame, scene.text_objects, scene.image_objects,
+                                       self.overlay_context(scene, frame_index), self.compose_tiles)
+        return frame
     
     def recording_worker(self):
         """Рабочая функция для потока записи"""
+        # Создаем отдельный экземпляр MSS для этого потока
+        thread_sct = None
+        try:
+            thread_sct = mss.mss()
+        except Exception as e:
+            print(f"Ошибка инициализации MSS в потоке записи: {e}")
+            
         while self.is_recording:
             if not self.is_paused:
                 try:
-                    # Захватываем экран или окно
-                    frame = self.capture_screen()
-                    
-                    if frame is not None:
-                        # Изменяем размер до Full HD (если необходимо)
-                        if frame.shape[0] != 1080 or frame.shape[1] != 1920:
-                            frame = cv2.resize(frame, (1920, 1080))
+                    with self.record_output_lock:
+                        slot = self.record_latency.begin()
+                        frame = self.render_record_frame(thread_sct)
                         
-                        # Накладываем текстовые объекты
-                        scene = self.scenes[self.current_scene_index]
-                        frame = self.apply_text_overlays(frame, scene.text_objects)
-                        
-                        # Добавляем индикатор записи
-                        if self.is_recording:
-                            cv2.putText(frame, "REC", (10, 30), 
-                                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                            if self.is_paused:
-                                cv2.putText(frame, "PAUSED", (10, 60), 
-                                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-                        
-                        # Записываем кадр
-                        if self.video_writer is not None:
-                            self.video_writer.write(frame)
+                        if frame is not None:
+                            self.record_latency.mark(slot, "composited")
+                            # Записываем кадр
+                            if self.video_writer is not None:
+                                self.record_latency.mark(slot, "encoder")
+                                self.video_writer.write(frame)
+                                self.record_latency.mark(slot, "written")
+                            
+                            # Пока идет запись, буфер повтора питается ее кадрами;
+                            # сжимает их поток буфера повтора
+                            replay_buffer = self.replay_buffer
+                            if replay_buffer is not None and replay_buffer.active:
+                                replay_buffer.offer_frame(frame, time.monotonic())
                     
                     # Небольшая задержка для контроля FPS
                     time.sleep(0.03)  # ~30 FPS
@@ -2396,6 +6362,133 @@ class RecordStudio:
                     time.sleep(0.1)
             else:
                 time.sleep(0.1)  # Пауза
+        
+        if thread_sct is not None:
+            try:
+                thread_sct.close()
+            except:
+                pass
+    
+    def toggle_replay_buffer(self):
+        """Включает или выключает буфер повтора"""
+        if self.replay_buffer is not None and self.replay_buffer.active:
+            self.stop_replay_buffer()
+        else:
+            self.start_replay_buffer()
+    
+    def start_replay_buffer(self):
+        """Запускает накопление последних секунд в памяти"""
+        try:
+            self.replay_buffer = ReplayBuffer(self.replay_seconds, self.replay_budget_mb)
+            self.replay_buffer.active = True
+            if not self.is_recording:
+                with self.record_output_lock:
+                    self.record_transition.reset()
+            
+            # Аудио сводится из дорожек сцены с их усилением и обработкой;
+            # без аудио буфер повтора все равно работает
+            scene = self.scenes[self.current_scene_index]
+            if scene.audio_enabled:
+                tracks = self.create_audio_tracks(scene)
+                if tracks:
+                    mixer = AudioMixer(tracks, None, self.sample_rate,
+                                       dsp_config=AudioDSPConfig(scene.audio_dsp),
+                                       sink=self.replay_buffer.push_audio)
+                    try:
+                        mixer.start()
+                        self.replay_audio_mixer = mixer
+                    except Exception as e:
+                        print(f"Ошибка запуска аудио буфера повтора: {e}")
+            
+            self.replay_thread = threading.Thread(target=self.replay_worker, daemon=True, name="replay")
+            self.replay_thread.start()
+            
+            self.replay_button.config(text=f"⟲ ВЫКЛ. ПОВТОР ({self.hotkeys['toggle_replay']})")
+            self.save_replay_button.config(state="normal")
+            self.status_label.config(text=f"Буфер повтора: последние {self.replay_seconds} с", foreground="#3498db")
+        except Exception as e:
+            self.stop_replay_buffer()
+            messagebox.showerror("Ошибка", f"Не удалось запустить буфер повтора: {str(e)}")
+    
+    def stop_replay_buffer(self):
+        """Останавливает буфер повтора и освобождает память"""
+        if self.replay_buffer is not None:
+            self.replay_buffer.active = False
+        
+        if self.replay_audio_mixer is not None:
+            self.replay_audio_mixer.stop()
+            self.replay_audio_mixer = None
+        
+        if self.replay_thread and self.replay_thread.is_alive():
+            self.replay_thread.join(timeout=2.0)
+        self.replay_thread = None
+        
+        if self.replay_buffer is not None:
+            self.replay_buffer.clear()
+            self.replay_buffer = None
+        
+        self.replay_button.config(text=f"⟲ ПОВТОР ({self.hotkeys['toggle_replay']})")
+        self.save_replay_button.config(state="disabled")
+    
+    def replay_worker(self):
+        """Захватывает кадры для буфера повтора, пока не идет запись"""
+        thread_sct = None
+        try:
+            thread_sct = mss.mss()
+        except Exception as e:
+            print(f"Ошибка инициализации MSS в потоке буфера повтора: {e}")
+        
+        replay_buffer = self.replay_buffer
+        while replay_buffer.active:
+            # Во время записи (кроме паузы) кадры в буфер подает recording_worker,
+            # а этот поток их сжимает
+            if self.is_recording and not self.is_paused:
+                replay_buffer.encode_pending(timeout=0.1)
+                continue
+            try:
+                while replay_buffer.encode_pending():
+                    pass  # Кадры, оставшиеся от записи, идут раньше новых
+                with self.record_output_lock:
+                    # Запись могла начаться или продолжиться, пока ждали замок
+                    if not (self.is_recording and not self.is_paused):
+                        frame = self.render_record_frame(thread_sct)
+                        if frame is not None:
+                            replay_buffer.push_frame(frame, time.monotonic())
+                time.sleep(0.03)  # ~30 FPS
+            except Exception as e:
+                print(f"Ошибка захвата кадра буфера повтора: {e}")
+                time.sleep(0.1)
+        
+        if thread_sct is not None:
+            try:
+                thread_sct.close()
+            except:
+                pass
+    
+    def save_replay(self):
+        """Сохраняет содержимое буфера повтора в файл в фоновом потоке"""
+        if self.replay_buffer is None or not self.replay_buffer.active:
+            return
+        frames, audio = self.replay_buffer.snapshot()
+        if not frames:
+            self.status_label.config(text="Буфер повтора пуст", foreground="orange")
+            return
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filepath = os.path.join(self.save_path, f"replay_{timestamp}.avi")
+        
+        def worker():
+            try:
+                save_replay_file(frames, audio, filepath, self.sample_rate, self.record_size)
+                self.root.after(0, lambda: self.status_label.config(
+                    text=f"Повтор сохранен: {os.path.basename(filepath)}", foreground="#2ecc71"))
+            except Exception as e:
+                print(f"Ошибка сохранения повтора: {e}")
+                self.root.after(0, lambda: self.status_label.config(
+                    text="Ошибка сохранения повтора", foreground="red"))
+        
+        threading.Thread(target=worker, daemon=True).start()
+        self.status_label.config(text="Сохранение повтора...", foreground="#3498db")
     
     def update_timer(self):
         """Обновляет таймер записи"""
@@ -2427,16 +6520,27 @@ class RecordStudio:
     
     def cleanup(self):
         """Очистка ресурсов"""
+        self.stop_profiling()
         self.stop_preview_thread()
         
-        # Закрываем камеру
-        if self.camera is not None:
-            self.camera.release()
+        # Останавливаем буфер повтора
+        if self.replay_buffer is not None:
+            self.stop_replay_buffer()
+        
+        # Закрываем камеры и другие источники
+        self.source_pool.close_all()
+        if self.compose_tiles is not None:
+            self.compose_tiles.shutdown()
+        
+        # Останавливаем постобработку (незавершенные задания продолжатся при следующем запуске)
+        if self.job_queue is not None:
+            self.job_queue.shutdown()
+            self.job_queue = None
         
-        # Останавливаем аудиопоток
-        if self.audio_stream is not None:
-            self.audio_stream.stop()
-            self.audio_stream.close()
+        # Останавливаем аудио
+        if self.audio_mixer is not None:
+            self.audio_mixer.stop()
+            self.audio_mixer = None
         
         # Сохраняем настройки и сцены
         self.save_settings()
@@ -2469,4 +6573,5 @@ def main():
         messagebox.showerror("Ошибка", f"Произошла критическая ошибка: {str(e)}")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# main.py лежит в корне репозитория, рядом с папкой тестов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+main = pytest.importorskip("main")
+
+
+def write_cube(path, size, mapping, header=""):
+    """Пишет .cube: mapping(r, g, b) -> (r, g, b) в долях 0..1; красный меняется быстрее всего"""
+    lines = [header, f"LUT_3D_SIZE {size}"]
+    for b in range(size):
+        for g in range(size):
+            for r in range(size):
+                rgb = mapping(r / (size - 1), g / (size - 1), b / (size - 1))
+                lines.append(" ".join(f"{value:.6f}" for value in rgb))
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def random_frame(channels=3):
+    return np.random.default_rng(1).integers(0, 256, (90, 160, channels), dtype=np.uint8)
+
+
+def test_cube_is_parsed_with_blue_green_red_axes(tmp_path):
+    path = write_cube(tmp_path / "identity.cube", 2, lambda r, g, b: (r, g, b),
+                      header='TITLE "test"\n# комментарий\nDOMAIN_MIN 0 0 0\nDOMAIN_MAX 1 1 1')
+    table, domain_min, domain_max = main.load_cube_lut(path, 1.0)
+    assert table.shape == (2, 2, 2, 3)
+    assert table[0, 0, 1].tolist() == [1.0, 0.0, 0.0]  # [b, g, r] -> RGB
+    assert table[1, 0, 0].tolist() == [0.0, 0.0, 1.0]
+    assert domain_min.tolist() == [0.0, 0.0, 0.0] and domain_max.tolist() == [1.0, 1.0, 1.0]
+
+
+def test_one_dimensional_cube_is_rejected(tmp_path):
+    path = tmp_path / "curve.cube"
+    path.write_text("LUT_1D_SIZE 2\n0 0 0\n1 1 1\n", encoding="utf-8")
+    with pytest.raises(RuntimeError):
+        main.load_cube_lut(str(path), 1.0)
+
+
+def test_truncated_cube_is_rejected(tmp_path):
+    path = tmp_path / "short.cube"
+    path.write_text("LUT_3D_SIZE 2\n0 0 0\n1 1 1\n", encoding="utf-8")
+    with pytest.raises(RuntimeError):
+        main.load_cube_lut(str(path), 1.0)
+
+
+def test_default_parameters_are_identity():
+    assert main.ColorCorrection(0, 1.0, 1.0).identity
+
+
+@pytest.mark.parametrize("channels", [3, 4])
+def test_identity_cube_keeps_the_frame(tmp_path, channels):
+    path = write_cube(tmp_path / "identity.cube", 17, lambda r, g, b: (r, g, b))
+    correction = main.ColorCorrection(0, 1.0, 1.0, path, 1.0)
+    frame = random_frame(channels)
+    graded = correction.apply(frame, main.FrameBufferPool(), "test")
+    assert graded.shape == frame.shape[:2] + (3,)
+    assert np.abs(graded.astype(np.int16) - frame[..., :3]).max() <= 1
+
+
+def test_cube_table_is_indexed_per_channel(tmp_path):
+    path = write_cube(tmp_path / "swap.cube", 9, lambda r, g, b: (b, g, r))
+    correction = main.ColorCorrection(0, 1.0, 1.0, path, 1.0)
+    frame = random_frame()
+    tiles = main.TilePool(3)
+    try:
+        graded = correction.apply(frame, main.FrameBufferPool(), "test", tiles)
+    finally:
+        tiles.shutdown()
+    assert np.abs(graded.astype(np.int16) - frame[..., ::-1]).max() <= 1
+
+
+def test_zero_saturation_gives_grey():
+    graded = main.ColorCorrection(0, 1.0, 0.0).apply(random_frame(), main.FrameBufferPool(), "test")
+    assert np.abs(graded[..., 0].astype(np.int16) - graded[..., 2]).max() <= 1
+
+
+def test_brightness_and_contrast_use_the_curve():
+    correction = main.ColorCorrection(20, 1.5, 1.0)
+    frame = random_frame()
+    graded = correction.apply(frame, main.FrameBufferPool(), "test")
+    assert np.array_equal(graded, correction.curve[frame])
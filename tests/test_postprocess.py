@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+main = pytest.importorskip("main")
+
+ALL_JOBS = {"thumbnail": True, "mux": True, "checksum": True, "transcode": True}
+
+
+def paused_queue(folder):
+    """Очередь, которая не запускает задания (как во время записи)"""
+    queue = main.PostProcessQueue(str(folder), max_workers=1)
+    queue.set_throttled(True)
+    return queue
+
+
+def test_pending_jobs_survive_a_restart(tmp_path):
+    queue = paused_queue(tmp_path)
+    try:
+        queue.add_recording(str(tmp_path / "record_1.avi"), ALL_JOBS)
+    finally:
+        queue.shutdown()
+
+    restored = paused_queue(tmp_path)
+    try:
+        jobs = {job["kind"]: job for job in restored.jobs.values()}
+        assert sorted(jobs) == ["checksum", "mux", "thumbnail", "transcode"]
+        assert all(job["status"] == "pending" for job in jobs.values())
+        assert jobs["transcode"]["depends"] == jobs["checksum"]["id"]
+        assert restored.next_id == max(restored.jobs) + 1
+        with restored.lock:
+            assert restored.next_job()["kind"] == "thumbnail"  # Самый высокий приоритет
+    finally:
+        restored.shutdown()
+
+
+def test_jobs_interrupted_while_running_are_queued_again(tmp_path):
+    state = [{"id": 7, "kind": "checksum", "args": ["a.avi", "a.avi.sha256"], "depends": None,
+              "priority": main.JOB_PRIORITIES["checksum"], "status": "running", "error": None}]
+    with open(os.path.join(tmp_path, main.PostProcessQueue.STATE_FILE), "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+    queue = paused_queue(tmp_path)
+    try:
+        assert queue.jobs[7]["status"] == "pending"
+        assert queue.next_id == 8
+        with queue.lock:
+            assert queue.next_job()["id"] == 7
+    finally:
+        queue.shutdown()
+
+
+def test_dependent_job_waits_for_its_dependency(tmp_path):
+    queue = paused_queue(tmp_path)
+    try:
+        checksum = queue.add("checksum", ["a.avi", "a.avi.sha256"])
+        queue.add("transcode", ["a.avi", "a.wav", "a.mp4"], depends=checksum)
+        with queue.lock:
+            first = queue.next_job()
+            first["status"] = "running"
+            assert first["id"] == checksum
+            assert queue.next_job() is None
+    finally:
+        queue.shutdown()
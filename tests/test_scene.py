@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+main = pytest.importorskip("main")
+
+
+def legacy_scene(**fields):
+    """Сцена из файла, сохраненного до смещений от центра (без ключа 'offsets')"""
+    data = {"name": "Сцена"}
+    data.update(fields)
+    return main.Scene.from_dict(data)
+
+
+def test_legacy_top_left_corner_becomes_centre_offset():
+    scene = legacy_scene(screen_scale=0.5, screen_offset_x=0, screen_offset_y=0)
+    assert (scene.screen_offset_x, scene.screen_offset_y) == (-480, -270)
+
+
+def test_migrated_offset_keeps_the_old_placement():
+    scene = legacy_scene(screen_scale=0.5, screen_offset_x=200, screen_offset_y=100)
+    transform = main.FrameTransform(main.LEGACY_SCREEN_SPACE, main.REFERENCE_SIZE, scene.screen_scale,
+                                    scene.screen_offset_x, scene.screen_offset_y)
+    assert transform.dst_rect == (200, 100, 1160, 640)
+
+
+def test_legacy_corner_is_clamped_to_the_screen():
+    scene = legacy_scene(screen_scale=0.5, screen_offset_x=5000, screen_offset_y=-10)
+    assert (scene.screen_offset_x, scene.screen_offset_y) == (480, -270)
+
+
+def test_legacy_full_size_screen_is_centred():
+    scene = legacy_scene(screen_offset_x=100, screen_offset_y=50)
+    assert (scene.screen_offset_x, scene.screen_offset_y) == (0, 0)
+
+
+def test_centred_offsets_survive_a_round_trip():
+    scene = main.Scene("Сцена")
+    scene.screen_scale = 0.5
+    scene.screen_offset_x, scene.screen_offset_y = -120, 35
+    restored = main.Scene.from_dict(json.loads(json.dumps(scene.to_dict())))
+    assert (restored.screen_offset_x, restored.screen_offset_y) == (-120, 35)
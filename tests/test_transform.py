@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+main = pytest.importorskip("main")
+
+OUT_SIZE = (1280, 720)
+
+
+def gradient(width, height, channels):
+    """Гладкий кадр с шумом: и края, и плавные переходы"""
+    rng = np.random.default_rng(width * height + channels)
+    y, x = np.mgrid[0:height, 0:width]
+    image = np.empty((height, width, channels), dtype=np.uint8)
+    for channel in range(channels):
+        image[..., channel] = (x * (channel + 1) + y * 2) % 256
+    noise = rng.integers(0, 32, image.shape, dtype=np.uint8)
+    return image // 2 + noise
+
+
+@pytest.mark.parametrize("channels", [3, 4])
+@pytest.mark.parametrize("src_size, scale, offset", [
+    ((1920, 1080), 1.0, (0, 0)),    # уменьшение
+    ((640, 360), 1.0, (0, 0)),      # увеличение
+    ((1280, 720), 1.0, (0, 0)),     # без масштабирования
+    ((1000, 700), 1.5, (300, -200)),  # частично за краем холста
+])
+def test_tiled_transfer_matches_serial(channels, src_size, scale, offset):
+    src = gradient(src_size[0], src_size[1], channels)
+    transform = main.FrameTransform(src_size, OUT_SIZE, scale, *offset)
+    serial = np.zeros((OUT_SIZE[1], OUT_SIZE[0], 3), dtype=np.uint8)
+    tiled = np.zeros_like(serial)
+
+    transform.apply(src, serial, main.FrameBufferPool())
+    tiles = main.TilePool(4)
+    try:
+        transform.apply(src, tiled, main.FrameBufferPool(), tiles=tiles)
+    finally:
+        tiles.shutdown()
+
+    # warpAffine и resize округляют коэффициенты интерполяции по-разному
+    difference = np.abs(serial.astype(np.int16) - tiled.astype(np.int16))
+    assert difference.max() <= 2
+
+
+def test_bands_cover_the_height_without_gaps():
+    tiles = main.TilePool(4)
+    try:
+        bands = tiles.bands(1080)
+    finally:
+        tiles.shutdown()
+    assert bands[0][0] == 0 and bands[-1][1] == 1080
+    assert all(previous[1] == current[0] for previous, current in zip(bands, bands[1:]))